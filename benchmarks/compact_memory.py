@@ -0,0 +1,62 @@
+"""
+Compare the memory held by full raw tweets and by compact RawTweet records.
+
+Generates tweets shaped like the responses of the twitter api (statuses/user_timeline,
+tweet_mode=extended, including the full user object and entities), decodes them from
+JSON like the extract phase does and measures with tracemalloc:
+    - full: the decoded tweet dicts
+    - compact: the RawTweet records (transform.compact_data), after the dicts are dropped
+    - peak: the highest allocation during decoding and compacting
+
+Run it from the repository root:
+    python benchmarks/compact_memory.py --tweets 20000
+"""
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tweetpipe"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+import django
+
+django.setup()
+
+from transform import compact_data
+from tweets import raw_data
+
+
+def measure(count):
+    encoded = json.dumps(raw_data(count))
+
+    tracemalloc.start()
+    data = json.loads(encoded)
+    full, _ = tracemalloc.get_traced_memory()
+    compacted = compact_data(data)
+    del data
+    compact, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(compacted["tweets"]) == count
+    return full, compact, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tweets", type=int, default=20000)
+    args = parser.parse_args()
+
+    full, compact, peak = measure(args.tweets)
+    mib = 1024 * 1024
+    print(f"tweets:  {args.tweets}")
+    print(f"full:    {full / mib:8.1f} MiB ({full / args.tweets:6.0f} B/tweet)")
+    print(f"compact: {compact / mib:8.1f} MiB ({compact / args.tweets:6.0f} B/tweet)")
+    print(f"peak:    {peak / mib:8.1f} MiB (decoding and compacting)")
+    print(f"saved:   {1 - compact / full:8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare the throughput of the installed json codecs (tweetpipe/codec.py).
+
+Encodes and decodes raw data shaped like the output of the extract phase and reports the
+MB/s of dumps (compact and indented), loads and canonical per codec. canonical is
+measured for ASCII tweets and for tweets with non-ASCII text, which have to be escaped.
+
+Run it from the repository root:
+    python benchmarks/json_codecs.py --tweets 2000 --repeat 5
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tweetpipe"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+import codec
+from tweets import raw_data
+
+
+def non_ascii(data):
+    suffix = " Grüße aus Köln 🎉"
+    return {
+        "tweets": [
+            {**tweet, "full_text": tweet["full_text"] + suffix} for tweet in data["tweets"]
+        ]
+    }
+
+
+def throughput(function, argument, size, repeat):
+    """MB/s of the fastest of repeat calls"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        best = min(best, time.perf_counter() - start)
+    return size / best / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tweets", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = raw_data(args.tweets)
+    data_non_ascii = non_ascii(data)
+    columns = ["dumps", "indent", "loads", "canonical", "non-ascii"]
+    print(f"{'MB/s':8}" + "".join(f"{column:>10}" for column in columns))
+    for name, available in codec.AVAILABLE_CODECS.items():
+        if not available:
+            continue
+        json_codec = codec.get_codec(name)
+        encoded = json_codec.dumps(data)
+        size = len(encoded)
+        size_non_ascii = len(json_codec.dumps(data_non_ascii))
+        results = [
+            throughput(json_codec.dumps, data, size, args.repeat),
+            throughput(lambda obj: json_codec.dumps(obj, 2), data, size, args.repeat),
+            throughput(json_codec.loads, encoded, size, args.repeat),
+            throughput(json_codec.canonical, data, size, args.repeat),
+            throughput(
+                json_codec.canonical, data_non_ascii, size_non_ascii, args.repeat
+            ),
+        ]
+        print(f"{name:8}" + "".join(f"{result:10.0f}" for result in results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Measure how the ParallelLoader (tweetpipe/load.py) scales with its DB connections.
+
+Generates the tweets of several users, transforms them and loads them into the
+configured DB with the CopyLoader (one connection) and the ParallelLoader with 1, 2 and
+4 workers. Every load starts from empty tables (initial load); afterwards the same tweets
+are loaded again (reload, every row is updated). The tweets are sharded by user: with
+--users 1 all tweets end up in the same shard.
+
+The loaders commit their batches, the benchmark needs an empty DB (created and migrated
+with manage.py) and empties all tweetpipe tables after every load:
+    DB_NAME=tweetpipe_bench python benchmarks/parallel_load.py --users 8 --tweets 5000
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tweetpipe"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+import django
+
+django.setup()
+
+from django.db import connection
+
+from load import copy_load_data, parallel_load_data
+from models import Tweet
+from transform import get_transformed_data
+from tweets import raw_data
+
+LOADERS = {
+    "copy": copy_load_data,
+    "parallel (1)": lambda data: parallel_load_data(data, workers=1),
+    "parallel (2)": lambda data: parallel_load_data(data, workers=2),
+    "parallel (4)": lambda data: parallel_load_data(data, workers=4),
+}
+
+
+def truncate():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT tablename FROM pg_tables "
+            "WHERE schemaname = 'public' AND tablename LIKE 'tweetpipe\\_%%'"
+        )
+        tables = ", ".join(f'"{table}"' for (table,) in cursor.fetchall())
+        cursor.execute(f"TRUNCATE {tables} RESTART IDENTITY CASCADE")
+
+
+def transformed(users, tweets_per_user):
+    """Transformed tweets of all users, interleaved like the staged pipeline"""
+    per_user = [
+        list(
+            get_transformed_data(
+                raw_data(
+                    tweets_per_user,
+                    username=f"user{user}",
+                    user_id=1000 + user,
+                    first_id=user * tweets_per_user,
+                )
+            )
+        )
+        for user in range(users)
+    ]
+    return [data for tweets in zip(*per_user) for data in tweets]
+
+
+def timed(load, users, tweets_per_user):
+    # The loaders may modify the transformed tweets, transform them for every load
+    data = transformed(users, tweets_per_user)
+    start = time.perf_counter()
+    load(data)
+    return time.perf_counter() - start
+
+
+def run(users, tweets_per_user):
+    results = {}
+    try:
+        for name, load in LOADERS.items():
+            initial = timed(load, users, tweets_per_user)
+            reload = timed(load, users, tweets_per_user)
+            results[name] = (initial, reload)
+            truncate()
+    finally:
+        truncate()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--tweets", type=int, default=5000, help="tweets per user")
+    args = parser.parse_args()
+
+    if Tweet.objects.exists():
+        parser.error(f"{connection.settings_dict['NAME']} is not empty")
+    results = run(args.users, args.tweets)
+    total = args.users * args.tweets
+    print("\n###############################################")
+    print(f"{args.users} user(s) with {args.tweets} tweets each")
+    print("###############################################\n")
+    print(f"{'':14} {'initial':>10} {'tweets/s':>10} {'reload':>10} {'tweets/s':>10}")
+    for name, (initial, reload) in results.items():
+        print(
+            f"{name:14} {initial:>9.3f}s {total / initial:>10.0f} "
+            f"{reload:>9.3f}s {total / reload:>10.0f}"
+        )
+    print("\n###############################################\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Benchmark monthly range partitions against a single heap table.
+
+Generates the same tweet-like rows into two temporary tables, a plain one and one
+partitioned like tweetpipe_tweet (monthly on created_at), and compares:
+    - the bulk insert
+    - a date bounded aggregate over one month
+    - a date bounded lookup of a single user (index on user_id, created_at)
+
+Run it against the configured DB (only temporary tables are used):
+    python benchmarks/partition_benchmark.py --rows 5000000 --months 36
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tweetpipe"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+import django
+
+django.setup()
+
+from django.db import connection, transaction
+
+from partitions import add_months
+
+COLUMNS = "id bigint, created_at timestamptz, user_id bigint, full_text varchar(660)"
+
+GENERATE_ROWS = """
+INSERT INTO {table}
+SELECT
+    i,
+    %(start)s::timestamptz + (%(end)s::timestamptz - %(start)s::timestamptz) * ((i - 1)::float / %(rows)s),
+    (i::bigint * 7919) %% %(users)s,
+    repeat(md5(i::text), 4)
+FROM generate_series(1, %(rows)s) i
+"""
+
+QUERIES = {
+    "month aggregate": (
+        "SELECT count(*), avg(length(full_text)) FROM {table} "
+        "WHERE created_at >= %(month_start)s AND created_at < %(month_end)s"
+    ),
+    "user in month": (
+        "SELECT id, created_at FROM {table} WHERE user_id = %(user_id)s "
+        "AND created_at >= %(month_start)s AND created_at < %(month_end)s"
+    ),
+}
+
+
+def timed(cursor, sql, params, repeat=1):
+    """Best time of repeat executions"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        if cursor.description:
+            cursor.fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def create_tables(cursor, first_month, months):
+    cursor.execute(f"CREATE TEMP TABLE bench_plain ({COLUMNS}, PRIMARY KEY (id))")
+    cursor.execute(
+        f"CREATE TEMP TABLE bench_partitioned ({COLUMNS}, PRIMARY KEY (id, created_at)) "
+        "PARTITION BY RANGE (created_at)"
+    )
+    for offset in range(months):
+        month = add_months(first_month, offset)
+        cursor.execute(
+            f"CREATE TEMP TABLE bench_partitioned_p{month:%Y_%m} "
+            "PARTITION OF bench_partitioned FOR VALUES FROM (%s) TO (%s)",
+            [month, add_months(month, 1)],
+        )
+
+
+def run(rows, months, users, repeat):
+    first_month = add_months(date.today().replace(day=1), -months)
+    params = {
+        "start": first_month,
+        "end": add_months(first_month, months),
+        "rows": rows,
+        "users": users,
+        "month_start": add_months(first_month, months // 2),
+        "month_end": add_months(first_month, months // 2 + 1),
+        "user_id": users // 2,
+    }
+    results = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SET LOCAL TIME ZONE 'UTC'")
+        create_tables(cursor, first_month, months)
+        for table in ("bench_plain", "bench_partitioned"):
+            results[(table, "insert")] = timed(
+                cursor, GENERATE_ROWS.format(table=table), params
+            )
+            start = time.perf_counter()
+            cursor.execute(f"CREATE INDEX ON {table} (user_id, created_at)")
+            cursor.execute(f"ANALYZE {table}")
+            results[(table, "index + analyze")] = time.perf_counter() - start
+            for name, sql in QUERIES.items():
+                results[(table, name)] = timed(
+                    cursor, sql.format(table=table), params, repeat=repeat
+                )
+        # Temporary tables, nothing to keep
+        transaction.set_rollback(True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.rows, args.months, args.users, args.repeat)
+    print("\n###############################################")
+    print(f"{args.rows} rows over {args.months} months, {args.users} users")
+    print("###############################################\n")
+    print(f"{'':20} {'plain':>12} {'partitioned':>12}")
+    for step in ["insert", "index + analyze", *QUERIES]:
+        plain = results[("bench_plain", step)]
+        partitioned = results[("bench_partitioned", step)]
+        print(f"{step:20} {plain:>11.3f}s {partitioned:>11.3f}s")
+    print("\n###############################################\n")
+
+
+if __name__ == "__main__":
+    main()
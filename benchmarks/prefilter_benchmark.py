@@ -0,0 +1,110 @@
+"""
+Measure the prefilter (tweetpipe/prefilter.py) against the configured DB.
+
+Stores a share of generated tweets with the COPY loader, then transforms and loads the
+whole batch again per PREFILTER_POLICY, like a rerun over overlapping fetches:
+    - transform: prefilter (incl. the refresh of the known ids) and transformation
+    - load: COPY loading of the transformed tweets
+The known ids are read from the DB on the first batch (cold) and from PREFILTER_DIR on
+the following ones (warm).
+
+The loader commits its batches, the benchmark needs an empty DB (created and migrated
+with manage.py) and empties all tweetpipe tables afterwards:
+    DB_NAME=tweetpipe_bench python benchmarks/prefilter_benchmark.py --tweets 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tweetpipe"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+import django
+
+django.setup()
+
+from django.db import connection
+
+import prefilter
+from load import copy_load_data
+from models import Tweet
+from transform import get_transformed_data
+from tweets import raw_data
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def run_batch(data):
+    # get_transformed_data replaces the tweets of the batch
+    batch = {**data, "tweets": list(data["tweets"])}
+    transformed, transform_time = timed(lambda: list(get_transformed_data(batch)))
+    _, load_time = timed(lambda: copy_load_data(transformed))
+    return transform_time, load_time
+
+
+def truncate():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT tablename FROM pg_tables "
+            "WHERE schemaname = 'public' AND tablename LIKE 'tweetpipe\\_%%'"
+        )
+        tables = ", ".join(f'"{table}"' for (table,) in cursor.fetchall())
+        cursor.execute(f"TRUNCATE {tables} RESTART IDENTITY CASCADE")
+
+
+def run(count, known_share, repeat):
+    data = raw_data(count)
+    step = round(1 / (1 - known_share)) if known_share < 1 else 0
+    known = [
+        tweet for tweet in data["tweets"] if not step or tweet["id"] % step != step - 1
+    ]
+    results = {}
+    try:
+        copy_load_data(list(get_transformed_data({**data, "tweets": known})))
+        for policy in prefilter.POLICIES:
+            with tempfile.TemporaryDirectory() as directory:
+                prefilter._prefilter = prefilter.Prefilter(
+                    policy=policy, directory=Path(directory)
+                )
+                results[(policy, "cold")] = run_batch(data)
+                results[(policy, "warm")] = min(
+                    (run_batch(data) for _ in range(repeat)), key=sum
+                )
+    finally:
+        prefilter._prefilter = None
+        truncate()
+    return len(known), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tweets", type=int, default=5000)
+    parser.add_argument("--known", type=float, default=0.9)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if Tweet.objects.exists():
+        parser.error(f"{connection.settings_dict['NAME']} is not empty")
+    known, results = run(args.tweets, args.known, args.repeat)
+    print("\n###############################################")
+    print(f"{args.tweets} tweets, {known} already stored")
+    print("###############################################\n")
+    print(f"{'':22} {'transform':>10} {'load':>10} {'tweets/s':>10}")
+    for (policy, cache), (transform_time, load_time) in results.items():
+        total = transform_time + load_time
+        print(
+            f"{policy + ' (' + cache + ')':22} {transform_time:>9.3f}s "
+            f"{load_time:>9.3f}s {args.tweets / total:>10.0f}"
+        )
+    print("\n###############################################\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark the full text search (search.py) against the ILIKE scan it replaces.
+
+Generates tweet-like rows with random words (skewed, a few words are very common) into a
+temporary table, with a tsvector column computed like the trigger of migration 0006 and a
+GIN index, and compares for a common and a rare word:
+    - scan: full_text ILIKE '%word%', newest first (the search before the index)
+    - fts: search_vector @@ plainto_tsquery(word), ranked by ts_rank
+
+Run it against the configured DB (only temporary tables are used):
+    python benchmarks/search_benchmark.py --rows 5000000
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tweetpipe"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+import django
+
+django.setup()
+
+from django.db import connection, transaction
+
+from models import Tweet
+
+# Words are md5 prefixes with the digits replaced by letters, low numbers are common
+WORD = "translate(substr(md5({number}::text), 1, 8), '0123456789', 'ghijklmnop')"
+
+RANDOM_WORD = WORD.format(
+    number="(1 + floor(power(random(), 3) * %(vocabulary)s)::int)"
+)
+
+GENERATE_ROWS = f"""
+INSERT INTO bench_tweet
+SELECT i, (i::bigint * 7919) %% %(users)s, now() - i * interval '1 minute', full_text,
+    to_tsvector(%(config)s, full_text)
+FROM generate_series(1, %(rows)s) i,
+LATERAL (
+    SELECT string_agg({RANDOM_WORD}, ' ') AS full_text
+    FROM generate_series(1, %(words_per_tweet)s)
+    -- Correlated with i, evaluated for every row
+    WHERE i > 0
+) tweet
+"""
+
+QUERIES = {
+    "scan": (
+        "SELECT id FROM bench_tweet WHERE full_text ILIKE %(pattern)s "
+        "ORDER BY created_at DESC LIMIT %(limit)s"
+    ),
+    "fts": (
+        "SELECT id, ts_rank(search_vector, query) AS rank "
+        "FROM bench_tweet, plainto_tsquery(%(config)s, %(word)s) query "
+        "WHERE search_vector @@ query ORDER BY rank DESC, created_at DESC LIMIT %(limit)s"
+    ),
+}
+
+COUNT = "SELECT count(*) FROM bench_tweet WHERE search_vector @@ plainto_tsquery(%s, %s)"
+
+
+def word(number):
+    digest = hashlib.md5(str(number).encode()).hexdigest()[:8]
+    return digest.translate(str.maketrans("0123456789", "ghijklmnop"))
+
+
+def timed(cursor, sql, params, repeat=1):
+    """Best time of repeat executions"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        if cursor.description:
+            cursor.fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(rows, vocabulary, users, limit, repeat):
+    params = {
+        "rows": rows,
+        "vocabulary": vocabulary,
+        "users": users,
+        "words_per_tweet": 12,
+        "config": Tweet.search_config,
+        "limit": limit,
+    }
+    words = {"common": word(1), "rare": word(vocabulary - 1)}
+    results = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMP TABLE bench_tweet (id bigint PRIMARY KEY, user_id bigint, "
+            "created_at timestamptz, full_text varchar(660), search_vector tsvector)"
+        )
+        results["insert (incl. tsvector)"] = timed(cursor, GENERATE_ROWS, params)
+        start = time.perf_counter()
+        cursor.execute("CREATE INDEX ON bench_tweet USING gin (search_vector)")
+        cursor.execute("CREATE INDEX ON bench_tweet (created_at)")
+        cursor.execute("ANALYZE bench_tweet")
+        results["index + analyze"] = time.perf_counter() - start
+
+        for kind, search_word in words.items():
+            cursor.execute(COUNT, [Tweet.search_config, search_word])
+            (matches,) = cursor.fetchone()
+            query_params = {**params, "word": search_word, "pattern": f"%{search_word}%"}
+            for name, sql in QUERIES.items():
+                label = f"{name}: {kind} ({matches})"
+                results[label] = timed(cursor, sql, query_params, repeat=repeat)
+        # Temporary tables, nothing to keep
+        transaction.set_rollback(True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.rows, args.vocabulary, args.users, args.limit, args.repeat)
+    print("\n###############################################")
+    print(f"{args.rows} rows, {args.vocabulary} words, limit {args.limit}")
+    print("###############################################\n")
+    for step, elapsed in results.items():
+        print(f"{step:32} {elapsed * 1000:>12.1f} ms")
+    print("\n###############################################\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Tweets shaped like the responses of the twitter api, used by the benchmarks.
+
+The tweets have all fields of statuses/user_timeline (tweet_mode=extended), including
+the full user object and the entities.
+"""
+
+
+def api_tweet(tweet_id, user):
+    hashtags = [f"tag{tweet_id % 7}", f"topic{tweet_id % 13}"]
+    text = f"Tweet number {tweet_id} about " + " ".join(f"#{tag}" for tag in hashtags)
+    text += f" https://t.co/{tweet_id:010d}"
+    return {
+        "created_at": "Tue Jun 04 23:12:08 +0000 2019",
+        "id": tweet_id,
+        "id_str": str(tweet_id),
+        "full_text": text,
+        "truncated": False,
+        "display_text_range": [0, len(text) - 24],
+        "entities": {
+            "hashtags": [
+                {"text": tag, "indices": [20 + 8 * i, 26 + 8 * i]}
+                for i, tag in enumerate(hashtags)
+            ],
+            "symbols": [],
+            "user_mentions": [
+                {
+                    "screen_name": "alice",
+                    "name": "Alice",
+                    "id": 42,
+                    "id_str": "42",
+                    "indices": [0, 6],
+                }
+            ],
+            "urls": [
+                {
+                    "url": f"https://t.co/{tweet_id:010d}",
+                    "expanded_url": f"https://example.com/articles/{tweet_id}",
+                    "display_url": f"example.com/articles/{tweet_id}",
+                    "indices": [len(text) - 23, len(text)],
+                }
+            ],
+        },
+        "source": '<a href="https://mobile.twitter.com" rel="nofollow">Twitter Web App</a>',
+        "in_reply_to_status_id": None,
+        "in_reply_to_status_id_str": None,
+        "in_reply_to_user_id": None,
+        "in_reply_to_user_id_str": None,
+        "in_reply_to_screen_name": None,
+        "user": user,
+        "geo": None,
+        "coordinates": None,
+        "place": None,
+        "contributors": None,
+        "is_quote_status": False,
+        "retweet_count": tweet_id % 100,
+        "favorite_count": tweet_id % 1000,
+        "favorited": False,
+        "retweeted": False,
+        "possibly_sensitive": False,
+        "lang": "en",
+    }
+
+
+def api_user(username, user_id=1234567):
+    return {
+        "id": user_id,
+        "id_str": str(user_id),
+        "name": username.title(),
+        "screen_name": username,
+        "location": "Berlin, Germany",
+        "description": "Writing about data pipelines, databases and the occasional cat.",
+        "url": "https://t.co/abcdefghij",
+        "entities": {
+            "url": {
+                "urls": [
+                    {
+                        "url": "https://t.co/abcdefghij",
+                        "expanded_url": "https://example.com",
+                        "display_url": "example.com",
+                        "indices": [0, 23],
+                    }
+                ]
+            },
+            "description": {"urls": []},
+        },
+        "protected": False,
+        "followers_count": 15234,
+        "friends_count": 321,
+        "listed_count": 87,
+        "created_at": "Tue Jun 04 23:12:08 +0000 2009",
+        "favourites_count": 4567,
+        "utc_offset": None,
+        "time_zone": None,
+        "geo_enabled": False,
+        "verified": False,
+        "statuses_count": 9876,
+        "lang": None,
+        "contributors_enabled": False,
+        "is_translator": False,
+        "is_translation_enabled": False,
+        "profile_background_color": "000000",
+        "profile_background_image_url": "http://abs.twimg.com/images/themes/theme1/bg.png",
+        "profile_background_image_url_https": "https://abs.twimg.com/images/themes/theme1/bg.png",
+        "profile_background_tile": False,
+        "profile_image_url": "http://pbs.twimg.com/profile_images/1/photo_normal.jpg",
+        "profile_image_url_https": "https://pbs.twimg.com/profile_images/1/photo_normal.jpg",
+        "profile_banner_url": "https://pbs.twimg.com/profile_banners/1234567/1559689928",
+        "profile_link_color": "1B95E0",
+        "profile_sidebar_border_color": "000000",
+        "profile_sidebar_fill_color": "000000",
+        "profile_text_color": "000000",
+        "profile_use_background_image": False,
+        "has_extended_profile": True,
+        "default_profile": False,
+        "default_profile_image": False,
+        "following": False,
+        "follow_request_sent": False,
+        "notifications": False,
+        "translator_type": "none",
+    }
+
+
+def raw_data(count, username="bob", user_id=1234567, first_id=0):
+    """Raw data as written by the extract phase (see extract.Tweets.enhance_data)"""
+    user = api_user(username, user_id)
+    metadata = {
+        "fetched_at": "Wed Jun 05 00:00:00 +0000 2019",
+        "username": username,
+        "count": count,
+    }
+    tweets = [
+        {**api_tweet(i, user), "tweetpipe_metadata": metadata}
+        for i in range(first_id, first_id + count)
+    ]
+    return {"tweets": tweets}
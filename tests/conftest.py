@@ -0,0 +1,69 @@
+"""
+Shared setup of the tests.
+
+The modules of tweetpipe import each other as top level modules (like the CLI does),
+the tweetpipe directory is therefore added to sys.path. Run the tests from the
+repository root: python -m pytest
+
+Tests using the db fixture run against a fresh test database (test_<DB_NAME>), which
+is migrated with manage.py. They are skipped if postgres is not reachable.
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import django
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(ROOT_DIR / "tweetpipe"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+os.environ.setdefault("DJANGO_SECRET_KEY", "tweetpipe-tests")
+django.setup()
+
+
+@pytest.fixture(scope="session")
+def django_db():
+    """Create and migrate the test database once per session"""
+    from django.db import OperationalError, connection
+
+    try:
+        connection.ensure_connection()
+    except OperationalError as e:
+        pytest.skip(f"postgres is not available: {e}")
+
+    old_name = connection.settings_dict["NAME"]
+    test_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False
+    )
+    # The tweetpipe app is only installed for manage.py (see config/settings.py)
+    subprocess.run(
+        [sys.executable, "manage.py", "migrate", "--verbosity", "0"],
+        cwd=ROOT_DIR,
+        env={
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": "tweetpipe.config.settings",
+            "DB_NAME": test_name,
+        },
+        check=True,
+    )
+    yield
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+@pytest.fixture
+def db(django_db):
+    """Empty all tweetpipe tables after the test"""
+    from django.db import connection
+
+    yield
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT tablename FROM pg_tables "
+            "WHERE schemaname = 'public' AND tablename LIKE 'tweetpipe\\_%%'"
+        )
+        tables = ", ".join(f'"{table}"' for (table,) in cursor.fetchall())
+        cursor.execute(f"TRUNCATE {tables} RESTART IDENTITY CASCADE")
+
@@ -0,0 +1,42 @@
+"""Raw and transformed data used by the tests"""
+
+
+def raw_tweet(tweet_id, user_id=1, screen_name="bob", hashtags=(), **fields):
+    """Minimal raw tweet as returned by the twitter api (tweet_mode=extended)"""
+    tweet = {
+        "id": tweet_id,
+        "created_at": "Tue Jun 04 23:12:08 +0000 2019",
+        "full_text": "hello " + " ".join(f"#{hashtag}" for hashtag in hashtags),
+        "retweet_count": 1,
+        "favorite_count": 2,
+        "lang": "en",
+        "entities": {
+            "hashtags": [{"text": hashtag, "indices": [0, 1]} for hashtag in hashtags],
+            "urls": [],
+        },
+        "user": {
+            "id": user_id,
+            "screen_name": screen_name,
+            "name": screen_name.title(),
+            "created_at": "Tue Jun 04 23:12:08 +0000 2009",
+            "followers_count": 10,
+            "friends_count": 3,
+            "favourites_count": 4,
+            "lang": "en",
+            "description": "",
+        },
+    }
+    tweet.update(fields)
+    # Without a link (tweet_url is empty)
+    tweet.setdefault("display_text_range", [0, len(tweet["full_text"])])
+    return tweet
+
+
+def with_metadata(raw_tweets, username="bob", fetched_at="Wed Jun 05 00:00:00 +0000 2019"):
+    """Raw data as written by the extract phase (see extract.Tweets.enhance_data)"""
+    metadata = {
+        "fetched_at": fetched_at,
+        "username": username,
+        "count": len(raw_tweets),
+    }
+    return {"tweets": [{**tweet, "tweetpipe_metadata": metadata} for tweet in raw_tweets]}
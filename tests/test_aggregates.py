@@ -0,0 +1,88 @@
+from datetime import date
+from importlib import import_module
+
+import pytest
+from django.db import connection
+
+import aggregates
+from load import copy_load_data, load_data
+from models import DailyFollowerCount, DailyHashtagCount
+from tests.factories import raw_tweet, with_metadata
+from transform import get_transformed_data
+
+# (fetched_at, followers_count), in the order they are loaded
+FETCHES = [
+    ("Wed Jun 05 12:00:00 +0000 2019", 30),
+    # June 5th in Europe/Berlin, loaded after a later fetch of the same day
+    ("Tue Jun 04 22:30:00 +0000 2019", 10),
+    ("Wed Jun 05 06:00:00 +0000 2019", 20),
+    # June 6th in Europe/Berlin
+    ("Wed Jun 05 22:30:00 +0000 2019", 25),
+]
+
+
+def fetch(fetched_at, followers_count, hashtags=()):
+    tweet = raw_tweet(1, hashtags=hashtags)
+    tweet["user"]["followers_count"] = followers_count
+    return list(get_transformed_data(with_metadata([tweet], fetched_at=fetched_at)))
+
+
+@pytest.fixture
+def today(monkeypatch):
+    monkeypatch.setattr(aggregates.timezone, "localdate", lambda: date(2019, 6, 6))
+
+
+def daily_follower_counts():
+    return list(
+        DailyFollowerCount.objects.order_by("date").values_list(
+            "date", "first_count", "last_count"
+        )
+    )
+
+
+@pytest.mark.parametrize("load", [load_data, copy_load_data])
+def test_daily_follower_counts_and_growth(db, today, load):
+    for fetched_at, followers_count in FETCHES:
+        load(fetch(fetched_at, followers_count))
+    # Loading a fetch again does not change the counts
+    load(fetch(*FETCHES[0]))
+
+    assert daily_follower_counts() == [
+        (date(2019, 6, 5), 10, 30),
+        (date(2019, 6, 6), 25, 25),
+    ]
+    # The first day with data shows the change during that day
+    assert aggregates.follower_growth(usernames=["BOB"]) == {
+        "bob": [(date(2019, 6, 5), 30, 20), (date(2019, 6, 6), 25, -5)]
+    }
+    assert aggregates.follower_growth(usernames=["alice"]) == {}
+    assert aggregates.follower_growth(days=1) == {"bob": [(date(2019, 6, 6), 25, 0)]}
+
+
+@pytest.mark.parametrize("load", [load_data, copy_load_data])
+def test_daily_hashtag_counts(db, today, load):
+    load(fetch(FETCHES[0][0], 10, hashtags=["a", "b"]))
+    # Reloading the tweet does not count its hashtags again
+    load(fetch(FETCHES[1][0], 10, hashtags=["a", "b"]))
+
+    counts = DailyHashtagCount.objects.values_list("date", "hashtag", "count")
+    assert sorted(counts) == [(date(2019, 6, 5), "a", 1), (date(2019, 6, 5), "b", 1)]
+    assert aggregates.hashtag_trends(limit=1) == {"bob": [("a", 1)]}
+
+
+def test_backfill_matches_the_loaders(db):
+    for fetched_at, followers_count in FETCHES:
+        copy_load_data(fetch(fetched_at, followers_count, hashtags=["a"]))
+    maintained = daily_follower_counts()
+    hashtag_counts = list(DailyHashtagCount.objects.values_list("date", "hashtag", "count"))
+
+    migration = import_module("migrations.0007_add_daily_aggregates")
+    DailyFollowerCount.objects.all().delete()
+    DailyHashtagCount.objects.all().delete()
+    with connection.cursor() as cursor:
+        cursor.execute(migration.BACKFILL)
+
+    assert daily_follower_counts() == maintained
+    assert list(DailyHashtagCount.objects.values_list("date", "hashtag", "count")) == (
+        hashtag_counts
+    )
@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+from api import FixtureCache, FixtureNotFound, ReplayAPI
+from extract import Tweets
+from tests.factories import raw_tweet
+
+
+def test_fixture_cache_round_trip(tmp_path):
+    cache = FixtureCache(tmp_path)
+    payload = [raw_tweet(1), raw_tweet(2)]
+    cache.put("timeline", {"username": "bob"}, payload, latency=0.5)
+
+    replayed, entry = cache.get("timeline", {"username": "bob"})
+    assert replayed == payload
+    assert entry["latency"] == 0.5
+    with pytest.raises(FixtureNotFound):
+        cache.get("timeline", {"username": "alice"})
+
+
+def test_fixture_cache_concurrent_recorders(tmp_path):
+    caches = [FixtureCache(tmp_path) for _ in range(8)]
+    errors = []
+
+    def record(cache, worker):
+        try:
+            for i in range(50):
+                cache.put("timeline", {"username": "bob"}, [raw_tweet(worker * 100 + i)])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=record, args=(cache, worker))
+        for worker, cache in enumerate(caches)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    payload, _ = caches[0].get("timeline", {"username": "bob"})
+    assert len(payload) == 1
+    assert not list(tmp_path.rglob("*.tmp"))
+
+
+def test_extract_only_requests_the_timeline(tmp_path):
+    cache = FixtureCache(tmp_path)
+    cache.put(
+        "timeline",
+        {"username": "bob", "count": 2, "tweet_mode": "extended"},
+        [raw_tweet(1), raw_tweet(2)],
+    )
+    # No get_user response was recorded
+    tweets = Tweets("bob", 2, storage_system=lambda: None, api=ReplayAPI(cache=cache))
+    data = tweets.get_data()
+    assert [tweet["id"] for tweet in data["tweets"]] == [1, 2]
+    assert data["tweets"][0]["tweetpipe_metadata"]["username"] == "bob"
+
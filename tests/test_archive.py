@@ -0,0 +1,53 @@
+import gzip
+
+import archive
+from storage import LocalFileSystem
+
+DUMPS = {
+    "bob/20190604-101010+0000.json": b'{"tweets": [1]}',
+    "bob/20190604-111111+0000.json": b'{"tweets": [2]}',
+}
+
+
+def test_build_archive_is_deterministic():
+    built = archive.build_archive(DUMPS)
+    assert archive.build_archive(DUMPS) == built
+
+    members, index = archive.split_archive(built)
+    for filename, data in DUMPS.items():
+        offset, length = index[filename]
+        member = members[offset : offset + length]
+        assert archive.read_member(member) == data
+        # Plain gzip members, without a timestamp
+        assert gzip.decompress(member) == data
+        assert member[4:8] == b"\x00\x00\x00\x00"
+
+
+def test_extend_archive_keeps_the_members():
+    first = dict(list(DUMPS.items())[:1])
+    members, index = archive.split_archive(archive.build_archive(first))
+    extended = archive.build_archive(
+        {"bob/20190604-121212+0000.json": b"{}"}, members, index
+    )
+    assert extended.startswith(members)
+    assert sorted(archive.split_archive(extended)[1]) == sorted(
+        [*first, "bob/20190604-121212+0000.json"]
+    )
+
+
+def test_compact_and_read_archived_dumps(tmp_path):
+    storage = LocalFileSystem(data_dir=tmp_path)
+    for filename, data in DUMPS.items():
+        storage.write_bytes(filename, data)
+    today = "bob/20990101-000000+0000.json"
+    storage.write_bytes(today, b'{"tweets": [3]}')
+
+    results = archive.compact_dumps(lambda: storage, usernames=["bob"])
+    assert results == {"bob/20190604.archive": 2}
+    assert not (tmp_path / "bob/20190604-101010+0000.json").exists()
+
+    # The archived dumps are read from the archive and listed instead of it
+    assert storage.read("bob/20190604-111111+0000.json") == {"tweets": [2]}
+    _, count, files = storage.list("bob")
+    assert count == 3
+    assert sorted(files) == sorted([*DUMPS, today])
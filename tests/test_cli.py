@@ -0,0 +1,52 @@
+import pytest
+
+import cli
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Record the commands run by cli.main instead of running them"""
+    calls = []
+    for name in ("rerun_pipeline", "run_pipeline", "print_aggregates", "list_files"):
+        monkeypatch.setattr(
+            cli, name, lambda *args, name=name, **kwargs: calls.append((name, args))
+        )
+    monkeypatch.setattr(cli, "ensure_upcoming_partitions", lambda: None)
+    monkeypatch.setattr(cli, "flush_uploads", lambda: None)
+    monkeypatch.setattr(cli, "get_api", lambda *args, **kwargs: None)
+    return calls
+
+
+def run(monkeypatch, *argv):
+    monkeypatch.setattr("sys.argv", ["tweetpipe", *argv])
+    cli.main()
+
+
+def test_aggregates_after_rerun(monkeypatch, calls):
+    run(monkeypatch, "--rerun_file", "bob/a.json", "--aggregates")
+    assert [name for name, _ in calls] == ["rerun_pipeline", "print_aggregates"]
+
+
+def test_aggregates_after_pipeline_run(monkeypatch, calls):
+    run(monkeypatch, "--user_handle", "bob", "--aggregates")
+    assert calls[0][0] == "run_pipeline"
+    assert calls[1] == ("print_aggregates", (["bob"],))
+
+
+def test_aggregates_only(monkeypatch, calls):
+    run(monkeypatch, "--aggregates")
+    assert calls == [("print_aggregates", (None,))]
+
+
+def test_load_workers_are_validated(monkeypatch, calls, capsys):
+    argv = ["--user_handle", "bob", "--loader", "parallel", "--load_workers", "0"]
+    with pytest.raises(SystemExit):
+        run(monkeypatch, *argv)
+    assert "--load_workers must be at least 1" in capsys.readouterr().err
+    assert calls == []
+
+
+def test_profile_is_rejected_for_workers(monkeypatch, calls, capsys):
+    with pytest.raises(SystemExit):
+        run(monkeypatch, "--worker", "--profile")
+    assert "--profile can not be combined with --worker" in capsys.readouterr().err
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+import codec
+from tests.factories import raw_tweet
+
+INSTALLED_CODECS = [name for name, available in codec.AVAILABLE_CODECS.items() if available]
+
+TWEET = raw_tweet(
+    1,
+    hashtags=["café", "東京"],
+    full_text='Grüße 🐍 "quoted" \\ back/slash\ttab\nline \x7f\x00 end',
+    user={"screen_name": "zoë", "description": "  sep", "ids": [1, 2**62]},
+    coordinates=None,
+    possibly_sensitive=False,
+)
+
+
+@pytest.fixture(params=INSTALLED_CODECS)
+def json_codec(request):
+    return codec.get_codec(request.param)
+
+
+def test_round_trip(json_codec):
+    assert json_codec.loads(json_codec.dumps(TWEET)) == TWEET
+    assert json_codec.loads(json_codec.dumps(TWEET, indent=2)) == TWEET
+    assert json_codec.loads(json_codec.dumps(TWEET).decode()) == TWEET
+    assert json_codec.loads(json_codec.canonical(TWEET)) == TWEET
+
+
+def test_canonical_matches_the_dedup_layout(json_codec):
+    # The encoding hashed by the dedup layout since its introduction
+    expected = json.dumps(TWEET, sort_keys=True, separators=(",", ":")).encode()
+    assert json_codec.canonical(TWEET) == expected
+    assert json_codec.canonical({"b": 1, "a": "é"}) == b'{"a":"\\u00e9","b":1}'
+
+
+def test_is_canonical():
+    assert codec.is_canonical(b'{"a":"b\\n"}')
+    assert not codec.is_canonical('{"a":"é"}'.encode())
+    assert not codec.is_canonical(b'{"a":"\x7f"}')
+
+
+def test_get_codec(monkeypatch):
+    assert codec.get_codec("stdlib").name == "stdlib"
+    assert codec.get_codec("auto").name == INSTALLED_CODECS[0]
+    with pytest.raises(ValueError, match="auto, orjson, ujson, stdlib"):
+        codec.get_codec("simplejson")
+
+    monkeypatch.setitem(codec.AVAILABLE_CODECS, "orjson", False)
+    assert codec.get_codec("orjson").name == "stdlib"
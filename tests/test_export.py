@@ -0,0 +1,52 @@
+import pytest
+
+from load import copy_load_data
+from storage import LocalFileSystem
+from tests.factories import raw_tweet, with_metadata
+from transform import get_transformed_data
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+from export import Exporter  # noqa: E402 (needs pyarrow)
+
+
+def load(raw_tweets, **metadata):
+    copy_load_data(list(get_transformed_data(with_metadata(raw_tweets, **metadata))))
+
+
+def exported_tweet_ids(storage):
+    ids = []
+    for path in storage.data_dir.glob("tweetpipe-exports/tweets/**/*.parquet"):
+        ids.extend(pq.read_table(str(path)).column("id").to_pylist())
+    return sorted(ids)
+
+
+def test_export_is_incremental_by_load(db, tmp_path):
+    storage = LocalFileSystem(tmp_path)
+
+    def export():
+        return Exporter(lambda: storage).process()
+
+    load([raw_tweet(1, hashtags=["a"]), raw_tweet(2)])
+    assert export()["tweets"] == 2
+    assert export()["tweets"] == 0
+
+    # Loaded later, but fetched before the exported tweets
+    load([raw_tweet(3)], fetched_at="Mon Jun 03 00:00:00 +0000 2019")
+    # Updated
+    load([raw_tweet(1, hashtags=["a"], retweet_count=5)])
+    results = export()
+    assert results["tweets"] == 2
+    assert exported_tweet_ids(storage) == [1, 1, 2, 3]
+    assert results["hashtags"] == 0
+
+
+def test_exports_are_not_listed(db, tmp_path):
+    storage = LocalFileSystem(tmp_path)
+    storage.write("bob/20190605-000000+0000.json", with_metadata([raw_tweet(1)]))
+    load([raw_tweet(1)])
+    Exporter(lambda: storage).process()
+
+    assert storage.exists("tweetpipe-exports/state.json")
+    _, _, files = storage.list()
+    assert files == ["bob/20190605-000000+0000.json"]
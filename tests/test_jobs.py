@@ -0,0 +1,90 @@
+import threading
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models.functions import Now
+
+import jobs
+from models import Job
+
+
+def expire_leases():
+    Job.objects.filter(status=Job.RUNNING).update(
+        lease_expires_at=Now() - timedelta(seconds=1)
+    )
+
+
+def test_enqueue_skips_open_duplicates(db):
+    assert jobs.enqueue(Job.FETCH, ["bob", "alice"], count=10) == 2
+    assert jobs.enqueue(Job.FETCH, ["bob"], count=10) == 0
+    assert Job.objects.count() == 2
+
+
+def test_claim_skips_locked_jobs(db):
+    jobs.enqueue(Job.FETCH, ["bob", "alice"])
+    locked = threading.Event()
+    done = threading.Event()
+
+    def hold_lock():
+        # Another worker (with its own connection) holds the row lock of the oldest job
+        try:
+            with transaction.atomic():
+                Job.objects.select_for_update().get(target="bob")
+                locked.set()
+                done.wait(10)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    try:
+        assert locked.wait(10)
+        job = jobs.claim("worker-a")
+        assert job.target == "alice"
+        assert (job.status, job.worker, job.attempts) == (Job.RUNNING, "worker-a", 1)
+        # Nothing else is available while the lock is held
+        assert jobs.claim("worker-b") is None
+    finally:
+        done.set()
+        thread.join()
+
+    assert jobs.claim("worker-b").target == "bob"
+
+
+def test_expired_lease_is_claimed_again(db):
+    jobs.enqueue(Job.FETCH, ["bob"])
+    job = jobs.claim("worker-a", max_attempts=2)
+    assert jobs.claim("worker-b", max_attempts=2) is None
+
+    expire_leases()
+    reclaimed = jobs.claim("worker-b", max_attempts=2)
+    assert (reclaimed.pk, reclaimed.worker, reclaimed.attempts) == (job.pk, "worker-b", 2)
+    # worker-a lost the lease, it can neither extend nor complete the job
+    assert not jobs.extend_lease(job, "worker-a", 60)
+    assert not jobs.complete(job, "worker-a")
+    assert jobs.extend_lease(reclaimed, "worker-b", 60)
+
+    # The lease of the last attempt expires as well, the job fails
+    expire_leases()
+    assert jobs.claim("worker-c", max_attempts=2) is None
+    job.refresh_from_db()
+    assert job.status == Job.FAILED
+    assert job.error == "Lease of worker-b expired."
+
+
+def test_worker_retries_failed_jobs(db, monkeypatch):
+    monkeypatch.setattr(jobs.settings, "JOB_MAX_ATTEMPTS", 3)
+    jobs.enqueue(Job.FETCH, ["bob"])
+    calls = []
+
+    def fetch(job):
+        calls.append(job.attempts)
+        if len(calls) == 1:
+            raise ValueError("api error")
+
+    worker = jobs.Worker({Job.FETCH: fetch}, worker_id="worker-a", lease_seconds=60)
+    assert worker.run(burst=True) == 2
+    assert calls == [1, 2]
+    job = Job.objects.get()
+    assert (job.status, job.attempts, job.lease_expires_at) == (Job.DONE, 2, None)
+    assert job.error == "ValueError('api error')"
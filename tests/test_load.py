@@ -0,0 +1,165 @@
+import io
+import threading
+
+import pytest
+from django.db import connection
+
+import load
+from load import CopyLoader, ParallelLoader, copy_load_data, load_data
+from models import DailyHashtagCount, Hashtag, Tweet, User
+from pipeline import PipelineStopped
+from tests.factories import raw_tweet, with_metadata
+from transform import get_transformed_data
+
+
+def transformed(raw_tweets):
+    return list(get_transformed_data(with_metadata(raw_tweets)))
+
+
+def test_copy_values_round_trip(db):
+    rows = [
+        ["tab\there", 1, True],
+        ["new\nline \\N back\\slash", None, False],
+        [None, 2, None],
+        ["", 3, True],
+    ]
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(CopyLoader.to_copy_value(value) for value in row) + "\n")
+    buffer.seek(0)
+
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE TEMP TABLE copy_values (t text, i integer, b boolean)")
+        cursor.copy_expert("COPY copy_values FROM STDIN", buffer)
+        cursor.execute("SELECT t, i, b FROM copy_values")
+        assert [list(row) for row in cursor.fetchall()] == rows
+        cursor.execute("DROP TABLE copy_values")
+
+
+def hashtags_of(tweet_id):
+    links = Hashtag.tweets.through.objects.filter(tweet_id=tweet_id)
+    return sorted(links.values_list("hashtag__text", flat=True))
+
+
+def test_copy_loader(db):
+    raw_tweets = [
+        raw_tweet(1, hashtags=["a", "b"], full_text="with\ttab and \\N"),
+        raw_tweet(2, hashtags=["b"]),
+    ]
+    copy_load_data(transformed(raw_tweets))
+    assert Tweet.objects.get(id=1).full_text == "with\ttab and \\N"
+    assert hashtags_of(1) == ["a", "b"]
+    assert hashtags_of(2) == ["b"]
+
+    # Loading the same tweets again does not add rows
+    copy_load_data(transformed(raw_tweets))
+    assert Tweet.objects.count() == 2
+    assert Hashtag.objects.count() == 2
+    assert Hashtag.tweets.through.objects.count() == 3
+
+
+def test_copy_loader_falls_back_on_data_errors(db, monkeypatch):
+    # Without validation, postgres rejects the too long text in the COPY
+    monkeypatch.setattr(load.settings, "VALIDATE_ROWS", False)
+    copy_load_data(transformed([raw_tweet(1, full_text="x" * 700), raw_tweet(2)]))
+    # The batch is reloaded row by row, only the invalid tweet is skipped
+    assert list(Tweet.objects.values_list("id", flat=True)) == [2]
+
+
+def test_orm_loader(db):
+    raw_tweets = [raw_tweet(1, hashtags=["a", "b"]), raw_tweet(2, hashtags=["b"])]
+    load_data(transformed(raw_tweets))
+    assert hashtags_of(1) == ["a", "b"]
+    assert hashtags_of(2) == ["b"]
+    counts = DailyHashtagCount.objects.order_by("hashtag")
+    assert list(counts.values_list("hashtag", "count")) == [("a", 1), ("b", 2)]
+
+    # Existing links are neither added nor counted again
+    load_data(transformed(raw_tweets))
+    assert Hashtag.tweets.through.objects.count() == 3
+    assert list(counts.values_list("hashtag", "count")) == [("a", 1), ("b", 2)]
+
+
+@pytest.mark.parametrize("load", [load_data, copy_load_data])
+def test_tweet_ids_stay_unique(db, load):
+    # The partitioned table only enforces (id, created_at)
+    load(transformed([raw_tweet(1, full_text="original")]))
+    moved = raw_tweet(1, full_text="moved", created_at="Mon Jul 01 10:00:00 +0000 2019")
+    load(transformed([moved, raw_tweet(2)]))
+
+    assert Tweet.objects.get(id=1).full_text == "original"
+    assert Tweet.objects.filter(id=2).exists()
+
+    Tweet.objects.all().delete()
+    load(transformed([moved, raw_tweet(1)]))
+    assert Tweet.objects.filter(id=1).count() == 1
+
+
+class StubShardLoader:
+    """ShardLoader without a DB, fails on the tweets of user 13"""
+
+    loaded = []
+
+    def __init__(self, batch_size=None):
+        pass
+
+    def process(self, transformed_data):
+        for data in transformed_data:
+            if data[User]["id"] == 13:
+                raise ValueError("shard failed")
+            self.loaded.append(data[User]["id"])
+
+
+@pytest.fixture
+def stub_shards(monkeypatch):
+    monkeypatch.setattr(StubShardLoader, "loaded", [])
+    monkeypatch.setattr(load, "ShardLoader", StubShardLoader)
+    return StubShardLoader.loaded
+
+
+def process(loader, transformed_data, timeout=10):
+    """Run process in a thread, fail instead of hanging if a shard does not stop"""
+    result = {}
+
+    def target():
+        try:
+            loader.process(transformed_data)
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the loader did not stop"
+    return result.get("error")
+
+
+def tweets_of(user_ids):
+    for user_id in user_ids:
+        yield {User: {"id": user_id}}
+
+
+def test_parallel_loader_shards_by_user(stub_shards):
+    assert process(ParallelLoader(workers=3), tweets_of(range(10))) is None
+    assert sorted(stub_shards) == list(range(10))
+
+
+def test_failing_shard_stops_the_loader(stub_shards):
+    # The producer blocks on the full queues of the other shards until it is stopped
+    loader = ParallelLoader(workers=2, queue_size=1)
+    error = process(loader, tweets_of([13, *[2] * 100]))
+    assert str(error) == "shard failed"
+
+
+@pytest.mark.parametrize("upstream_error", [PipelineStopped(), ValueError("upstream")])
+def test_failing_upstream_stops_the_shards(stub_shards, upstream_error):
+    def transformed_data():
+        yield from tweets_of([1, 2])
+        raise upstream_error
+
+    assert process(ParallelLoader(workers=2), transformed_data()) is upstream_error
+
+
+def test_parallel_loader_needs_a_worker():
+    with pytest.raises(ValueError):
+        ParallelLoader(workers=0)
@@ -0,0 +1,91 @@
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from django.db import connection, connections, transaction
+
+import partitions
+from load import copy_load_data
+from models import FollowerCount, Tweet
+from tests.factories import raw_tweet, with_metadata
+from transform import get_transformed_data
+
+
+@pytest.fixture
+def known_partitions(monkeypatch):
+    """Start without cached partitions"""
+    known = set()
+    monkeypatch.setattr(partitions, "_known_partitions", known)
+    return known
+
+
+def partition_exists(name):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+        return cursor.fetchone()[0]
+
+
+def test_month_of_is_the_utc_month():
+    berlin = timezone(timedelta(hours=2))
+    july_in_berlin = datetime(2019, 7, 1, 0, 30, tzinfo=berlin)
+    assert partitions.month_of(july_in_berlin) == date(2019, 6, 1)
+    assert partitions.add_months(date(2019, 11, 1), 3) == date(2020, 2, 1)
+    assert partitions.add_months(date(2019, 1, 1), -1) == date(2018, 12, 1)
+
+
+def test_rows_outside_the_partitions_are_loaded(db, known_partitions):
+    old = raw_tweet(1, created_at="Sat Mar 03 10:00:00 +0000 2001")
+    data = with_metadata([old], fetched_at="Mon Jan 07 10:00:00 +0000 2030")
+    transformed = list(get_transformed_data(data))
+    assert dict(partitions.batch_months(transformed)) == {
+        Tweet: {date(2001, 3, 1)},
+        FollowerCount: {date(2030, 1, 1)},
+    }
+
+    copy_load_data(transformed)
+    assert partition_exists("tweetpipe_tweet_p2001_03")
+    assert partition_exists("tweetpipe_followercount_p2030_01")
+    assert Tweet.objects.get(id=1).created_at.year == 2001
+    assert ("tweetpipe_tweet", date(2001, 3, 1)) in known_partitions
+
+
+def test_partitions_of_rolled_back_transactions_are_not_cached(db, known_partitions):
+    with transaction.atomic():
+        partitions.create_partitions(Tweet, [date(2002, 5, 1)])
+        assert partition_exists("tweetpipe_tweet_p2002_05")
+        transaction.set_rollback(True)
+    assert not partition_exists("tweetpipe_tweet_p2002_05")
+    assert not known_partitions
+
+    partitions.create_partitions(Tweet, [date(2002, 5, 1)])
+    assert partition_exists("tweetpipe_tweet_p2002_05")
+
+
+def test_concurrent_creation_of_the_same_partition(db, known_partitions):
+    workers = 8
+    barrier = threading.Barrier(workers)
+    errors = []
+
+    def create():
+        try:
+            barrier.wait()
+            # Every thread uses its own connection, the advisory lock serializes them
+            partitions.create_partitions(FollowerCount, [date(2003, 8, 1)])
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=create) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM pg_inherits "
+            "WHERE inhrelid = 'tweetpipe_followercount_p2003_08'::regclass"
+        )
+        assert cursor.fetchone()[0] == 1
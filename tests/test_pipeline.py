@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+
+from pipeline import StagedPipeline
+
+
+def run(pipeline, items, timeout=10):
+    """Run the pipeline in a thread, fail instead of hanging if a stage does not stop"""
+    result = {}
+
+    def target():
+        try:
+            pipeline.run(items)
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the pipeline did not stop"
+    return result.get("error")
+
+
+def extract(item):
+    return {"item": item}
+
+
+def transform(raw_data):
+    return [(raw_data["item"], i) for i in range(3)]
+
+
+def test_stages_pass_all_items():
+    loaded = []
+    pipeline = StagedPipeline(extract, transform, loaded.extend, 1, 1)
+    assert run(pipeline, ["a", "b"]) is None
+    assert loaded == [("a", 0), ("a", 1), ("a", 2), ("b", 0), ("b", 1), ("b", 2)]
+
+
+@pytest.mark.parametrize("failing_stage", ["extract", "transform", "load"])
+def test_failing_stage_stops_the_pipeline(failing_stage):
+    error = ValueError(failing_stage)
+    loaded = []
+
+    def fail(*args):
+        raise error
+
+    def load(transformed_tweets):
+        for transformed_tweet in transformed_tweets:
+            loaded.append(transformed_tweet)
+            if failing_stage == "load":
+                raise error
+
+    stages = {"extract": extract, "transform": transform, "load": load}
+    if failing_stage != "load":
+        stages[failing_stage] = fail
+    # Small queues, the other stages block on them until the pipeline stops
+    pipeline = StagedPipeline(**stages, raw_queue_size=1, queue_size=1)
+
+    assert run(pipeline, range(100)) is error
+    assert pipeline.errors == [error]
+    assert len(loaded) < 300
+
+
+def test_failure_after_the_upstream_stages_finished():
+    def load(transformed_tweets):
+        list(transformed_tweets)
+        raise ValueError("commit failed")
+
+    pipeline = StagedPipeline(extract, transform, load, 1, 1)
+    error = run(pipeline, ["a"])
+    assert isinstance(error, ValueError)
+    assert str(error) == "commit failed"
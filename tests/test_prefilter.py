@@ -0,0 +1,90 @@
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.db import connection
+from django.utils import timezone
+
+from load import copy_load_data
+from models import Tweet
+from prefilter import KnownTweets, Prefilter
+from tests.factories import raw_tweet, with_metadata
+from transform import get_transformed_data
+
+
+def load(raw_tweets):
+    copy_load_data(list(get_transformed_data(with_metadata(raw_tweets))))
+
+
+def ids(raw_tweets):
+    return [raw_tweet["id"] for raw_tweet in raw_tweets]
+
+
+def test_concurrent_saves_replace_the_file(tmp_path):
+    def save(number):
+        known = KnownTweets(1, directory=tmp_path)
+        known.ids = array("q", range(number))
+        for _ in range(20):
+            known.save()
+
+    # Every writer (thread or worker process) uses its own temporary file
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(save, range(1, 9)))
+
+    known_dir = KnownTweets(1, directory=tmp_path).path.parent
+    assert [path.name for path in known_dir.iterdir()] == ["1.ids"]
+    # The complete ids of one of the writers
+    saved = list(KnownTweets(1, directory=tmp_path).ids)
+    assert saved == list(range(len(saved))) and len(saved) in range(1, 9)
+
+
+def test_known_tweets_are_refreshed_incrementally(db, tmp_path):
+    load([raw_tweet(1), raw_tweet(2), raw_tweet(5, user_id=2, screen_name="alice")])
+    known = KnownTweets(1, directory=tmp_path)
+    assert known.refresh() == 2
+    assert 1 in known and 2 in known and 5 not in known
+
+    load([raw_tweet(3)])
+    assert known.refresh() == 1
+    assert list(KnownTweets(1, directory=tmp_path).ids) == [1, 2, 3]
+
+
+def test_known_tweets_are_kept_per_database(tmp_path):
+    known = KnownTweets(1, directory=tmp_path)
+    assert known.path == tmp_path / connection.settings_dict["NAME"] / "1.ids"
+
+
+def test_stale_known_tweets_are_rebuilt(db, tmp_path):
+    load([raw_tweet(1), raw_tweet(2), raw_tweet(5)])
+    KnownTweets(1, directory=tmp_path).refresh()
+
+    # E.g. a truncated or restored DB, the file of the earlier refresh is outdated
+    Tweet.objects.filter(id__in=[1, 5]).delete()
+    known = KnownTweets(1, directory=tmp_path)
+    assert list(known.ids) == [1, 2, 5]
+    known.refresh()
+    assert list(known.ids) == [2]
+    prefilter = Prefilter(policy="skip", directory=tmp_path)
+    assert ids(prefilter.filter([raw_tweet(2), raw_tweet(1), raw_tweet(2)])) == [2, 1]
+
+    # Older tweets loaded later (reruns, backfills) are added as well
+    load([raw_tweet(1), raw_tweet(3)])
+    known.refresh()
+    assert list(KnownTweets(1, directory=tmp_path).ids) == [1, 2, 3]
+
+
+@pytest.mark.parametrize(
+    "policy, kept", [("off", [1, 2, 3, 4]), ("skip", [1, 4]), ("refresh_recent", [1, 3, 4])]
+)
+def test_filter_drops_known_tweets(db, tmp_path, policy, kept):
+    recent = timezone.now().strftime("%a %b %d %H:%M:%S %z %Y")
+    load([raw_tweet(1), raw_tweet(2), raw_tweet(3, created_at=recent)])
+    raw_tweets = [
+        raw_tweet(1),
+        raw_tweet(2),
+        raw_tweet(3, created_at=recent),
+        raw_tweet(4),
+    ]
+    prefilter = Prefilter(policy=policy, refresh_days=7, directory=tmp_path)
+    # The first tweet is always kept, the user is parsed from it
+    assert ids(prefilter.filter(raw_tweets)) == kept
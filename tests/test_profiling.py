@@ -0,0 +1,31 @@
+import pstats
+import time
+
+from django.db import connection
+
+from profiling import Profiler
+
+
+def test_profiler_records_stages_and_queries(db, tmp_path):
+    profiler = Profiler(output_dir=tmp_path, top=5)
+    for _ in range(2):
+        with profiler.stage("extract"):
+            time.sleep(0.01)
+    with profiler.stage("load"):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.execute("SELECT pg_sleep(0.01)")
+
+    extract, load = profiler.stages["extract"], profiler.stages["load"]
+    assert extract.calls == 2 and extract.wall_time >= 0.02
+    assert extract.queries == 0
+    # Counted by the execute wrapper of the stage
+    assert load.calls == 1 and load.queries == 2
+    assert 0.01 <= load.sql_time <= load.wall_time
+
+    summary = profiler.report()
+    assert "Stage load: " in summary and "2 SQL queries" in summary
+    assert (tmp_path / f"{profiler.run_id}-summary.txt").read_text() == summary
+    for stage in ("extract", "load"):
+        prof_path = tmp_path / f"{profiler.run_id}-{stage}.prof"
+        assert pstats.Stats(str(prof_path)).total_calls > 0
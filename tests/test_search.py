@@ -0,0 +1,60 @@
+import warnings
+from datetime import date
+
+from django.db import connection
+
+from load import copy_load_data
+from models import Tweet
+from search import search_tweets
+from tests.factories import raw_tweet, with_metadata
+from transform import get_transformed_data
+
+
+def load(raw_tweets):
+    copy_load_data(list(get_transformed_data(with_metadata(raw_tweets))))
+
+
+def ids(tweets):
+    return [tweet.id for tweet in tweets]
+
+
+def test_search_ranks_and_filters(db):
+    load(
+        [
+            # created_at: Tue Jun 04 23:12:08 +0000 2019 (June 5th in Europe/Berlin)
+            raw_tweet(1, full_text="Pipelines pipelines everywhere"),
+            raw_tweet(2, full_text="A pipeline and a database"),
+            raw_tweet(3, user_id=2, screen_name="alice", full_text="pipeline"),
+            raw_tweet(
+                4,
+                full_text="Nothing to see",
+                created_at="Mon Jun 03 10:00:00 +0000 2019",
+            ),
+        ]
+    )
+    # Stemming (english) and ranking
+    assert ids(search_tweets("pipeline", usernames=["BOB"])) == [1, 2]
+    assert ids(search_tweets("pipelines database")) == [2]
+    assert ids(search_tweets("pipeline", limit=1)) == [1]
+
+    with warnings.catch_warnings():
+        # Django warns about naive datetimes (RuntimeWarning)
+        warnings.simplefilter("error", RuntimeWarning)
+        since = date(2019, 6, 5)
+        assert ids(search_tweets("pipeline", usernames=["bob"], since=since)) == [1, 2]
+        assert ids(search_tweets("pipeline", until=date(2019, 6, 5))) == []
+
+
+def test_search_vector_is_maintained_by_the_db(db):
+    load([raw_tweet(1, full_text="first version")])
+    Tweet.objects.filter(id=1).update(full_text="second version")
+    assert ids(search_tweets("second")) == [1]
+    assert ids(search_tweets("first")) == []
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT prosrc FROM pg_proc "
+            "WHERE proname = 'tweetpipe_tweet_search_vector_update'"
+        )
+        (source,) = cursor.fetchone()
+    assert f"'{Tweet.search_config}'" in source
@@ -0,0 +1,223 @@
+import io
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+import cli
+import storage
+from models import FollowerCount, User
+from tests.factories import raw_tweet, with_metadata
+
+
+class FakeS3(storage.S3):
+    """S3 keeping the objects in memory, counts the transferred bodies"""
+
+    def __init__(self):
+        super().__init__()
+        self.objects = {}
+        self.downloads = 0
+
+    def get_object(self, filename, **kwargs):
+        try:
+            data, etag = self.objects[filename]
+        except KeyError:
+            raise FileNotFoundError(filename)
+        if kwargs.get("IfNoneMatch") == etag:
+            raise ClientError({"Error": {"Code": "304"}}, "GetObject")
+        self.downloads += 1
+        return {"Body": io.BytesIO(data), "ETag": etag}
+
+    def write_bytes(self, filename, data):
+        etag = f'"{len(self.objects)}-{len(data)}"'
+        self.objects[filename] = (data, etag)
+        return etag
+
+    def exists(self, filename):
+        return filename in self.objects
+
+
+@pytest.fixture
+def cached_s3(monkeypatch, tmp_path):
+    monkeypatch.setattr(storage, "S3", FakeS3)
+    monkeypatch.setattr(storage.settings, "S3_CACHE_DIR", tmp_path)
+    return storage.CachedS3()
+
+
+def test_unchanged_file_is_read_from_the_cache(cached_s3):
+    cached_s3.write_bytes("bob/a.json", b"a")
+    assert cached_s3.read_bytes("bob/a.json") == b"a"
+    assert cached_s3.remote.downloads == 0
+
+    cached_s3.remote.write_bytes("bob/a.json", b"changed")
+    assert cached_s3.read_bytes("bob/a.json") == b"changed"
+    assert cached_s3.remote.downloads == 1
+
+
+def test_file_evicted_after_not_modified_is_downloaded(cached_s3):
+    cached_s3.write_bytes("bob/a.json", b"a")
+    # Another thread evicts the file between the ETag lookup and the read
+    (cached_s3.local.data_dir / "bob/a.json").unlink()
+
+    assert cached_s3.read_bytes("bob/a.json") == b"a"
+    assert cached_s3.remote.downloads == 1
+    # Cached again
+    assert cached_s3.read_bytes("bob/a.json") == b"a"
+    assert cached_s3.remote.downloads == 1
+
+
+class FlakyStorage(storage.LocalFileSystem):
+    """Local storage whose writes fail a given number of times or wait for a gate"""
+
+    def __init__(self, data_dir, failures=0):
+        super().__init__(data_dir=data_dir)
+        self.failures = failures
+        self.attempts = 0
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def write(self, filename, data):
+        self.gate.wait()
+        self.attempts += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("upload failed")
+        return super().write(filename, data)
+
+
+@pytest.fixture
+def spool_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(storage.settings, "SPOOL_DIR", tmp_path / "spool")
+    monkeypatch.setattr(storage.settings, "UPLOAD_QUEUE_SIZE", 1)
+    monkeypatch.setattr(storage.settings, "UPLOAD_RETRIES", 2)
+    return tmp_path / "spool" / "flakystorage"
+
+
+def flush(uploader, timeout=10):
+    """Flush in a thread, fail instead of hanging"""
+    result = {}
+
+    def target():
+        try:
+            uploader.flush()
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "flush did not return"
+    return result.get("error")
+
+
+def test_uploader_spools_beyond_the_memory_budget(tmp_path, spool_dir):
+    remote = FlakyStorage(tmp_path / "remote")
+    remote.gate.clear()
+    uploader = storage.BackgroundUploader(remote)
+    for i in range(3):
+        uploader.submit(f"bob/{i}.json", {"tweets": [i]})
+    # One file is held in memory, the others wait on disk
+    assert len(list(spool_dir.glob("*.spool"))) == 2
+
+    remote.gate.set()
+    assert flush(uploader) is None
+    for i in range(3):
+        assert remote.read(f"bob/{i}.json") == {"tweets": [i]}
+    assert list(spool_dir.iterdir()) == []
+
+
+def test_uploader_retries_and_spools_failed_uploads(tmp_path, spool_dir):
+    remote = FlakyStorage(tmp_path / "remote", failures=1)
+    uploader = storage.BackgroundUploader(remote)
+    uploader.submit("bob/retried.json", {"tweets": [1]})
+    assert flush(uploader) is None
+    assert remote.attempts == 2
+    assert remote.exists("bob/retried.json")
+
+    remote.failures = 2
+    uploader.submit("bob/failed.json", {"tweets": [2]})
+    error = flush(uploader)
+    assert isinstance(error, storage.UploadError)
+    assert "bob/failed.json" in str(error)
+    assert not remote.exists("bob/failed.json")
+    (spool_path,) = spool_dir.glob("*.spool")
+
+    # The next run uploads the spooled file
+    uploader = storage.BackgroundUploader(remote)
+    assert flush(uploader) is None
+    assert remote.read("bob/failed.json") == {"tweets": [2]}
+    assert not spool_path.exists()
+
+
+def test_uploader_survives_a_failing_spool(tmp_path, spool_dir, monkeypatch):
+    remote = FlakyStorage(tmp_path / "remote", failures=2)
+    uploader = storage.BackgroundUploader(remote)
+
+    def spool(filename, data):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(uploader, "spool", spool)
+    uploader.submit("bob/lost.json", {"tweets": [1]})
+    assert isinstance(flush(uploader), storage.UploadError)
+
+    # The thread is still running
+    uploader.submit("bob/next.json", {"tweets": [2]})
+    assert flush(uploader) is None
+    assert remote.exists("bob/next.json")
+
+
+def dump(fetched_at, followers_count, tweet_ids=(1, 2)):
+    raw_tweets = [raw_tweet(tweet_id) for tweet_id in tweet_ids]
+    for tweet in raw_tweets:
+        tweet["user"]["followers_count"] = followers_count
+    return with_metadata(raw_tweets, fetched_at=fetched_at)
+
+
+@pytest.fixture
+def dedup_storage(monkeypatch, tmp_path):
+    monkeypatch.setattr(storage.settings, "RAW_STORAGE_LAYOUT", "dedup")
+    return storage.LocalFileSystem(data_dir=tmp_path)
+
+
+def test_dedup_layout_stores_objects_once(dedup_storage, tmp_path):
+    first = dump("Wed Jun 05 00:00:00 +0000 2019", 10)
+    second = dump("Wed Jun 05 01:00:00 +0000 2019", 10)
+    dedup_storage.write("bob/first.json", first)
+    dedup_storage.write("bob/second.json", second)
+
+    manifest = dedup_storage.json2dict(dedup_storage.read_bytes("bob/second.json"))
+    assert manifest["tweetpipe_metadata"] == second["tweets"][0]["tweetpipe_metadata"]
+    # Two tweets and one user, shared by both manifests
+    assert len(list((tmp_path / storage.settings.OBJECT_PREFIX).rglob("*.json"))) == 3
+    assert dedup_storage.read("bob/first.json") == first
+    assert dedup_storage.read("bob/second.json") == second
+    # Objects are not listed as raw files
+    assert sorted(dedup_storage.list("bob")[2]) == ["bob/first.json", "bob/second.json"]
+
+
+def test_dedup_read_excludes_tweets_of_earlier_files(dedup_storage):
+    dedup_storage.write("bob/first.json", dump("Wed Jun 05 00:00:00 +0000 2019", 10))
+    dedup_storage.write(
+        "bob/second.json", dump("Wed Jun 05 01:00:00 +0000 2019", 20, (1, 2, 3))
+    )
+
+    processed = set()
+    tweets = dedup_storage.read("bob/first.json", processed)["tweets"]
+    assert [tweet["id"] for tweet in tweets] == [1, 2]
+    tweets = dedup_storage.read("bob/second.json", processed)["tweets"]
+    # The first tweet of the user is kept with the metadata of its manifest
+    assert [tweet["id"] for tweet in tweets] == [1, 3]
+    assert tweets[0]["user"]["followers_count"] == 20
+    metadata = tweets[0]["tweetpipe_metadata"]
+    assert metadata["fetched_at"] == "Wed Jun 05 01:00:00 +0000 2019"
+    assert len(processed) == 3
+
+
+def test_rerun_of_identical_manifests_loads_every_follower_count(db, dedup_storage):
+    dedup_storage.write("bob/first.json", dump("Wed Jun 05 00:00:00 +0000 2019", 10))
+    dedup_storage.write("bob/second.json", dump("Wed Jun 05 01:00:00 +0000 2019", 20))
+
+    cli.rerun_pipeline(["bob/first.json", "bob/second.json"], lambda: dedup_storage)
+    counts = FollowerCount.objects.order_by("fetched_at")
+    assert list(counts.values_list("count", flat=True)) == [10, 20]
+    assert User.objects.get(id=1).followers_count == 20
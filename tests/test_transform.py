@@ -0,0 +1,76 @@
+import pytest
+
+from models import User
+from tests.factories import raw_tweet, with_metadata
+from transform import (
+    METADATA_FIELDS,
+    TweetCompactor,
+    compact_data,
+    get_transformed_data,
+    registry,
+)
+
+
+def test_compacted_record_keeps_exactly_the_projected_fields():
+    compactor = TweetCompactor(["id", "user.followers_count", "entities.hashtags"])
+    tweet = raw_tweet(1, hashtags=["a"])
+    record = compactor.compact(tweet)
+
+    assert sorted(record.keys()) == ["entities", "id", "user"]
+    assert record["id"] == 1
+    assert record["user"] == {"followers_count": 10}
+    assert record["entities"] == {"hashtags": [{"text": "a", "indices": [0, 1]}]}
+    assert "full_text" not in record
+    with pytest.raises(KeyError):
+        record["full_text"]
+    # Records have no per instance dict
+    assert not hasattr(record, "__dict__")
+    # The raw tweet is not modified
+    assert "full_text" in tweet and "screen_name" in tweet["user"]
+
+
+def test_compacted_records_share_repeating_dicts():
+    data = compact_data(with_metadata([raw_tweet(1), raw_tweet(2)]))
+    first, second = data["tweets"]
+    assert first["user"] is second["user"]
+    assert first["tweetpipe_metadata"] is second["tweetpipe_metadata"]
+
+
+def test_compacting_does_not_change_the_transformation():
+    def raw_data():
+        return with_metadata(
+            [
+                raw_tweet(1, hashtags=["a", "b"], source="web", place=None),
+                raw_tweet(2, user_id=2, screen_name="alice"),
+            ]
+        )
+
+    full = list(get_transformed_data(raw_data()))
+    compacted = list(get_transformed_data(compact_data(raw_data())))
+    assert compacted == full
+
+
+def test_source_fields_only_contain_fields_of_the_raw_tweet():
+    assert registry.source_fields[:3] == [
+        "tweetpipe_metadata.fetched_at",
+        "tweetpipe_metadata.username",
+        "tweetpipe_metadata.count",
+    ]
+    metadata_fields = {
+        field for field in registry.source_fields if field.startswith("tweetpipe_metadata.")
+    }
+    assert metadata_fields == {f"tweetpipe_metadata.{field}" for field in METADATA_FIELDS}
+    assert "user.screen_name" in registry.source_fields
+
+    record = compact_data(with_metadata([raw_tweet(1)]))["tweets"][0]
+    assert record["tweetpipe_metadata"]["username"] == "bob"
+
+
+def test_rows_only_contain_model_columns():
+    (transformed,) = get_transformed_data(with_metadata([raw_tweet(1)]))
+    for model, columns in registry.columns.items():
+        rows = transformed[model]
+        for row in rows if isinstance(rows, list) else [rows]:
+            assert set(row) <= set(columns)
+    assert transformed[User]["screen_name"] == "bob"
+    assert "username" not in transformed[User]
@@ -0,0 +1,82 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import validation
+from models import Hashtag, Tweet, User
+from tests.factories import raw_tweet, with_metadata
+from transform import get_transformed_data
+from validation import DeadLetter, ModelValidator, TweetValidator
+
+
+def transformed(raw_tweet):
+    (data,) = get_transformed_data(with_metadata([raw_tweet]))
+    return data
+
+
+def read_entries(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+@pytest.mark.parametrize(
+    "url, valid",
+    [("https://t.co/abcdef", True), ("", True), ("#hashtag", False)],
+)
+def test_url_check(url, valid):
+    validator = ModelValidator(Tweet, ["tweet_url"])
+    assert (validator.errors({"tweet_url": url}) == []) == valid
+
+
+def test_constraint_checks():
+    validator = ModelValidator(Tweet, ["full_text", "retweet_count", "user_id"])
+    assert validator.errors({"full_text": "x", "retweet_count": 1, "user_id": 1}) == []
+    assert sorted(validator.errors({"full_text": "x" * 661, "retweet_count": -1})) == [
+        "full_text has 661 characters (max_length=660)",
+        "retweet_count -1 is out of range [0, 2147483647]",
+        "user_id is missing",
+    ]
+
+
+def test_invalid_rows_are_dead_lettered(tmp_path):
+    validator = TweetValidator(dead_letter=DeadLetter(directory=tmp_path))
+    valid = transformed(raw_tweet(1, hashtags=["ok"]))
+    assert valid[Tweet]["tweet_url"] == ""
+    assert validator.validate(valid) == valid
+
+    # An invalid hashtag is dropped on its own
+    data = transformed(raw_tweet(2, hashtags=["ok", "x" * 280]))
+    assert [row["text"] for row in validator.validate(data)[Hashtag]] == ["ok"]
+    # Any other invalid row drops the tweet
+    data = transformed(raw_tweet(3, screen_name="x" * 16))
+    assert validator.validate(data) is None
+
+    validator.dead_letter.close()
+    (path,) = tmp_path.iterdir()
+    entries = read_entries(path)
+    assert [(entry["model"], entry["tweet_id"], entry["dropped"]) for entry in entries] == [
+        (Hashtag.__name__, 2, "row"),
+        (User.__name__, 3, "tweet"),
+    ]
+    assert entries[1]["reasons"] == ["screen_name has 16 characters (max_length=15)"]
+
+
+def test_dead_letter_keeps_one_file_per_day_open(monkeypatch, tmp_path):
+    dead_letter = DeadLetter(directory=tmp_path)
+    now = datetime(2019, 6, 4, 23, 0, tzinfo=timezone.utc)
+    monkeypatch.setattr(validation.timezone, "now", lambda: now)
+
+    dead_letter.write(Tweet, {"id": 1}, ["first"], "tweet", 1)
+    dead_letter_file = dead_letter._file
+    dead_letter.write(Tweet, {"id": 2}, ["second"], "tweet", 2)
+    assert dead_letter._file is dead_letter_file
+    # Flushed, complete lines are readable while the file is open
+    assert len(read_entries(tmp_path / "20190604.jsonl")) == 2
+
+    now = datetime(2019, 6, 5, 0, 1, tzinfo=timezone.utc)
+    dead_letter.write(Tweet, {"id": 3}, ["next day"], "tweet", 3)
+    assert dead_letter_file.closed
+    dead_letter.close()
+
+    assert [entry["tweet_id"] for entry in read_entries(tmp_path / "20190605.jsonl")] == [3]
+    assert dead_letter.count == 3
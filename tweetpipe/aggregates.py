@@ -0,0 +1,167 @@
+"""
+Summary tables for hashtag trends and follower growth.
+
+Aggregates over the FollowerCount history or Hashtag.tweets would otherwise scan and
+join the base tables on every query. Instead, the loaders add every newly loaded row
+to small summary tables in the same transaction as the row itself:
+
+    DailyHashtagCount - number of tweets of a user per day using a hashtag
+    DailyFollowerCount - first and last follower count of a user per day
+
+Days are calendar days in settings.TIME_ZONE. Only new links between a hashtag and a
+tweet are counted, reloading a tweet does not change the counts.
+The tables are filled with the existing rows by migration 0007.
+"""
+from datetime import timedelta
+from itertools import groupby
+
+from django.db.models import F, Q, Sum, Window
+from django.db.models.functions import Lag
+from django.utils import timezone
+from loguru import logger
+
+from config import settings
+from models import DailyFollowerCount, DailyHashtagCount
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
+
+
+# links_sql returns the new (hashtag_id, tweet_id) links. It may be an INSERT ... RETURNING,
+# which links and counts the hashtags in a single statement.
+HASHTAG_COUNTS_SQL = """
+WITH new_links (hashtag_id, tweet_id) AS ({links_sql})
+INSERT INTO tweetpipe_dailyhashtagcount (user_id, date, hashtag, count)
+SELECT t.user_id, (t.created_at AT TIME ZONE %s)::date, h.text, count(*)
+FROM new_links l
+JOIN tweetpipe_tweet t ON t.id = l.tweet_id
+JOIN tweetpipe_hashtag h ON h.id = l.hashtag_id
+GROUP BY 1, 2, 3
+ON CONFLICT (user_id, date, hashtag)
+DO UPDATE SET count = tweetpipe_dailyhashtagcount.count + EXCLUDED.count
+"""
+
+# counts_sql returns (user_id, fetched_at, count) rows
+FOLLOWER_COUNTS_SQL = """
+INSERT INTO tweetpipe_dailyfollowercount AS d
+    (user_id, date, first_fetched_at, first_count, last_fetched_at, last_count)
+SELECT
+    user_id,
+    date,
+    min(fetched_at),
+    (array_agg(count ORDER BY fetched_at))[1],
+    max(fetched_at),
+    (array_agg(count ORDER BY fetched_at DESC))[1]
+FROM (
+    SELECT user_id, (fetched_at AT TIME ZONE %s)::date AS date, fetched_at, count
+    FROM ({counts_sql}) c (user_id, fetched_at, count)
+) s
+GROUP BY user_id, date
+ON CONFLICT (user_id, date) DO UPDATE SET
+    first_count = CASE WHEN EXCLUDED.first_fetched_at < d.first_fetched_at
+        THEN EXCLUDED.first_count ELSE d.first_count END,
+    first_fetched_at = LEAST(d.first_fetched_at, EXCLUDED.first_fetched_at),
+    last_count = CASE WHEN EXCLUDED.last_fetched_at >= d.last_fetched_at
+        THEN EXCLUDED.last_count ELSE d.last_count END,
+    last_fetched_at = GREATEST(d.last_fetched_at, EXCLUDED.last_fetched_at)
+"""
+
+
+def update_hashtag_counts(cursor, links_sql, params=()):
+    """Add the (hashtag_id, tweet_id) links returned by links_sql to DailyHashtagCount"""
+    cursor.execute(
+        HASHTAG_COUNTS_SQL.format(links_sql=links_sql),
+        [*params, settings.TIME_ZONE],
+    )
+    logger.debug(f"Updated {cursor.rowcount} daily hashtag counts.")
+
+
+def update_follower_counts(cursor, counts_sql, params=()):
+    """Add the (user_id, fetched_at, count) rows returned by counts_sql to DailyFollowerCount"""
+    cursor.execute(
+        FOLLOWER_COUNTS_SQL.format(counts_sql=counts_sql),
+        [settings.TIME_ZONE, *params],
+    )
+    logger.debug(f"Updated {cursor.rowcount} daily follower counts.")
+
+
+def add_hashtag_links(cursor, links):
+    """Add a list of new (hashtag_id, tweet_id) links to DailyHashtagCount"""
+    hashtag_ids, tweet_ids = zip(*links)
+    update_hashtag_counts(
+        cursor,
+        "SELECT * FROM unnest(%s::integer[], %s::bigint[])",
+        [list(hashtag_ids), list(tweet_ids)],
+    )
+
+
+def add_follower_counts(cursor, follower_counts):
+    """Add a list of (user_id, fetched_at, count) to DailyFollowerCount"""
+    user_ids, fetched_ats, counts = zip(*follower_counts)
+    update_follower_counts(
+        cursor,
+        "SELECT * FROM unnest(%s::bigint[], %s::timestamptz[], %s::integer[])",
+        [list(user_ids), list(fetched_ats), list(counts)],
+    )
+
+
+def _filter_users(queryset, usernames):
+    if not usernames:
+        return queryset
+    # Twitter handles are case insensitive
+    user_filter = Q()
+    for username in usernames:
+        user_filter |= Q(user__screen_name__iexact=username)
+    return queryset.filter(user_filter)
+
+
+def hashtag_trends(usernames=None, days=7, limit=10):
+    """
+    Return the most used hashtags of the last days per user.
+
+    Returns a dict {screen_name: [(hashtag, count), ...]}, most used hashtags first.
+    """
+    since = timezone.localdate() - timedelta(days=days - 1)
+    counts = _filter_users(DailyHashtagCount.objects.filter(date__gte=since), usernames)
+    counts = (
+        counts.values_list("user__screen_name", "hashtag")
+        .annotate(total=Sum("count"))
+        .order_by("user__screen_name", "-total", "hashtag")
+    )
+    return {
+        screen_name: [(hashtag, total) for _, hashtag, total in rows][:limit]
+        for screen_name, rows in groupby(counts, key=lambda row: row[0])
+    }
+
+
+def follower_growth(usernames=None, days=7):
+    """
+    Return the follower count at the end of each of the last days per user.
+
+    Returns a dict {screen_name: [(date, count, delta), ...]}, oldest day first.
+    The delta is the change since the previous day with data. For the first day,
+    it is the change during that day.
+    """
+    since = timezone.localdate() - timedelta(days=days - 1)
+    counts = _filter_users(DailyFollowerCount.objects.filter(date__gte=since), usernames)
+    counts = (
+        counts.annotate(
+            previous_count=Window(
+                Lag("last_count"),
+                partition_by=[F("user_id")],
+                order_by=F("date").asc(),
+            )
+        )
+        .values_list(
+            "user__screen_name", "date", "first_count", "last_count", "previous_count"
+        )
+        .order_by("user__screen_name", "date")
+    )
+    growth = {}
+    for screen_name, date, first_count, last_count, previous_count in counts:
+        if previous_count is None:
+            previous_count = first_count
+        growth.setdefault(screen_name, []).append(
+            (date, last_count, last_count - previous_count)
+        )
+    return growth
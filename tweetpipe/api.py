@@ -0,0 +1,198 @@
+"""
+Backends to interact with the twitter api.
+
+The extract phase only needs the timeline, every tweet contains its user.
+All backends return the raw json (python dicts) sent by twitter, this makes it
+possible to record responses and replay them later without hitting the api.
+
+Available backends:
+    LiveAPI - talk to twitter using tweepy
+    RecordingAPI - like LiveAPI, but keep a copy of every response in the FixtureCache
+    ReplayAPI - answer all requests from the FixtureCache (no network access)
+"""
+import hashlib
+import json
+import time
+
+import tweepy
+from loguru import logger
+
+from django.utils import timezone
+
+from codec import get_codec
+from config import settings
+import utils
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
+
+
+class FixtureNotFound(LookupError):
+    pass
+
+
+class FixtureCache:
+    """
+    Content addressed cache for raw api responses.
+
+    Every payload is stored once under the sha256 of its content (objects/).
+    Requests are mapped onto payloads by small index files (requests/), keyed by
+    the sha256 of the request (method and parameters). Recording the same response
+    twice therefore only adds a new index entry.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or settings.API_CACHE_DIR
+        self.objects_dir = self.cache_dir / "objects"
+        self.requests_dir = self.cache_dir / "requests"
+        self.codec = get_codec()
+        settings.create_dir_if_missing(self.objects_dir)
+        settings.create_dir_if_missing(self.requests_dir)
+
+    @staticmethod
+    def request_key(method, params):
+        request = json.dumps({"method": method, "params": params}, sort_keys=True)
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def _object_path(self, digest):
+        return self.objects_dir / digest[:2] / f"{digest}.json"
+
+    def _request_path(self, key):
+        return self.requests_dir / f"{key}.json"
+
+    def put(self, method, params, payload, latency=0.0):
+        """Store payload and link it to the request (method, params)"""
+        content = self.codec.canonical(payload)
+        digest = hashlib.sha256(content).hexdigest()
+        object_path = self._object_path(digest)
+        if not object_path.exists():
+            settings.create_dir_if_missing(object_path.parent)
+            utils.write_atomic(object_path, content)
+
+        entry = {
+            "method": method,
+            "params": params,
+            "object": digest,
+            "latency": latency,
+            "recorded_at": utils.datetime_to_twitter_format(timezone.now()),
+        }
+        key = self.request_key(method, params)
+        utils.write_atomic(
+            self._request_path(key), json.dumps(entry, indent=2).encode()
+        )
+        logger.debug(f"Recorded {method}({params}) as {digest}")
+        return digest
+
+    def get(self, method, params):
+        """Return the recorded payload and its index entry for a request"""
+        key = self.request_key(method, params)
+        try:
+            entry = json.loads(self._request_path(key).read_bytes())
+        except FileNotFoundError:
+            raise FixtureNotFound(
+                f"No recorded response for {method}({params}) in {self.cache_dir}"
+            )
+        payload = self.codec.loads(self._object_path(entry["object"]).read_bytes())
+        return payload, entry
+
+
+class LiveAPI:
+    """Fetch data from twitter using tweepy"""
+
+    def __init__(self):
+        self._api = self._auth()
+
+    def _auth(self):
+        """Authenticate with Twitter and return a tweepy API inst."""
+
+        auth = tweepy.OAuthHandler(
+            settings.TWITTER_CONSUMER_KEY, settings.TWITTER_CONSUMER_SECRET_KEY
+        )
+        auth.set_access_token(
+            settings.TWITTER_ACCESS_TOKEN, settings.TWITTER_SECRET_ACCESS_TOKEN
+        )
+
+        return tweepy.API(auth)
+
+    def get_user(self, username):
+        """Get the user referenced by the username"""
+        # TODO: Catch Unknown User Exception
+        return self._api.get_user(username)._json
+
+    def timeline(self, username, count, tweet_mode="extended"):
+        """Get the 'count' most recent tweets of username"""
+        statuses = self._api.user_timeline(
+            screen_name=username, count=count, tweet_mode=tweet_mode
+        )
+        # Only keep the raw json, the tweepy objects are not needed after this point
+        return [status._json for status in statuses]
+
+
+class RecordingAPI(LiveAPI):
+    """Fetch data from twitter and record every response in the FixtureCache"""
+
+    def __init__(self, cache=None):
+        super().__init__()
+        self.cache = cache or FixtureCache()
+
+    def _record(self, method, params, call):
+        start = time.perf_counter()
+        payload = call()
+        latency = time.perf_counter() - start
+        self.cache.put(method, params, payload, latency=latency)
+        return payload
+
+    def get_user(self, username):
+        return self._record(
+            "get_user",
+            {"username": username},
+            lambda: super(RecordingAPI, self).get_user(username),
+        )
+
+    def timeline(self, username, count, tweet_mode="extended"):
+        return self._record(
+            "timeline",
+            {"username": username, "count": count, "tweet_mode": tweet_mode},
+            lambda: super(RecordingAPI, self).timeline(
+                username, count, tweet_mode=tweet_mode
+            ),
+        )
+
+
+class ReplayAPI:
+    """
+    Answer requests with responses from the FixtureCache.
+
+    If speed is set, every response is delayed by its recorded latency divided by speed
+    (speed=1 replays in real time, speed=100 is 100 times faster than the api).
+    Without speed, responses are returned as fast as possible.
+    """
+
+    def __init__(self, speed=None, cache=None):
+        self.speed = speed
+        self.cache = cache or FixtureCache()
+
+    def _replay(self, method, params):
+        payload, entry = self.cache.get(method, params)
+        if self.speed:
+            time.sleep(entry["latency"] / self.speed)
+        return payload
+
+    def get_user(self, username):
+        return self._replay("get_user", {"username": username})
+
+    def timeline(self, username, count, tweet_mode="extended"):
+        return self._replay(
+            "timeline",
+            {"username": username, "count": count, "tweet_mode": tweet_mode},
+        )
+
+
+API_BACKENDS = {"live": LiveAPI, "record": RecordingAPI, "replay": ReplayAPI}
+
+
+def get_api(backend, replay_speed=None):
+    """Instantiate the api backend"""
+    if backend == "replay":
+        return ReplayAPI(speed=replay_speed)
+    return API_BACKENDS[backend]()
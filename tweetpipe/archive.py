@@ -0,0 +1,179 @@
+"""
+Daily archives of raw dumps.
+
+Frequent polling leaves one small file per run and user (<username>/<timestamp>.json).
+The Compactor merges all dumps of a user and day into a single archive:
+
+    <username>/<YYYYMMDD>.archive
+
+An archive is a concatenation of gzip members (one per dump), followed by an index and
+a fixed size footer:
+
+    [gzip dump 1][gzip dump 2]...[index (json)][magic (8 bytes)][index offset (8)][index length (8)]
+
+The index maps the original filenames onto (offset, length) of their gzip member.
+Reading an archived dump only needs the footer, the index and the member itself
+(storage.read_range), the original filenames keep working for --rerun_file and are listed
+instead of the archive.
+"""
+import gzip
+import io
+import json
+import re
+import struct
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from loguru import logger
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
+
+ARCHIVE_SUFFIX = ".archive"
+ARCHIVE_VERSION = 1
+FOOTER_MAGIC = b"TPARCHV1"
+FOOTER = struct.Struct(">8sQQ")
+
+# <username>/<YYYYMMDD>-<HHMMSS><utc offset>.json (see extract.Tweets.filename)
+DUMP_PATTERN = re.compile(r"^(?P<username>[^/]+)/(?P<day>\d{8})-\d{6}[+-]\d{4}\.json$")
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def is_archive(filename):
+    return filename.endswith(ARCHIVE_SUFFIX)
+
+
+def archive_filename(filename):
+    """Name of the archive a dump is compacted into, None if filename is not a dump"""
+    match = DUMP_PATTERN.match(filename)
+    if match is None:
+        return None
+    return f"{match['username']}/{match['day']}{ARCHIVE_SUFFIX}"
+
+
+def parse_footer(footer):
+    """Return (offset, length) of the index"""
+    if len(footer) != FOOTER.size:
+        raise ArchiveError(f"Invalid archive footer of {len(footer)} bytes.")
+    magic, index_offset, index_length = FOOTER.unpack(footer)
+    if magic != FOOTER_MAGIC:
+        raise ArchiveError(f"Invalid archive magic {magic}.")
+    return index_offset, index_length
+
+
+def parse_index(index):
+    index = json.loads(index)
+    if index.get("version") != ARCHIVE_VERSION:
+        raise ArchiveError(f"Unsupported archive version {index.get('version')}.")
+    return index["members"]
+
+
+def split_archive(archive):
+    """Return the gzip members (bytes) and the index of a complete archive"""
+    index_offset, index_length = parse_footer(archive[-FOOTER.size :])
+    members = parse_index(archive[index_offset : index_offset + index_length])
+    return archive[:index_offset], members
+
+
+def compress(data):
+    """
+    Return data as a single gzip member.
+
+    mtime=0: the same dumps always result in the same archive
+    (gzip.compress only accepts mtime with python >= 3.8).
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as member:
+        member.write(data)
+    return buffer.getvalue()
+
+
+def build_archive(dumps, members=b"", index=None):
+    """
+    Build an archive from dumps {filename: bytes}.
+
+    The gzip members and the index of an existing archive can be passed in to
+    extend it, its members are kept as they are.
+    """
+    index = dict(index or {})
+    parts = [members]
+    offset = len(members)
+    for filename, data in sorted(dumps.items()):
+        member = compress(data)
+        index[filename] = [offset, len(member)]
+        parts.append(member)
+        offset += len(member)
+
+    index_bytes = json.dumps(
+        {"version": ARCHIVE_VERSION, "members": index}, sort_keys=True
+    ).encode()
+    parts.append(index_bytes)
+    parts.append(FOOTER.pack(FOOTER_MAGIC, offset, len(index_bytes)))
+    return b"".join(parts)
+
+
+def read_member(member):
+    return gzip.decompress(member)
+
+
+class Compactor:
+    """
+    Merge the dumps of every user and day into a daily archive.
+
+    Only days before the given day (UTC, default: today) are compacted, the current day
+    is still being written to. The original dumps are deleted after their archive is written.
+    If the archive of a day exists already (e.g. late reruns), the new dumps are added to it.
+    """
+
+    def __init__(self, storage_system):
+        self.storage = storage_system()
+
+    def dumps_by_day(self, username):
+        """Group the (not yet archived) dumps of username by (username, day)"""
+        username, _, filenames = self.storage.list(username, expand_archives=False)
+        days = defaultdict(list)
+        for filename in filenames:
+            match = DUMP_PATTERN.match(filename)
+            if match is not None:
+                days[(match["username"], match["day"])].append(filename)
+        return days
+
+    def compact_day(self, username, day, filenames):
+        archive = f"{username}/{day}{ARCHIVE_SUFFIX}"
+        dumps = {filename: self.storage.read_bytes(filename) for filename in filenames}
+
+        members, index = b"", {}
+        if self.storage.exists(archive):
+            members, index = split_archive(self.storage.read_bytes(archive))
+        self.storage.write_bytes(archive, build_archive(dumps, members, index))
+
+        # Only delete the dumps once they are safely stored in the archive
+        for filename in filenames:
+            self.storage.delete(filename)
+        logger.info(f"Compacted {len(filenames)} dump(s) into {archive}.")
+        return archive
+
+    def process(self, usernames=None, before=None):
+        """Compact the dumps of usernames (default: all users), return {archive: dumps}"""
+        before = before or datetime.now(timezone.utc).date()
+        before = before.strftime("%Y%m%d")
+        days = {}
+        for username in usernames or [""]:
+            days.update(self.dumps_by_day(username))
+
+        results = {}
+        for (username, day), filenames in sorted(days.items()):
+            if day >= before:
+                continue
+            archive = self.compact_day(username, day, filenames)
+            results[archive] = len(filenames)
+        return results
+
+
+def compact_dumps(storage_system, usernames=None, before=None):
+    """Entry function to compact the raw dumps into daily archives"""
+    compactor = Compactor(storage_system)
+    return compactor.process(usernames=usernames, before=before)
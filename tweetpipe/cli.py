@@ -3,6 +3,8 @@
 """
 import argparse
 import django
+from datetime import date
+from functools import partial
 import os
 import sys
 from loguru import logger
@@ -11,11 +13,21 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 # Necessary for the ORM to work
 django.setup()
 
+from aggregates import follower_growth, hashtag_trends
+from api import API_BACKENDS, get_api
+from archive import compact_dumps
 from config import settings
+from export import export_data
 from extract import get_tweet_data
-from load import load_data
-from storage import S3, LocalFileSystem
-from transform import get_transformed_data
+from jobs import Worker, enqueue
+from load import copy_load_data, load_data, parallel_load_data
+from models import Job
+from partitions import ensure_upcoming_partitions
+from pipeline import StagedPipeline
+from profiling import Profiler, null_profiler
+from search import search_tweets
+from storage import S3, CachedS3, LocalFileSystem, flush_uploads
+from transform import compact_data, get_transformed_data
 
 _log_file_name = __file__.split("/")[-1].split(".")[0]
 logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
@@ -28,7 +40,7 @@ Retrieve twitter data for a given username, transform the data
 and store it in a DB.
 
 The steps are:
-    1) Get last 'count' tweets of user ('user_handle')
+    1) Get last 'count' tweets of user(s) ('user_handle')
     2) Store the data along with metadata in a file (locally or on S3)
     3) Transform the raw data
     4) Store transformed data in the DB
@@ -36,6 +48,12 @@ The steps are:
 In addition to the base process, it is also possible to list all saved raw files and to
 re-run the pipeline using the data from the file storage instead of newly fetched data.
 
+With --staged, the steps run concurrently: while tweets of one user are fetched,
+the tweets of the previous users are transformed and stored.
+
+With --enqueue, the user handles and files are queued in the DB instead. Any number of
+workers (--worker), on any number of nodes, process the queued jobs.
+
 """
 
 epilog = """
@@ -43,7 +61,12 @@ epilog = """
 Written as first draft by Moritz Eilfort.
 
 """
-STORAGE_CHOICES = {"s3": S3, "local": LocalFileSystem}
+STORAGE_CHOICES = {"s3": S3, "s3-cached": CachedS3, "local": LocalFileSystem}
+LOADER_CHOICES = {
+    "orm": load_data,
+    "copy": copy_load_data,
+    "parallel": parallel_load_data,
+}
 
 parser = argparse.ArgumentParser(
     prog="tweetpipe",
@@ -53,7 +76,11 @@ parser = argparse.ArgumentParser(
 )
 
 parser.add_argument(
-    "--user_handle", "-u", help="twitter user handle (@'handle')", type=str
+    "--user_handle",
+    "-u",
+    help="twitter user handle(s) (@'handle')",
+    type=str,
+    nargs="+",
 )
 
 parser.add_argument(
@@ -74,7 +101,7 @@ parser.add_argument(
 parser.add_argument(
     "--storage",
     "-s",
-    default=STORAGE_CHOICES[settings.DEFAULT_STORAGE_SYSTEM],
+    default=settings.DEFAULT_STORAGE_SYSTEM,
     nargs="?",
     choices=STORAGE_CHOICES,
     help=f"select a storage location for raw data (default: {settings.DEFAULT_STORAGE_SYSTEM})",
@@ -82,10 +109,133 @@ parser.add_argument(
 
 parser.add_argument(
     "--rerun_file",
-    help="re-process and store data from a file stored in S3",
+    help="re-process and store data from file(s) stored in S3",
+    type=str,
+    nargs="+",
+)
+
+parser.add_argument(
+    "--staged",
+    action="store_true",
+    help="run extract, transform and load concurrently (useful for multiple users)",
+)
+
+parser.add_argument(
+    "--profile",
+    action="store_true",
+    help="profile the extract, transform and load stages of the run, not with --worker "
+    f"(profiles and a hotspot summary are written to {settings.PROFILE_DIR})",
+)
+
+parser.add_argument(
+    "--profile_top",
+    help=f"number of hotspots per stage in the profile summary (default: {settings.PROFILE_TOP})",
+    type=int,
+    default=settings.PROFILE_TOP,
+)
+
+parser.add_argument(
+    "--enqueue",
+    action="store_true",
+    help="queue --user_handle and --rerun_file as jobs for the workers instead of running them",
+)
+
+parser.add_argument(
+    "--worker",
+    action="store_true",
+    help="process queued jobs until interrupted (with the selected --storage, --loader and --api)",
+)
+
+parser.add_argument(
+    "--burst",
+    action="store_true",
+    help="stop the --worker once the queue is empty",
+)
+
+parser.add_argument(
+    "--export",
+    action="store_true",
+    help="export new rows of all tables as parquet files into the selected storage",
+)
+
+parser.add_argument(
+    "--compact",
+    action="store_true",
+    help="merge the raw files of every day before --until (default: today) into daily "
+    "archives per user (all users or --user_handle)",
+)
+
+parser.add_argument(
+    "--search",
+    help="full text search in the stored tweets (filter with --user_handle, --since, --until)",
     type=str,
 )
 
+parser.add_argument(
+    "--since",
+    help="only search tweets created at or after this date (YYYY-MM-DD)",
+    type=date.fromisoformat,
+)
+
+parser.add_argument(
+    "--until",
+    help="only search tweets created before this date, or only compact the raw files "
+    "of days before it (YYYY-MM-DD)",
+    type=date.fromisoformat,
+)
+
+parser.add_argument(
+    "--limit",
+    help="max. number of search results or hashtags per user (default: 20)",
+    type=int,
+    default=20,
+)
+
+parser.add_argument(
+    "--aggregates",
+    action="store_true",
+    help="print hashtag trends and follower growth of the last --days "
+    "(after the pipeline run if --user_handle or --rerun_file is given)",
+)
+
+parser.add_argument(
+    "--days",
+    help=f"number of days shown by --aggregates (default: {settings.AGGREGATE_DAYS})",
+    type=int,
+    default=settings.AGGREGATE_DAYS,
+)
+
+parser.add_argument(
+    "--loader",
+    default="orm",
+    choices=LOADER_CHOICES,
+    help="orm: upsert tweet by tweet, copy: bulk load batches with postgres COPY, "
+    "parallel: bulk load with --load_workers connections, sharded by user (a single user "
+    "is loaded by one connection) (default: orm)",
+)
+
+parser.add_argument(
+    "--load_workers",
+    help=f"number of DB connections of --loader parallel (default: {settings.LOAD_WORKERS})",
+    type=int,
+    default=settings.LOAD_WORKERS,
+)
+
+parser.add_argument(
+    "--api",
+    default=settings.DEFAULT_API_BACKEND,
+    choices=API_BACKENDS,
+    help="live: fetch from twitter, record: fetch and record responses locally, "
+    f"replay: answer from recorded responses (default: {settings.DEFAULT_API_BACKEND})",
+)
+
+parser.add_argument(
+    "--replay_speed",
+    help="delay replayed responses by their recorded latency divided by this factor "
+    "(default: no delay)",
+    type=float,
+)
+
 # Do not upload fetched tweets to s3
 # parser.add_argument("--avoid_s3", action="store_true", help="Do not upload to S3")
 
@@ -111,9 +261,66 @@ def list_files(username, storage_system):
     print("\n###############################################\n")
 
 
-def load(transformed_data):
+def search(query, usernames=None, since=None, until=None, limit=20):
+    """Print the tweets matching query, best matches first"""
+    tweets = search_tweets(
+        query, usernames=usernames, since=since, until=until, limit=limit
+    )
+    print("\n###############################################")
+    print(f"Search results for: {query}")
+    print("###############################################\n")
+    for tweet in tweets:
+        print(f"[{tweet.rank:.3f}] @{tweet.user.screen_name} {tweet.created_at:%Y-%m-%d %H:%M}")
+        print(f"    {tweet.text}")
+        print(f"    {tweet.tweet_url}\n")
+
+    print("###############################################\n")
+
+
+def export(storage_system):
+    """Export the loaded data as partitioned parquet files"""
+    results = export_data(storage_system)
+    print("\n###############################################")
+    for dataset, count in results.items():
+        print(f"Exported {count} row(s) of {dataset}")
+    print("###############################################\n")
+
+
+def print_aggregates(usernames=None, days=7, limit=10):
+    """Print the hashtag trends and follower growth from the summary tables"""
+    trends = hashtag_trends(usernames=usernames, days=days, limit=limit)
+    growth = follower_growth(usernames=usernames, days=days)
+    print("\n###############################################")
+    print(f"Aggregates of the last {days} day(s)")
+    print("###############################################\n")
+    for screen_name in sorted(set(trends) | set(growth)):
+        print(f"@{screen_name}")
+        print("    Followers:")
+        for day, count, delta in growth.get(screen_name, []):
+            print(f"        {day}  {count:>10}  {delta:+d}")
+        print("    Hashtags:")
+        for hashtag, count in trends.get(screen_name, []):
+            print(f"        #{hashtag}  {count}")
+        print()
+
+    print("###############################################\n")
+
+
+def compact(storage_system, usernames=None, before=None):
+    """Compact the raw files into daily archives"""
+    results = compact_dumps(storage_system, usernames=usernames, before=before)
+    print("\n###############################################")
+    print(f"Compacted {sum(results.values())} file(s) into {len(results)} archive(s)")
+    print("###############################################\n")
+    for archive, count in results.items():
+        print(f"{archive}: {count} file(s)")
+
+    print("\n###############################################\n")
+
+
+def load(transformed_data, loader=load_data):
     """Store transformed_data in the DB"""
-    result = load_data(transformed_data)
+    result = loader(transformed_data)
     return result
 
 
@@ -124,50 +331,207 @@ def transform(json_data):
     return transformed_data
 
 
-def extract(userhandle, count, storage_system):
+def extract(userhandle, count, storage_system, api=None):
     """Fetch tweets from api, convert it to json, and store it"""
-    json_tweets = get_tweet_data(userhandle, count, storage_system)
+    json_tweets = get_tweet_data(userhandle, count, storage_system, api=api)
     return json_tweets
 
 
-def rerun_pipeline(filename, storage_system):
+def profiled_transform(json_data, profiler=null_profiler):
+    """Transform raw data as profiled stage"""
+    with profiler.stage("transform"):
+        transformed_data = transform(json_data)
+        if profiler.enabled:
+            # The transformation is lazy, run it within its stage instead of the load stage
+            transformed_data = list(transformed_data)
+    return transformed_data
+
+
+def rerun_pipeline(
+    filenames, storage_system, loader=load_data, profiler=null_profiler
+):
     """
     Run pipelien using previously fetched data
 
-    Read content of a file with filename stored
+    Read content of files with filenames stored
     and continue with the transformation phase.
+
+    Tweets stored as the same object (dedup layout) in several of the files
+    are only processed once.
     """
-    logger.debug(f"Rerun data from file: {filename}")
     storage = storage_system()
-    json_tweets = storage.read(filename)
-    transformed_data = transform(json_tweets)
-    results = load(transformed_data)
-
-
-def run_pipeline(userhandle, count, storage_system):
+    processed_objects = set()
+    for filename in filenames:
+        logger.debug(f"Rerun data from file: {filename}")
+        with profiler.stage("extract"):
+            raw_data = storage.read(filename, exclude_objects=processed_objects)
+            json_tweets = compact_data(raw_data)
+            del raw_data
+        transformed_data = profiled_transform(json_tweets, profiler=profiler)
+        with profiler.stage("load"):
+            results = load(transformed_data, loader=loader)
+
+
+def run_pipeline(
+    userhandle,
+    count,
+    storage_system,
+    api=None,
+    loader=load_data,
+    profiler=null_profiler,
+):
     """Run the entire Extract, Transform and Load Pipeline"""
     logger.debug(f"Extract last {count} tweets for '{userhandle}'")
-    json_tweets = extract(userhandle, count, storage_system)
-    transformed_data = transform(json_tweets)
-    results = load(transformed_data)
+    with profiler.stage("extract"):
+        json_tweets = extract(userhandle, count, storage_system, api=api)
+    transformed_data = profiled_transform(json_tweets, profiler=profiler)
+    with profiler.stage("load"):
+        results = load(transformed_data, loader=loader)
+
+
+def run_staged_pipeline(
+    userhandles,
+    count,
+    storage_system,
+    api=None,
+    loader=load_data,
+    profiler=null_profiler,
+):
+    """Run the Extract, Transform and Load stages concurrently for all userhandles"""
+    logger.debug(f"Staged pipeline for last {count} tweets of {userhandles}")
+
+    def extract_stage(userhandle):
+        with profiler.stage("extract"):
+            return extract(userhandle, count, storage_system, api=api)
+
+    def load_stage(transformed_data):
+        # NOTE: The load stage also waits for the transform stage
+        with profiler.stage("load"):
+            return load(transformed_data, loader=loader)
+
+    pipeline = StagedPipeline(
+        extract=extract_stage,
+        transform=lambda json_data: profiled_transform(json_data, profiler=profiler),
+        load=load_stage,
+    )
+    pipeline.run(userhandles)
+
+
+def print_profile(profiler):
+    """Write the profiles and print the hotspot summary"""
+    summary = profiler.report()
+    print("\n###############################################")
+    print(f"Profile of run {profiler.run_id} ({profiler.output_dir})")
+    print("###############################################\n")
+    print(summary)
+    print("###############################################\n")
+
+
+def enqueue_jobs(userhandles, filenames, count):
+    """Queue a fetch job per user handle and a rerun job per file"""
+    queued = enqueue(Job.FETCH, userhandles or [], count=count)
+    queued += enqueue(Job.RERUN, filenames or [])
+    print("\n###############################################")
+    print(f"Queued {queued} new job(s)")
+    print("###############################################\n")
+
+
+def run_worker(storage_system, api=None, loader=load_data, burst=False):
+    """Process queued jobs"""
+
+    def fetch(job):
+        # Workers run for months, keep creating the upcoming partitions
+        ensure_upcoming_partitions()
+        run_pipeline(job.target, job.count, storage_system, api=api, loader=loader)
+        # The job is only done once its raw data is stored
+        flush_uploads()
+
+    def rerun(job):
+        ensure_upcoming_partitions()
+        rerun_pipeline([job.target], storage_system, loader=loader)
+
+    worker = Worker({Job.FETCH: fetch, Job.RERUN: rerun})
+    processed = worker.run(burst=burst)
+    print("\n###############################################")
+    print(f"{worker.worker_id} processed {processed} job(s)")
+    print("###############################################\n")
 
 
 def main():
     args = parser.parse_args()
     logger.debug(f"Starting TweetPipe")
     storage_system = STORAGE_CHOICES[args.storage]
+    loader = LOADER_CHOICES[args.loader]
+    if args.loader == "parallel":
+        if args.load_workers < 1:
+            parser.error(f"--load_workers must be at least 1, not {args.load_workers}")
+        loader = partial(parallel_load_data, workers=args.load_workers)
+    if args.profile and args.worker:
+        # A worker runs until it is interrupted, its profile would never be reported
+        parser.error("--profile can not be combined with --worker, profile single runs")
+    profiler = Profiler(top=args.profile_top) if args.profile else null_profiler
 
     if args.list:
-        username = args.user_handle or ""
-        logger.debug(f"Username:{username}")
-        list_files(username, storage_system)
+        for username in args.user_handle or [""]:
+            logger.debug(f"Username:{username}")
+            list_files(username, storage_system)
+    elif args.search:
+        search(
+            args.search,
+            usernames=args.user_handle,
+            since=args.since,
+            until=args.until,
+            limit=args.limit,
+        )
+    elif args.export:
+        export(storage_system)
+    elif args.compact:
+        compact(storage_system, usernames=args.user_handle, before=args.until)
+    elif args.enqueue:
+        enqueue_jobs(args.user_handle, args.rerun_file, args.count)
+    elif args.worker:
+        api = get_api(args.api, replay_speed=args.replay_speed)
+        run_worker(storage_system, api=api, loader=loader, burst=args.burst)
     elif args.rerun_file:
-        rerun_pipeline(args.rerun_file, storage_system)
+        ensure_upcoming_partitions()
+        rerun_pipeline(
+            args.rerun_file, storage_system, loader=loader, profiler=profiler
+        )
     elif args.user_handle:
-        run_pipeline(args.user_handle, args.count, storage_system)
-    else:
+        ensure_upcoming_partitions()
+        api = get_api(args.api, replay_speed=args.replay_speed)
+        if args.staged:
+            run_staged_pipeline(
+                args.user_handle,
+                args.count,
+                storage_system,
+                api=api,
+                loader=loader,
+                profiler=profiler,
+            )
+        else:
+            for userhandle in args.user_handle:
+                run_pipeline(
+                    userhandle,
+                    args.count,
+                    storage_system,
+                    api=api,
+                    loader=loader,
+                    profiler=profiler,
+                )
+    elif not args.aggregates:
         parser.print_help()
 
+    if args.aggregates:
+        # After the pipeline run (if any), of the given users (default: all)
+        print_aggregates(args.user_handle, days=args.days, limit=args.limit)
+
+    # Make sure all raw files are stored before reporting success
+    flush_uploads()
+
+    if profiler.enabled:
+        print_profile(profiler)
+
 
 if __name__ == "__main__":
     main()
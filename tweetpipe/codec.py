@@ -0,0 +1,153 @@
+"""
+JSON codecs used to (de-)serialize raw data.
+
+All codecs work on bytes: dumps returns UTF-8 encoded bytes, loads accepts bytes (or str).
+The fastest available library is used, unless a codec is selected in the settings (JSON_CODEC):
+    orjson - https://github.com/ijl/orjson
+    ujson - https://github.com/ultrajson/ultrajson
+    stdlib - python's json module (always available)
+
+canonical() returns a stable encoding, the same for all codecs (apart from the formatting
+of some floats) and byte-identical to the one the dedup layout (storage.py) has used from
+the start: json.dumps(obj, sort_keys=True, separators=(",", ":")), i.e. non-ASCII
+characters escaped as \\uXXXX. Use it whenever the bytes are hashed, a different encoding
+changes the content hashes of stored objects.
+"""
+import json
+
+from loguru import logger
+
+from config import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def stdlib_canonical(obj):
+    return json.dumps(obj, sort_keys=True, separators=(",", ":")).encode()
+
+
+def is_canonical(content):
+    """
+    True if content, encoded by another codec, contains no character json.dumps escapes.
+
+    Control characters are escaped by all codecs, json.dumps additionally escapes DEL and
+    all non-ASCII characters.
+    """
+    return content.isascii() and b"\x7f" not in content
+
+
+class JSONCodec:
+    """Base Class for all json codecs"""
+
+    name = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}()"
+
+    def dumps(self, obj, indent=None):
+        raise NotImplementedError(
+            f"{self.__class__.__name__}.dumps(obj, indent) Not Implemented."
+        )
+
+    def loads(self, data):
+        raise NotImplementedError(
+            f"{self.__class__.__name__}.loads(data) Not Implemented."
+        )
+
+    def canonical(self, obj):
+        raise NotImplementedError(
+            f"{self.__class__.__name__}.canonical(obj) Not Implemented."
+        )
+
+
+class StdlibCodec(JSONCodec):
+    name = "stdlib"
+
+    def dumps(self, obj, indent=None):
+        return json.dumps(obj, indent=indent or None).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def canonical(self, obj):
+        return stdlib_canonical(obj)
+
+
+class OrjsonCodec(JSONCodec):
+    name = "orjson"
+
+    def dumps(self, obj, indent=None):
+        # orjson only supports an indentation of 2 spaces
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def canonical(self, obj):
+        content = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+        # Re-encoding with json is faster than escaping the few non-ASCII tweets
+        return content if is_canonical(content) else stdlib_canonical(obj)
+
+
+class UjsonCodec(JSONCodec):
+    name = "ujson"
+
+    def dumps(self, obj, indent=None):
+        return ujson.dumps(
+            obj, indent=indent or 0, ensure_ascii=False, escape_forward_slashes=False
+        ).encode()
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+    def canonical(self, obj):
+        content = ujson.dumps(
+            obj, sort_keys=True, ensure_ascii=False, escape_forward_slashes=False
+        ).encode()
+        return content if is_canonical(content) else stdlib_canonical(obj)
+
+
+CODECS = {"orjson": OrjsonCodec, "ujson": UjsonCodec, "stdlib": StdlibCodec}
+AVAILABLE_CODECS = {
+    "orjson": orjson is not None,
+    "ujson": ujson is not None,
+    "stdlib": True,
+}
+
+_codec = None
+
+
+def get_codec(name=None):
+    """
+    Return the codec selected by name (default: settings.JSON_CODEC).
+
+    'auto' selects the fastest available codec, an unavailable codec falls back to stdlib.
+    """
+    global _codec
+    if name is None and _codec is not None:
+        return _codec
+
+    selected = name or settings.JSON_CODEC
+    if selected != "auto" and selected not in CODECS:
+        raise ValueError(
+            f"Unknown JSON codec '{selected}', use one of: auto, {', '.join(CODECS)}"
+        )
+    if selected == "auto":
+        selected = next(name for name, available in AVAILABLE_CODECS.items() if available)
+    elif not AVAILABLE_CODECS[selected]:
+        logger.warning(f"JSON codec '{selected}' is not installed, use stdlib json.")
+        selected = "stdlib"
+
+    codec = CODECS[selected]()
+    if name is None:
+        _codec = codec
+        logger.debug(f"Using {codec} for json")
+    return codec
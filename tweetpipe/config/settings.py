@@ -21,6 +21,12 @@ CONFIG_DIR = PROJECT_DIR / "config"
 LOG_DIR = ROOT_DIR / "logs"
 DATA_DIR = ROOT_DIR / "data"
 LOCAL_STORAGE_DIR = DATA_DIR / "local"
+SPOOL_DIR = DATA_DIR / "spool"
+API_CACHE_DIR = DATA_DIR / "api_cache"
+PREFILTER_DIR = DATA_DIR / "prefilter"
+DEAD_LETTER_DIR = DATA_DIR / "dead_letter"
+S3_CACHE_DIR = DATA_DIR / "s3_cache"
+PROFILE_DIR = DATA_DIR / "profiles"
 TEST_DIR = ROOT_DIR / "tests"
 ENV_PATH = CONFIG_DIR / ".env"
 
@@ -56,11 +62,71 @@ DATABASES = {
     }
 }
 
+# JSON library used for raw data: auto (fastest installed), orjson, ujson or stdlib (see codec.py)
+JSON_CODEC = os.getenv("JSON_CODEC", default="auto")
+# Indentation of stored json files (0 = compact, smaller and faster)
+JSON_INDENT = int(os.getenv("JSON_INDENT", default=2))
+
+# Layout of raw files: dump (full tweets in every file) or dedup (see storage.BaseStorage)
+RAW_STORAGE_LAYOUT = os.getenv("RAW_STORAGE_LAYOUT", default="dump")
+# Prefix of the deduplicated tweet and user objects, '-' never collides with a username
+OBJECT_PREFIX = os.getenv("OBJECT_PREFIX", default="tweetpipe-objects")
+
+# Write raw files in a background thread (see storage.BackgroundUploader)
+UPLOAD_IN_BACKGROUND = os.getenv("UPLOAD_IN_BACKGROUND", default="True") == "True"
+# Raw files held in memory while waiting for the upload, further files are spooled to disk
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", default=4))
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", default=3))
+
+# Drop already stored tweets before the transformation: off, skip or refresh_recent
+# (refresh_recent still processes tweets of the last PREFILTER_REFRESH_DAYS, see prefilter.py)
+PREFILTER_POLICY = os.getenv("PREFILTER_POLICY", default="off")
+PREFILTER_REFRESH_DAYS = int(os.getenv("PREFILTER_REFRESH_DAYS", default=2))
+
+# Reject rows violating model constraints before loading them (see validation.py)
+VALIDATE_ROWS = os.getenv("VALIDATE_ROWS", default="True") == "True"
+
+# Number of transformed tweets per COPY batch (see load.CopyLoader)
+COPY_BATCH_SIZE = int(os.getenv("COPY_BATCH_SIZE", default=5000))
+
+# Number of DB connections of the parallel loader (see load.ParallelLoader)
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", default=4))
+
+# Max. number of raw user dumps/transformed tweets waiting between stages (see pipeline.py)
+PIPELINE_RAW_QUEUE_SIZE = int(os.getenv("PIPELINE_RAW_QUEUE_SIZE", default=2))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", default=1000))
+
+# Default number of days printed by --aggregates (see aggregates.py)
+AGGREGATE_DAYS = int(os.getenv("AGGREGATE_DAYS", default=7))
+
+# Number of hotspots per stage in the --profile summary (see profiling.py)
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", default=20))
+
+# Monthly partitions created ahead of time (see partitions.py)
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", default=2))
+
+# Job queue (see jobs.py)
+# Seconds a claimed job is leased to a worker, extended by its heartbeat
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", default=60))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", default=3))
+# Seconds an idle worker waits before it looks for new jobs
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", default=5))
+
+# Parquet export (see export.py)
+# NOTE: twitter handles can not contain '-', the prefix never collides with a username
+EXPORT_PREFIX = os.getenv("EXPORT_PREFIX", default="tweetpipe-exports")
+# Rows fetched per round trip of the server side cursor
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", default=2000))
+# Max. number of rows held in memory before the partitions are written
+EXPORT_BUFFER_ROWS = int(os.getenv("EXPORT_BUFFER_ROWS", default=100000))
+
 # TWITTER
 TWITTER_CONSUMER_KEY = os.getenv("TWITTER_CONSUMER_KEY")
 TWITTER_CONSUMER_SECRET_KEY = os.getenv("TWITTER_CONSUMER_SECRET_KEY")
 TWITTER_ACCESS_TOKEN = os.getenv("TWITTER_ACCESS_TOKEN")
 TWITTER_SECRET_ACCESS_TOKEN = os.getenv("TWITTER_SECRET_ACCESS_TOKEN")
+# Select the api backend: live, record or replay (see api.py)
+DEFAULT_API_BACKEND = os.getenv("DEFAULT_API_BACKEND", default="live")
 # Timeformat (Example: "Tue Jun 04 23:12:08 +0000 2019")
 TWITTER_TIME_FORMAT = "%a %b %d %H:%M:%S %z %Y"
 
@@ -69,3 +135,9 @@ AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_BUCKET_NAME = os.getenv("AWS_BUCKET_NAME", default="tweetpipe")
 AWS_REGION_NAME = os.getenv("AWS_REGION_NAME", default="eu-central-1")
+# Files larger than the threshold are uploaded in parts (min. part size on S3 is 5MB)
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", default=16 * 1024 ** 2))
+S3_MULTIPART_CHUNK_SIZE = int(os.getenv("S3_MULTIPART_CHUNK_SIZE", default=8 * 1024 ** 2))
+# Local cache in front of S3 (--storage s3-cached, see storage.CachedS3)
+S3_CACHE_MAX_SIZE = int(os.getenv("S3_CACHE_MAX_SIZE", default=1024 ** 3))
+S3_CACHE_LIST_TTL = int(os.getenv("S3_CACHE_LIST_TTL", default=300))
@@ -2,11 +2,10 @@
 Module to hold Base Classes used in this project.
 
 The ModelParser BaseClass provides all the core parsing machinery.
+The ParserRegistry collects the ModelParsers and everything derived from their models.
 """
 from loguru import logger
 
-import utils
-
 
 class ModelParser:
     """Base Class for ModelParsers.
@@ -32,6 +31,9 @@ class ModelParser:
 
     """
 
+    # Set by the ParserRegistry, the rows are built from these fields after the transformations
+    columns = None
+
     def __init__(self):
         if not hasattr(self, "data"):
             raise NotImplementedError(
@@ -116,9 +118,114 @@ class ModelParser:
         for transformation in self.general_transformations:
             transformation()
 
+    def filter_model_fields(self):
+        """Only keep the fields which are columns of the model"""
+        if self.columns is not None:
+            data = self.data
+            self.data = {column: data[column] for column in self.columns if column in data}
+
     def process(self):
         """Run the field transformations and return the data in a processable format"""
         self.pre_transformation_filter()
         self.run_field_transformations()
         self.run_general_transformations()
+        self.filter_model_fields()
         return {self._model: self.data}
+
+
+class ParserRegistry:
+    """
+    Registry for ModelParsers.
+
+    ModelParsers are added with the register decorator. Everything which depends on
+    the model of a parser is computed once, during the registration:
+        columns - fields the parser emits (concrete, non relational model fields,
+            without the fields listed in model.generated_fields)
+        relations - foreign keys of the model {field_name: related_model}
+        many_to_many - many-to-many fields of the model {field_name: related_model}
+        source_fields - paths of the raw tweet read by all parsers
+        model_order - registered models, ordered such that every model comes after
+            the models it references (the order in which they have to be loaded)
+
+    Parsers need to define the class attributes '_model' and 'relevant_fields'.
+    A relevant_field ending in '.*' only reads the sub fields which are model columns,
+    fields which are not named after columns (like the tweetpipe metadata) have to be
+    listed explicitly.
+    """
+
+    def __init__(self):
+        self.parsers = []
+        self.columns = {}
+        self.relations = {}
+        self.many_to_many = {}
+        self.source_fields = []
+        self.model_order = ()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(parsers={self.parsers})"
+
+    def register(self, parser_class):
+        model = parser_class._model
+        fields = model._meta.concrete_fields
+        generated_fields = getattr(model, "generated_fields", ())
+        self.columns[model] = tuple(
+            field.name
+            for field in fields
+            if not field.is_relation
+            and field.name not in generated_fields
+            and not (field.primary_key and field.get_internal_type() == "AutoField")
+        )
+        self.relations[model] = {
+            field.name: field.related_model for field in fields if field.is_relation
+        }
+        self.many_to_many[model] = {
+            field.name: field.related_model for field in model._meta.many_to_many
+        }
+        parser_class.columns = self.columns[model]
+
+        for source_field in parser_class.source_fields():
+            self.source_fields.extend(
+                self.expand_source_field(source_field, self.columns[model])
+            )
+
+        self.parsers.append(parser_class)
+        self.model_order = self.order_models()
+        logger.debug(f"Registered {parser_class.__name__} for {model.__name__}")
+        return parser_class
+
+    @staticmethod
+    def expand_source_field(source_field, columns):
+        """Replace 'field.*' with the paths of all columns below field"""
+        prefix, _, field_name = source_field.rpartition(".")
+        if not prefix or field_name not in ("*", ""):
+            return [source_field]
+        return [f"{prefix}.{column}" for column in sorted(columns)]
+
+    def order_models(self):
+        """Order the registered models by their dependencies (stable topological sort)"""
+        models = []
+        for parser_class in self.parsers:
+            if parser_class._model not in models:
+                models.append(parser_class._model)
+
+        ordered = []
+        remaining = list(models)
+        while remaining:
+            for model in remaining:
+                dependencies = {
+                    **self.relations[model],
+                    **self.many_to_many[model],
+                }.values()
+                if all(
+                    dependency in ordered
+                    or dependency not in models
+                    or dependency is model
+                    for dependency in dependencies
+                ):
+                    ordered.append(model)
+                    remaining.remove(model)
+                    break
+            else:
+                raise ValueError(f"Circular dependency between the models {remaining}")
+
+        return tuple(ordered)
@@ -0,0 +1,234 @@
+"""
+Export the loaded data into columnar (parquet) files for analytics.
+
+Heavy analytical queries should not compete with the ingestion for the DB.
+The Exporter streams the rows of every dataset out of postgres (server side cursors,
+only chunk_size rows are held by the cursor) and writes them into parquet files,
+partitioned by user and date:
+
+    tweetpipe-exports/<dataset>/user_id=<id>/date=<YYYY-MM-DD>/<run>-<part>.parquet
+
+The files are written with one of the storage systems (storage.[S3|LocalFileSystem]).
+
+Exports are incremental: every row carries the id of the transaction which inserted or
+last updated it (load_txid, migration 0010). Each run exports the rows of all transactions
+which finished since the previous run, no matter when the tweets were fetched, and stores
+the oldest still running transaction as watermark of the next run (state.json).
+Rows which are updated by a later pipeline run are exported again, use the row with the
+latest fetched_at per id when reading the files.
+
+The export files live under EXPORT_PREFIX, they are not listed as raw files.
+
+pyarrow is an optional dependency (requirements/optional.txt), only needed for the export.
+"""
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from loguru import logger
+
+from config import settings
+import utils
+from models import FollowerCount, Hashtag, Tweet, User
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
+
+
+class Dataset:
+    """
+    Description of a single exported dataset.
+
+        name: str - name of the dataset (directory in the export)
+        queryset: callable returning the base queryset
+        fields: list of field lookups which are exported as columns
+        user_field: lookup used to partition by user
+        date_field: lookup used to partition by date
+        table: table whose load_txid is used for the incremental export
+    """
+
+    def __init__(self, name, queryset, fields, user_field, date_field, table):
+        self.name = name
+        self.queryset = queryset
+        self.fields = fields
+        self.user_field = user_field
+        self.date_field = date_field
+        self.table = table
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(name='{self.name}')"
+
+    def rows(self, since, until, chunk_size):
+        """Stream all rows with since <= load_txid < until as tuples"""
+        load_txid = RawSQL(f"{connection.ops.quote_name(self.table)}.load_txid", ())
+        queryset = (
+            self.queryset()
+            .annotate(load_txid=load_txid)
+            .filter(load_txid__gte=since, load_txid__lt=until)
+        )
+        # iterator() uses a server side cursor on postgres, memory stays bounded
+        return queryset.values_list(*self.fields).iterator(chunk_size=chunk_size)
+
+
+DATASETS = (
+    Dataset(
+        name="users",
+        queryset=User.objects.all,
+        fields=[field.attname for field in User._meta.concrete_fields],
+        user_field="id",
+        date_field="fetched_at",
+        table=User._meta.db_table,
+    ),
+    Dataset(
+        name="follower_counts",
+        queryset=FollowerCount.objects.all,
+        fields=[field.attname for field in FollowerCount._meta.concrete_fields],
+        user_field="user_id",
+        date_field="fetched_at",
+        table=FollowerCount._meta.db_table,
+    ),
+    Dataset(
+        name="tweets",
+        queryset=Tweet.objects.all,
+        fields=[
+            field.attname
+            for field in Tweet._meta.concrete_fields
+            if field.name not in Tweet.generated_fields
+        ],
+        user_field="user_id",
+        date_field="created_at",
+        table=Tweet._meta.db_table,
+    ),
+    Dataset(
+        name="hashtags",
+        queryset=Hashtag.tweets.through.objects.all,
+        fields=[
+            "hashtag_id",
+            "hashtag__text",
+            "tweet_id",
+            "tweet__user_id",
+            "tweet__created_at",
+            "tweet__fetched_at",
+        ],
+        user_field="tweet__user_id",
+        date_field="tweet__created_at",
+        table=Hashtag.tweets.through._meta.db_table,
+    ),
+)
+
+
+class Exporter:
+    def __init__(self, storage_system, datasets=DATASETS, chunk_size=None):
+        if pa is None:
+            raise ImportError(
+                "The export requires pyarrow, install requirements/optional.txt"
+            )
+        self.storage = storage_system()
+        self.datasets = datasets
+        self.chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+        self.buffer_rows = settings.EXPORT_BUFFER_ROWS
+        self.prefix = settings.EXPORT_PREFIX
+        self.run_id = utils.datetime_to_string_format(timezone.now())
+        self.parts = defaultdict(int)
+
+    @property
+    def state_filename(self):
+        return f"{self.prefix}/state.json"
+
+    def read_state(self):
+        if self.storage.exists(self.state_filename):
+            return self.storage.read(self.state_filename)
+        return {}
+
+    def write_state(self, state):
+        self.storage.write(self.state_filename, state)
+
+    def partition_filename(self, dataset, user_id, date):
+        part = self.parts[(dataset.name, user_id, date)]
+        self.parts[(dataset.name, user_id, date)] += 1
+        return (
+            f"{self.prefix}/{dataset.name}/user_id={user_id}/date={date}/"
+            f"{self.run_id}-{part:04d}.parquet"
+        )
+
+    def write_partition(self, dataset, user_id, date, rows):
+        """Write the buffered rows of a single partition as parquet file"""
+        columns = [name.replace("__", "_") for name in dataset.fields]
+        table = pa.Table.from_pydict(
+            {column: list(values) for column, values in zip(columns, zip(*rows))}
+        )
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink, compression="snappy")
+        filename = self.partition_filename(dataset, user_id, date)
+        self.storage.write_bytes(filename, sink.getvalue().to_pybytes())
+        logger.debug(f"Exported {len(rows)} rows to {filename}")
+
+    def flush(self, dataset, partitions):
+        for (user_id, date), rows in partitions.items():
+            self.write_partition(dataset, user_id, date, rows)
+        partitions.clear()
+
+    def export_dataset(self, dataset, since, until):
+        """Export all new rows of dataset, return the number of rows"""
+        user_idx = dataset.fields.index(dataset.user_field)
+        date_idx = dataset.fields.index(dataset.date_field)
+
+        partitions = defaultdict(list)
+        buffered = 0
+        count = 0
+        for row in dataset.rows(since, until, self.chunk_size):
+            partitions[(row[user_idx], row[date_idx].date())].append(row)
+            buffered += 1
+            count += 1
+            if buffered >= self.buffer_rows:
+                # Bound the memory usage, even if this results in smaller files
+                self.flush(dataset, partitions)
+                buffered = 0
+
+        self.flush(dataset, partitions)
+        return count
+
+    @staticmethod
+    def oldest_running_txid():
+        """All transactions before this one have finished, their rows are visible"""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+            return cursor.fetchone()[0]
+
+    def process(self):
+        """Export all datasets incrementally and return the exported row count per dataset"""
+        state = self.read_state()
+        # Rows of transactions which are still running are exported by the next run
+        until = self.oldest_running_txid()
+        # Runs within the same second must not overwrite each other's files
+        self.run_id = f"{utils.datetime_to_string_format(timezone.now())}-{until}"
+        results = {}
+        for dataset in self.datasets:
+            since = state.get(dataset.name, 0)
+            if not isinstance(since, int):
+                logger.warning(
+                    f"Watermark {since} of {dataset} is not a load_txid (exported before "
+                    "migration 0010), export the entire dataset again."
+                )
+                since = 0
+            logger.info(f"Export {dataset} from load_txid {since} until {until}")
+            count = self.export_dataset(dataset, since, until)
+            state[dataset.name] = until
+            # Persist the progress after every dataset
+            self.write_state(state)
+            results[dataset.name] = count
+
+        return results
+
+
+def export_data(storage_system):
+    """Entry function to run the incremental parquet export"""
+    exporter = Exporter(storage_system)
+    return exporter.process()
@@ -1,18 +1,19 @@
 """
 Extract tweets for a given user.
 
-Use tweepy to interact with the twitter api.
+The twitter api is accessed through one of the backends in api.py (live, record or replay).
 
 After fetching the data, also upload the raw data along with metadata to S3,
 incase the later steps need to be rerun at some point.
 """
-import boto3
-import tweepy
 from loguru import logger
 
 from django.utils import timezone
 
+from api import LiveAPI
 from config import settings
+from storage import get_uploader
+from transform import compact_data
 import utils
 
 # from config import Config
@@ -21,33 +22,15 @@ logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
 
 
 class Tweets:
-    def __init__(self, username, count, storage_system):
+    def __init__(self, username, count, storage_system, api=None):
         self._tweet_mode = "extended"
-        self._api = self._auth()
+        self._api = api or LiveAPI()
 
         self.username = username
         self.count = count
-        self.user = self.get_user()
 
         self.storage = storage_system()
 
-    def _auth(self):
-        """Authenticate with Twitter and return a tweepy API inst."""
-
-        auth = tweepy.OAuthHandler(
-            settings.TWITTER_CONSUMER_KEY, settings.TWITTER_CONSUMER_SECRET_KEY
-        )
-        auth.set_access_token(
-            settings.TWITTER_ACCESS_TOKEN, settings.TWITTER_SECRET_ACCESS_TOKEN
-        )
-
-        return tweepy.API(auth)
-
-    def get_user(self):
-        """Get the user referenced by the username"""
-        # TODO: Catch Unknown User Exception
-        return self._api.get_user(self.username)
-
     @property
     def fetched(self):
         return hasattr(self, "fetched_at") and hasattr(self, "tweets")
@@ -55,25 +38,24 @@ class Tweets:
     def fetch(self):
         """Fetch the 'count' most recent tweets for 'username'"""
         fetched_at = timezone.now()
-        tweets = self.user.timeline(
-            tweet_mode=self._tweet_mode, count=self.count
+        tweets = self._api.timeline(
+            self.username, self.count, tweet_mode=self._tweet_mode
         )
         self.fetched_at = fetched_at
         self.tweets = tweets
 
     def enhance_data(self):
-        """Append metadata to dict and convert tweepy.tweet objs to dicts"""
+        """Append metadata to the raw tweet dicts"""
 
         enhanced_data = {"tweets": []}
+        # The parsers read these keys, see transform.METADATA_FIELDS
         metadata = {
             "fetched_at": utils.datetime_to_twitter_format(self.fetched_at),
             "username": self.username,
             "count": self.count,
         }
-        for tweet in self.tweets:
-            # self.tweets is a list of tweepy.Tweet objects
-            # tweet._json returns the returned data as a dictionary
-            tweet_dict = tweet._json
+        for tweet_dict in self.tweets:
+            # self.tweets is a list of raw tweet dicts returned by the api backend
             tweet_dict["tweetpipe_metadata"] = metadata
             enhanced_data["tweets"].append(tweet_dict)
 
@@ -96,22 +78,39 @@ class Tweets:
         logger.debug(f"Write tweets to storage with filename {self.filename}.")
         self.storage.write(self.filename, self.enhanced_data)
 
+    def write_in_background(self):
+        """Hand the data to the background uploader and return immediately"""
+        logger.debug(f"Queue tweets for upload with filename {self.filename}.")
+        get_uploader(self.storage).submit(self.filename, self.enhanced_data)
 
-def get_tweet_data(username, count, storage_system):
+
+def get_tweet_data(username, count, storage_system, api=None):
     """
     Entry function to extract count tweets from username
 
         username: str
         count: int
         storage: storage class (storage.[S3|LocalFileSystem])
+        api: api backend instance (api.[LiveAPI|RecordingAPI|ReplayAPI]), default: LiveAPI
 
     If storage is set, store the raw file with appended
-    metadata.
+    metadata. With UPLOAD_IN_BACKGROUND, the file is written by the
+    BackgroundUploader (call storage.flush_uploads() before exiting).
+
+    The full raw data is only kept until it is stored, the returned data
+    contains compact tweet records (see transform.compact_data).
     """
     tweets = Tweets(
-        username=username, count=count, storage_system=storage_system
+        username=username,
+        count=count,
+        storage_system=storage_system,
+        api=api,
     )
     tweet_data = tweets.get_data()
-    if storage_system:
+    if storage_system and settings.UPLOAD_IN_BACKGROUND:
+        # The uploader keeps the full data until it is written,
+        # it is not modified by the following steps.
+        tweets.write_in_background()
+    elif storage_system:
         tweets.write()
-    return tweet_data
+    return compact_data(tweet_data)
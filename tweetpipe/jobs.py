@@ -0,0 +1,234 @@
+"""
+Job queue stored in the database, shared by any number of workers on any number of nodes.
+
+Jobs (models.Job) are claimed with SELECT ... FOR UPDATE SKIP LOCKED: concurrent workers
+skip the rows locked by each other instead of waiting for them, every job is handed out once.
+A claimed job is leased to its worker for JOB_LEASE_SECONDS. While the job runs, a heartbeat
+thread extends the lease. If a worker dies, its lease expires and the job is claimed again
+by another worker (at most JOB_MAX_ATTEMPTS times).
+
+All times are taken from the database clock, the clocks of the nodes do not matter.
+
+Kinds of jobs:
+    fetch - run the pipeline for a user handle (target) with count tweets
+    rerun - rerun the pipeline for a raw file (target)
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import DateTimeField, ExpressionWrapper, F, Q
+from django.db.models.functions import Now
+from loguru import logger
+
+from config import settings
+from models import Job
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
+
+
+def lease_expiry(seconds):
+    """Expression for the end of a lease starting now (database time)"""
+    return ExpressionWrapper(
+        Now() + timedelta(seconds=seconds), output_field=DateTimeField()
+    )
+
+
+def enqueue(kind, targets, count=None):
+    """Queue a job of kind for every target, return the number of new jobs"""
+    queued = 0
+    for target in targets:
+        try:
+            # The savepoint keeps a failed insert from breaking an outer transaction
+            with transaction.atomic():
+                Job.objects.create(kind=kind, target=target, count=count)
+            queued += 1
+        except IntegrityError:
+            logger.info(f"A {kind} job for {target} is already queued.")
+    return queued
+
+
+def claim(worker_id, lease_seconds=None, max_attempts=None):
+    """Lease the oldest available job to worker_id, return None if there is none"""
+    lease_seconds = lease_seconds or settings.JOB_LEASE_SECONDS
+    max_attempts = max_attempts or settings.JOB_MAX_ATTEMPTS
+    available = Q(status=Job.PENDING) | Q(
+        status=Job.RUNNING, lease_expires_at__lt=Now()
+    )
+    while True:
+        with transaction.atomic():
+            job = (
+                Job.objects.select_for_update(skip_locked=True)
+                .filter(available)
+                .order_by("created_at", "id")
+                .first()
+            )
+            if job is None:
+                return None
+
+            if job.attempts >= max_attempts:
+                # The lease of the last attempt expired, the worker died while running it
+                job.status = Job.FAILED
+                job.error = job.error or f"Lease of {job.worker} expired."
+                job.save(update_fields=["status", "error", "updated_at"])
+                logger.error(f"{job} failed after {job.attempts} attempts.")
+                continue
+
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.RUNNING,
+                worker=worker_id,
+                attempts=F("attempts") + 1,
+                lease_expires_at=lease_expiry(lease_seconds),
+                updated_at=Now(),
+            )
+        job.refresh_from_db()
+        logger.info(f"{worker_id} claimed {job} (attempt {job.attempts}).")
+        return job
+
+
+def _owned(job, worker_id):
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=worker_id)
+
+
+def extend_lease(job, worker_id, lease_seconds):
+    """Extend the lease of job, return False if the worker does not hold it anymore"""
+    return bool(
+        _owned(job, worker_id).update(
+            lease_expires_at=lease_expiry(lease_seconds), updated_at=Now()
+        )
+    )
+
+
+def complete(job, worker_id):
+    """Mark job as done, return False if the worker lost the lease in the meantime"""
+    return bool(
+        _owned(job, worker_id).update(
+            status=Job.DONE, lease_expires_at=None, updated_at=Now()
+        )
+    )
+
+
+def fail(job, worker_id, error, max_attempts=None):
+    """Give the job back to the queue, or mark it as failed after max_attempts"""
+    max_attempts = max_attempts or settings.JOB_MAX_ATTEMPTS
+    status = Job.FAILED if job.attempts >= max_attempts else Job.PENDING
+    return bool(
+        _owned(job, worker_id).update(
+            status=status, error=error, lease_expires_at=None, updated_at=Now()
+        )
+    )
+
+
+def release(job, worker_id):
+    """Give the job back to the queue without counting the attempt (e.g. on shutdown)"""
+    return bool(
+        _owned(job, worker_id).update(
+            status=Job.PENDING,
+            attempts=F("attempts") - 1,
+            lease_expires_at=None,
+            updated_at=Now(),
+        )
+    )
+
+
+class Heartbeat:
+    """Extend the lease of a job in a background thread until stopped"""
+
+    def __init__(self, job, worker_id, lease_seconds):
+        self.job = job
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        # Renew well before the lease expires, a single missed beat is not fatal
+        self.interval = lease_seconds / 3
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="tweetpipe-heartbeat", daemon=True
+        )
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    extended = extend_lease(
+                        self.job, self.worker_id, self.lease_seconds
+                    )
+                except Exception as e:
+                    logger.warning(f"Heartbeat for {self.job} failed: {e}")
+                    continue
+                if not extended:
+                    self.lost = True
+                    logger.error(f"{self.worker_id} lost the lease of {self.job}.")
+                    return
+        finally:
+            # Every thread uses its own DB connection, do not leave it open
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+class Worker:
+    """
+    Claim and run jobs until stopped.
+
+    handlers maps every job kind onto a callable, which is called with the job.
+    Jobs raising an exception are retried (by any worker) until JOB_MAX_ATTEMPTS.
+    """
+
+    def __init__(self, handlers, worker_id=None, lease_seconds=None, poll_interval=None):
+        self.handlers = handlers
+        self.worker_id = (
+            worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        )
+        self.lease_seconds = lease_seconds or settings.JOB_LEASE_SECONDS
+        self.poll_interval = poll_interval or settings.JOB_POLL_INTERVAL
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(worker_id='{self.worker_id}')"
+
+    def run_job(self, job):
+        handler = self.handlers[job.kind]
+        with Heartbeat(job, self.worker_id, self.lease_seconds) as heartbeat:
+            try:
+                handler(job)
+            except KeyboardInterrupt:
+                release(job, self.worker_id)
+                raise
+            except Exception as e:
+                logger.exception(f"{job} failed: {e}")
+                fail(job, self.worker_id, repr(e))
+                return False
+
+        if not complete(job, self.worker_id) or heartbeat.lost:
+            # The job may have been run by another worker as well, the loaders are
+            # idempotent (upserts), the data is not duplicated.
+            logger.warning(f"{self.worker_id} finished {job} without holding its lease.")
+        return True
+
+    def run(self, burst=False):
+        """Run jobs until interrupted, or until the queue is empty if burst is set"""
+        logger.info(f"Starting {self}")
+        processed = 0
+        while True:
+            job = claim(self.worker_id, lease_seconds=self.lease_seconds)
+            if job is None:
+                if burst:
+                    break
+                time.sleep(self.poll_interval)
+                continue
+            self.run_job(job)
+            processed += 1
+
+        logger.info(f"{self} processed {processed} job(s).")
+        return processed
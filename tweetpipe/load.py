@@ -7,67 +7,138 @@ The loader expects data in the following form:
         ...,
     }
 
-It processes this dict in a pre-defined order (model_order).
-The dependents are pulled out of the instances dict and added to the current model.
+It processes this dict in the order of the registered models (registry.model_order in transform.py).
+The parsers only emit model columns, foreign keys are filled with the instances created for the
+same tweet and many-to-many relations are linked to them (registry.relations/many_to_many).
 
 In order to determine which fields should be used to check update or create, you can specify a
 model class attribute 'req_fields' (on the model class) which is then used in the get_instance method.
+For partitioned tables, req_fields contains the partition key (e.g. Tweet: id, created_at).
+The DB can only enforce keys containing the partition key. Fields which are unique on their
+own (model.unique_fields, e.g. Tweet.id) are checked by the loaders, a row which reuses them
+with a different key is rejected with an IntegrityError.
+The partitions needed by the loaded rows are created before they are loaded (partitions.py).
+
+With VALIDATE_ROWS, rows violating the constraints of their model are rejected before
+they are sent to the DB (see validation.py).
+
+For bulk (re-)loads the CopyLoader streams batches of transformed tweets into staging tables
+using postgres COPY and merges them into the real tables with one upsert per table.
+
+The ParallelLoader shards the transformed tweets by user and loads every shard with its own
+CopyLoader and DB connection.
+
+All loaders add the loaded follower counts and new hashtag links to the summary tables
+(aggregates.py) in the same transaction.
 """
-from django.db import IntegrityError
+import io
+import queue
+import threading
+from datetime import datetime
+from itertools import islice
+
+from django.db import DataError, IntegrityError, connection, transaction
 from loguru import logger
 
-import utils
-from models import FollowerCount, Hashtag, Tweet, User
+import aggregates
+from config import settings
+from models import FollowerCount, Hashtag, User
+from partitions import ensure_partitions
+from pipeline import PipelineStopped
+from validation import get_validator
+from transform import registry
 
 
 _log_file_name = __file__.split("/")[-1].split(".")[0]
 logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
 
+# Characters with a special meaning in the text format of COPY
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
 
 class Loader:
     def __init__(self, data):
         self.data = data
-        # TODO: While the data model changes, check  if there is a better ways of
-        # dealing with dependencies and creation order
-        self.model_order = (User, FollowerCount, Tweet, Hashtag)
+        self.model_order = registry.model_order
         self.instances = {}
-        self.dependents = {}
+        # (model, field_name): [(pk, related pk), ...] of the links added by this loader
+        self.new_links = {}
 
     def process(self):
         """Process the transformed data and store it in all relevant models"""
         for model in self.model_order:
             _fields = self.data[model]
             if isinstance(_fields, list):
-                for fields in _fields:
+                # Lock the rows in the same order as concurrent loaders (see ParallelLoader)
+                for fields in sorted(_fields, key=self.lookup_key(model)):
                     self.get_instance(fields, model)
             else:
                 self.get_instance(_fields, model)
+        self.update_aggregates()
+
+    @staticmethod
+    def lookup_key(model):
+        """Sort key for rows of model: the fields used to look up existing rows"""
+        req_fields = getattr(model, "req_fields", ("id",))
+        return lambda fields: tuple(fields.get(name) for name in req_fields)
 
     def get_instance(self, fields, model):
-        dependents = self.get_dependents(fields, model)
+        dependents = self.get_dependents(model)
         fields = {**fields, **dependents}
         model_inst = self.update_or_create(fields, model)
-        self.instances[self.get_model_name(model)] = model_inst
-
-    def get_dependents(self, fields, model):
-        """Extend fields with instances of dependent models"""
+        self.add_many_to_many(model_inst, model)
+        self.instances[model] = model_inst
 
-        if not model in self.dependents:
-            self.dependents[model] = {}
-            for dependent_name, dependent_inst in self.instances.items():
-                if dependent_name in fields:
-                    self.dependents[model][dependent_name] = dependent_inst
+    def get_dependents(self, model):
+        """Instances of the models referenced by the foreign keys of model"""
+        return {
+            field_name: self.instances[related_model]
+            for field_name, related_model in registry.relations[model].items()
+            if related_model in self.instances
+        }
 
-        return self.dependents[model]
-
-    def filter_model_fields(self, fields, model):
-        """Filter out all fields necessary for this model"""
-        return utils.filter_dict(
-            fields, map(lambda x: x.name, model._meta.fields)
-        )
+    def add_many_to_many(self, model_inst, model):
+        """Link model_inst with the instances of the related models"""
+        if model_inst is None:
+            return
+        quote = connection.ops.quote_name
+        for field_name, related_model in registry.many_to_many[model].items():
+            related_inst = self.instances.get(related_model)
+            if related_inst is None:
+                continue
+            field = model._meta.get_field(field_name)
+            with connection.cursor() as cursor:
+                # Only a link which did not exist yet is returned
+                cursor.execute(
+                    f"INSERT INTO {quote(field.m2m_db_table())} "
+                    f"({quote(field.m2m_column_name())}, {quote(field.m2m_reverse_name())}) "
+                    "VALUES (%s, %s) ON CONFLICT DO NOTHING RETURNING 1",
+                    [model_inst.pk, related_inst.pk],
+                )
+                added = cursor.fetchone() is not None
+            if added:
+                self.new_links.setdefault((model, field_name), []).append(
+                    (model_inst.pk, related_inst.pk)
+                )
 
-    def get_model_name(self, model):
-        return model.__name__.lower()
+    def update_aggregates(self):
+        """Add the loaded follower count and the new hashtag links to the summary tables"""
+        follower_count = self.instances.get(FollowerCount)
+        hashtag_links = self.new_links.get((Hashtag, "tweets"))
+        with connection.cursor() as cursor:
+            if follower_count is not None:
+                aggregates.add_follower_counts(
+                    cursor,
+                    [
+                        (
+                            follower_count.user_id,
+                            follower_count.fetched_at,
+                            follower_count.count,
+                        )
+                    ],
+                )
+            if hashtag_links:
+                aggregates.add_hashtag_links(cursor, hashtag_links)
 
     def update_or_create(self, fields, model):
         """
@@ -81,7 +152,6 @@ class Loader:
 
         """
 
-        fields = self.filter_model_fields(fields, model)
         required_fields = {}
         try:
             try:
@@ -96,6 +166,7 @@ class Loader:
             return None
 
         logger.debug(f"required_fields: {required_fields}")
+        self.check_unique_fields(model, required_fields)
 
         inst, created = model.objects.update_or_create(
             **required_fields, defaults=fields
@@ -107,15 +178,422 @@ class Loader:
 
         return inst
 
+    @staticmethod
+    def check_unique_fields(model, required_fields):
+        """Raise an IntegrityError if another row of model has the same unique_fields"""
+        unique_fields = getattr(model, "unique_fields", ())
+        if not unique_fields:
+            return
+        lookup = {name: required_fields[name] for name in unique_fields}
+        if model.objects.filter(**lookup).exclude(**required_fields).exists():
+            raise IntegrityError(
+                f"{model.__name__} with {lookup} exists with a different key than "
+                f"{required_fields}."
+            )
+
 
 def load_data(transformed_data):
     """Entry function to instantiate and process the Loader"""
+    validator = get_validator() if settings.VALIDATE_ROWS else None
     for data in transformed_data:
+        if validator is not None:
+            data = validator.validate(data)
+            if data is None:
+                continue
         loader = Loader(data)
         try:
-            loader.process()
-        except IntegrityError as e:
+            ensure_partitions([data])
+            # A tweet and its summary rows are stored together or not at all
+            with transaction.atomic():
+                loader.process()
+        except (IntegrityError, DataError) as e:
             # Do not break if a tweet does not fit the schema.
             # track in logs.
             logger.error(e)
             continue
+
+
+class CopyLoader:
+    """
+    Bulk load transformed data with postgres COPY.
+
+    For every batch of transformed tweets, the rows of each model are streamed into a
+    temporary staging table using copy_expert. Afterwards, every staging table is merged
+    into its real table with a single INSERT ... SELECT ... ON CONFLICT statement.
+
+    The conflict target is the same set of fields Loader.update_or_create uses to look up
+    existing rows (model.req_fields or id). If a batch contains the same row more than once,
+    the last occurrence wins, just like loading the tweets one after the other.
+    Many-to-many relations (Hashtag.tweets) are linked to the instances of the same tweet.
+    """
+
+    seq_column = "_tweetpipe_seq"
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.COPY_BATCH_SIZE
+        self.validator = get_validator() if settings.VALIDATE_ROWS else None
+        self.model_order = registry.model_order
+        self.quote = connection.ops.quote_name
+
+    def process(self, transformed_data):
+        """Load all transformed tweets in batches of batch_size"""
+        transformed_data = iter(transformed_data)
+        while True:
+            batch = list(islice(transformed_data, self.batch_size))
+            if not batch:
+                break
+            if self.validator is not None:
+                # Invalid rows would abort the entire COPY batch
+                batch = self.validator.validate_batch(batch)
+            try:
+                self.prepare_batch(batch)
+                with transaction.atomic():
+                    self.load_batch(batch)
+            except (IntegrityError, DataError) as e:
+                # Do not lose the entire batch because of a single bad tweet.
+                # Fall back to the row by row Loader, which skips the offending tweets.
+                logger.error(f"COPY of {len(batch)} tweets failed: {e}")
+                logger.warning("Reload batch with the row by row Loader.")
+                load_data(batch)
+
+    def prepare_batch(self, batch):
+        """Called before the transaction which loads batch"""
+        ensure_partitions(batch)
+
+    def load_batch(self, batch):
+        with connection.cursor() as cursor:
+            for model in self.model_order:
+                self.copy_model(cursor, model, batch)
+                self.merge_model(cursor, model)
+                self.merge_m2m(cursor, model)
+                if model is FollowerCount:
+                    aggregates.update_follower_counts(
+                        cursor,
+                        "SELECT user_id, fetched_at, count "
+                        f"FROM {self.quote(self.staging_table(model))}",
+                    )
+
+    @staticmethod
+    def columns(model):
+        """Concrete fields of model which are written by the loader (no auto ids/generated fields)"""
+        generated_fields = getattr(model, "generated_fields", ())
+        return [
+            field
+            for field in model._meta.concrete_fields
+            if field.name not in generated_fields
+            and not (field.primary_key and field.get_internal_type() == "AutoField")
+        ]
+
+    @staticmethod
+    def conflict_columns(model):
+        req_fields = getattr(model, "req_fields", ("id",))
+        return [model._meta.get_field(name).column for name in req_fields]
+
+    def m2m_fields(self, model):
+        """Many-to-many fields of model whose related model is loaded as well"""
+        return [
+            field
+            for field in model._meta.many_to_many
+            if field.related_model in self.model_order
+        ]
+
+    def staging_table(self, model):
+        return f"tmp_{model._meta.db_table}"
+
+    def iter_rows(self, model, batch):
+        """Yield the staging rows of model for all transformed tweets in batch"""
+        columns = self.columns(model)
+        m2m_fields = self.m2m_fields(model)
+        seq = 0
+        for data in batch:
+            _fields = data[model]
+            if not isinstance(_fields, list):
+                _fields = [_fields]
+            for fields in _fields:
+                row = []
+                for field in columns:
+                    if field.is_relation:
+                        related_fields = data[field.related_model]
+                        value = related_fields[field.target_field.attname]
+                    else:
+                        value = fields[field.attname]
+                    row.append(value)
+                for field in m2m_fields:
+                    row.append(data[field.related_model]["id"])
+                row.append(seq)
+                seq += 1
+                yield row
+
+    @staticmethod
+    def to_copy_value(value):
+        """Encode value for the text format of COPY (NULL is \\N)"""
+        if value is None:
+            return "\\N"
+        if isinstance(value, bool):
+            return "t" if value else "f"
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return str(value).translate(COPY_ESCAPES)
+
+    def copy_model(self, cursor, model, batch):
+        """Create the staging table for model and COPY the rows of batch into it"""
+        quote = self.quote
+        staging = quote(self.staging_table(model))
+        select_columns = [quote(field.column) for field in self.columns(model)]
+        select_columns += [
+            f"NULL::bigint AS {quote(field.m2m_reverse_name())}"
+            for field in self.m2m_fields(model)
+        ]
+        select_columns.append(f"NULL::bigint AS {quote(self.seq_column)}")
+        cursor.execute(
+            f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS "
+            f"SELECT {', '.join(select_columns)} FROM {quote(model._meta.db_table)} "
+            "WITH NO DATA"
+        )
+
+        buffer = io.StringIO()
+        for row in self.iter_rows(model, batch):
+            buffer.write("\t".join(self.to_copy_value(value) for value in row))
+            buffer.write("\n")
+        buffer.seek(0)
+        # copy_expert is not wrapped by Django, raise its errors as Django's (DataError, ...)
+        with connection.wrap_database_errors:
+            cursor.copy_expert(f"COPY {staging} FROM STDIN", buffer)
+
+    def check_unique_fields(self, cursor, model):
+        """
+        Raise an IntegrityError if staged rows reuse unique_fields with a different key.
+
+        The staged rows are checked against each other and against the stored rows.
+        """
+        unique_fields = getattr(model, "unique_fields", ())
+        if not unique_fields:
+            return
+        quote = self.quote
+        unique_columns = [
+            quote(model._meta.get_field(name).column) for name in unique_fields
+        ]
+        key_columns = [
+            quote(column)
+            for column in self.conflict_columns(model)
+            if quote(column) not in unique_columns
+        ]
+        staging = quote(self.staging_table(model))
+        join_condition = " AND ".join(
+            f"t.{column} = s.{column}" for column in unique_columns
+        )
+        cursor.execute(
+            f"SELECT {', '.join(unique_columns)} FROM {staging} "
+            f"GROUP BY {', '.join(unique_columns)} "
+            f"HAVING count(DISTINCT ({', '.join(key_columns)})) > 1 "
+            f"UNION ALL "
+            f"SELECT {', '.join(f's.{column}' for column in unique_columns)} "
+            f"FROM {staging} s JOIN {quote(model._meta.db_table)} t ON {join_condition} "
+            f"WHERE ({', '.join(f't.{column}' for column in key_columns)}) "
+            f"IS DISTINCT FROM ({', '.join(f's.{column}' for column in key_columns)}) "
+            "LIMIT 1"
+        )
+        duplicate = cursor.fetchone()
+        if duplicate is not None:
+            raise IntegrityError(
+                f"{model.__name__} {duplicate} is loaded with a different key "
+                f"({', '.join(key_columns)})."
+            )
+
+    def merge_model(self, cursor, model):
+        """Upsert the rows of the staging table into the table of model"""
+        self.check_unique_fields(cursor, model)
+        quote = self.quote
+        columns = [quote(field.column) for field in self.columns(model)]
+        conflict_columns = [quote(column) for column in self.conflict_columns(model)]
+        update_columns = [
+            column for column in columns if column not in conflict_columns
+        ]
+        if update_columns:
+            assignments = ", ".join(
+                f"{column} = EXCLUDED.{column}" for column in update_columns
+            )
+            on_conflict = f"DO UPDATE SET {assignments}"
+        else:
+            on_conflict = "DO NOTHING"
+
+        conflict_target = ", ".join(conflict_columns)
+        cursor.execute(
+            f"INSERT INTO {quote(model._meta.db_table)} ({', '.join(columns)}) "
+            f"SELECT DISTINCT ON ({conflict_target}) {', '.join(columns)} "
+            f"FROM {quote(self.staging_table(model))} "
+            f"ORDER BY {conflict_target}, {quote(self.seq_column)} DESC "
+            f"ON CONFLICT ({conflict_target}) {on_conflict}"
+        )
+        logger.debug(f"Merged {cursor.rowcount} rows into {model.__name__}.")
+
+    def merge_m2m(self, cursor, model):
+        """Link the merged rows of model with the related instances of their tweet"""
+        quote = self.quote
+        table = quote(model._meta.db_table)
+        staging = quote(self.staging_table(model))
+        join_condition = " AND ".join(
+            f"t.{quote(column)} = s.{quote(column)}"
+            for column in self.conflict_columns(model)
+        )
+        for field in self.m2m_fields(model):
+            through_table = quote(field.m2m_db_table())
+            own_column = quote(field.m2m_column_name())
+            related_column = quote(field.m2m_reverse_name())
+            insert_links = (
+                f"INSERT INTO {through_table} ({own_column}, {related_column}) "
+                f"SELECT DISTINCT t.{quote(model._meta.pk.column)}, s.{related_column} "
+                f"FROM {staging} s, {table} t WHERE {join_condition} "
+                "ON CONFLICT DO NOTHING"
+            )
+            if model is Hashtag and field.name == "tweets":
+                # Only the links which did not exist yet are returned and counted
+                aggregates.update_hashtag_counts(
+                    cursor, f"{insert_links} RETURNING {own_column}, {related_column}"
+                )
+            else:
+                cursor.execute(insert_links)
+
+
+def copy_load_data(transformed_data):
+    """Entry function to bulk load the transformed data with the CopyLoader"""
+    loader = CopyLoader()
+    loader.process(transformed_data)
+
+
+class ShardLoader(CopyLoader):
+    """
+    CopyLoader of a single shard of the ParallelLoader.
+
+    Hashtags are the only rows shared between the shards. The new hashtags of a batch are
+    inserted before the batch is loaded, sorted by text and in a short transaction of their
+    own: concurrent shards wait for each other in the same order instead of deadlocking and
+    nobody holds the locks while loading an entire batch. The merge of the batch then only
+    finds existing hashtags (ON CONFLICT DO NOTHING, no locks).
+    """
+
+    def prepare_batch(self, batch):
+        super().prepare_batch(batch)
+        self.insert_hashtags(batch)
+
+    def insert_hashtags(self, batch):
+        texts = {fields["text"] for data in batch for fields in data.get(Hashtag, [])}
+        if not texts:
+            return
+        text_column = self.quote(Hashtag._meta.get_field("text").column)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.quote(Hashtag._meta.db_table)} ({text_column}) "
+                "SELECT text FROM unnest(%s::text[]) AS text ORDER BY text "
+                f"ON CONFLICT ({text_column}) DO NOTHING",
+                [sorted(texts)],
+            )
+
+
+# Marks the end of the tweets of a shard
+_DONE = object()
+
+
+class ParallelLoader:
+    """
+    Load transformed tweets with several DB connections concurrently.
+
+    The tweets are sharded by their user (User.id % workers). Every shard is loaded by its
+    own thread (and DB connection) with a ShardLoader, in the order of the registered models.
+    The users, tweets, follower counts and summary rows of a user are only written by its
+    shard, the shared hashtags are inserted in a fixed order (see ShardLoader). The tweets
+    of a single user (e.g. a run with --user) all go to one shard and are loaded with one
+    connection, no faster than with the CopyLoader.
+
+    If a shard fails, all shards are stopped and the exception is re-raised by process.
+    The shards are also stopped if the transformed tweets fail (or the upstream stage
+    stops), the exception is re-raised as well.
+    """
+
+    def __init__(self, workers=None, batch_size=None, queue_size=None):
+        self.workers = settings.LOAD_WORKERS if workers is None else workers
+        if self.workers < 1:
+            raise ValueError(f"At least 1 load worker is required, not {self.workers}")
+        self.batch_size = batch_size
+        self.queues = [
+            queue.Queue(maxsize=queue_size or settings.PIPELINE_QUEUE_SIZE)
+            for _ in range(self.workers)
+        ]
+        self._stop = threading.Event()
+        self.errors = []
+
+    def shard_of(self, data):
+        return data[User]["id"] % self.workers
+
+    def put(self, shard_queue, item):
+        """Put item into the queue, block while it is full unless a shard failed"""
+        while not self._stop.is_set():
+            try:
+                shard_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise PipelineStopped()
+
+    def iter_queue(self, shard_queue):
+        """Yield the tweets of a shard until the end is reached or the loader stops"""
+        while not self._stop.is_set():
+            try:
+                item = shard_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+        raise PipelineStopped()
+
+    def run_shard(self, shard):
+        try:
+            loader = ShardLoader(batch_size=self.batch_size)
+            loader.process(self.iter_queue(self.queues[shard]))
+        except PipelineStopped:
+            logger.debug(f"Shard {shard} stopped.")
+        except Exception as e:
+            logger.exception(f"Shard {shard} failed: {e}")
+            self.errors.append(e)
+            self._stop.set()
+        finally:
+            # Every shard uses its own DB connection, do not leave it open
+            connection.close()
+
+    def process(self, transformed_data):
+        """Distribute the transformed tweets to the shards and wait until they are loaded"""
+        shards = [
+            threading.Thread(
+                target=self.run_shard, args=(shard,), name=f"tweetpipe-load-{shard}"
+            )
+            for shard in range(self.workers)
+        ]
+        for shard in shards:
+            shard.start()
+
+        try:
+            for data in transformed_data:
+                self.put(self.queues[self.shard_of(data)], data)
+            for shard_queue in self.queues:
+                self.put(shard_queue, _DONE)
+        except PipelineStopped:
+            # Raised by put if a shard failed (its error is raised below), else upstream
+            if not self._stop.is_set():
+                self._stop.set()
+                raise
+        except BaseException:
+            self._stop.set()
+            raise
+        finally:
+            for shard in shards:
+                shard.join()
+
+        if self.errors:
+            raise self.errors[0]
+
+
+def parallel_load_data(transformed_data, workers=None):
+    """Entry function to load the transformed data with the ParallelLoader"""
+    loader = ParallelLoader(workers=workers)
+    loader.process(transformed_data)
@@ -0,0 +1,53 @@
+from django.db import migrations, models
+
+# The row by row loader could store the same hashtag or follower count more than once.
+# Remove these duplicates before the unique constraints are added:
+#   tweetpipe_hashtag: keep the oldest row per text, move the tweet links over to it
+#   tweetpipe_followercount: keep the newest row per (user, fetched_at)
+REMOVE_DUPLICATES = """
+-- Check the foreign keys right away, pending (deferred) checks would block the ALTER TABLE
+SET CONSTRAINTS ALL IMMEDIATE;
+
+WITH hashtags AS (
+    SELECT id, min(id) OVER (PARTITION BY text) AS keep_id FROM tweetpipe_hashtag
+)
+INSERT INTO tweetpipe_hashtag_tweets (hashtag_id, tweet_id)
+SELECT DISTINCT h.keep_id, l.tweet_id
+FROM tweetpipe_hashtag_tweets l
+JOIN hashtags h ON h.id = l.hashtag_id
+WHERE h.id <> h.keep_id
+ON CONFLICT DO NOTHING;
+
+DELETE FROM tweetpipe_hashtag_tweets l
+USING tweetpipe_hashtag h, tweetpipe_hashtag kept
+WHERE l.hashtag_id = h.id AND kept.text = h.text AND kept.id < h.id;
+
+DELETE FROM tweetpipe_hashtag h
+USING tweetpipe_hashtag kept
+WHERE kept.text = h.text AND kept.id < h.id;
+
+DELETE FROM tweetpipe_followercount f
+USING tweetpipe_followercount newer
+WHERE newer.user_id = f.user_id AND newer.fetched_at = f.fetched_at AND newer.id > f.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweetpipe', '0004_create_hashtag'),
+    ]
+
+    operations = [
+        # Removed duplicates can not be restored
+        migrations.RunSQL(REMOVE_DUPLICATES, reverse_sql=migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='hashtag',
+            name='text',
+            field=models.CharField(max_length=279, unique=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='followercount',
+            unique_together={('user', 'fetched_at')},
+        ),
+    ]
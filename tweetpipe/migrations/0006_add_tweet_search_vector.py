@@ -0,0 +1,52 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Keep the search_vector of a tweet up to date, independent of how it is loaded
+# (ORM or COPY). The document is the full text, the text if the full text is missing.
+# SEARCH_CONFIG has to match Tweet.search_config, which is used by the search queries
+# (search.py). It is not read from the model, the migration must not change with it.
+SEARCH_CONFIG = 'english'
+
+CREATE_TRIGGER = f"""
+CREATE FUNCTION tweetpipe_tweet_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := to_tsvector(
+        '{SEARCH_CONFIG}', coalesce(NEW.full_text, NEW.text, '')
+    );
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tweetpipe_tweet_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF full_text, text ON tweetpipe_tweet
+    FOR EACH ROW EXECUTE PROCEDURE tweetpipe_tweet_search_vector_update();
+
+UPDATE tweetpipe_tweet
+SET search_vector = to_tsvector('{SEARCH_CONFIG}', coalesce(full_text, text, ''));
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS tweetpipe_tweet_search_vector_trigger ON tweetpipe_tweet;
+DROP FUNCTION IF EXISTS tweetpipe_tweet_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweetpipe', '0005_add_upsert_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='tweet_search_vector_idx'),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, reverse_sql=DROP_TRIGGER),
+    ]
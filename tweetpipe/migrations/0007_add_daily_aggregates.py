@@ -0,0 +1,68 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Fill the summary tables with the rows loaded before they existed.
+# From now on they are updated by the loaders (see aggregates.py).
+# TIME_ZONE is the settings.TIME_ZONE the days were computed in when the migration was
+# written. It is not read from the settings, the migration must not change with them.
+TIME_ZONE = 'Europe/Berlin'
+
+BACKFILL = f"""
+INSERT INTO tweetpipe_dailyhashtagcount (user_id, date, hashtag, count)
+SELECT t.user_id, (t.created_at AT TIME ZONE '{TIME_ZONE}')::date, h.text, count(*)
+FROM tweetpipe_hashtag_tweets ht
+JOIN tweetpipe_tweet t ON t.id = ht.tweet_id
+JOIN tweetpipe_hashtag h ON h.id = ht.hashtag_id
+GROUP BY 1, 2, 3;
+
+INSERT INTO tweetpipe_dailyfollowercount
+    (user_id, date, first_fetched_at, first_count, last_fetched_at, last_count)
+SELECT
+    user_id,
+    (fetched_at AT TIME ZONE '{TIME_ZONE}')::date,
+    min(fetched_at),
+    (array_agg(count ORDER BY fetched_at))[1],
+    max(fetched_at),
+    (array_agg(count ORDER BY fetched_at DESC))[1]
+FROM tweetpipe_followercount
+GROUP BY 1, 2;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweetpipe', '0006_add_tweet_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyHashtagCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('hashtag', models.CharField(max_length=279)),
+                ('count', models.PositiveIntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_hashtag_counts', to='tweetpipe.User')),
+            ],
+            options={
+                'unique_together': {('user', 'date', 'hashtag')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyFollowerCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('first_fetched_at', models.DateTimeField()),
+                ('first_count', models.IntegerField()),
+                ('last_fetched_at', models.DateTimeField()),
+                ('last_count', models.IntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_follower_counts', to='tweetpipe.User')),
+            ],
+            options={
+                'unique_together': {('user', 'date')},
+            },
+        ),
+        migrations.RunSQL(BACKFILL, reverse_sql=migrations.RunSQL.noop),
+    ]
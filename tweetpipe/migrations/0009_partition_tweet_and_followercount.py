@@ -0,0 +1,182 @@
+from django.db import migrations
+
+# Convert tweetpipe_tweet (created_at) and tweetpipe_followercount (fetched_at) into
+# monthly range partitioned tables (postgres >= 11).
+#
+# The primary and unique keys of a partitioned table have to contain the partition key:
+#   tweetpipe_tweet: (id, created_at)
+#   tweetpipe_followercount: (id, fetched_at) and (user_id, fetched_at)
+# The django state is unchanged (pk=id), the loaders use the full keys (Model.req_fields).
+# Foreign keys can not reference (id) of the partitioned tweets anymore, the constraint of
+# the Hashtag.tweets link table is dropped. Instead of the DB, the loaders (load.py) keep
+# the tweets consistent:
+#   - a tweet reusing the id of another tweet with a different created_at is rejected
+#     (Tweet.unique_fields)
+#   - hashtags are only linked with the tweets stored in the same transaction
+# Delete tweets with the ORM, which deletes their links as well, not with plain SQL.
+#
+# The constraints and indexes which are kept or restored use the names generated by django.
+#
+# Monthly partitions (<table>_pYYYY_MM, UTC months) are created by
+# tweetpipe_create_month_partition, see partitions.py.
+
+CREATE_PARTITION_FUNCTION = """
+CREATE FUNCTION tweetpipe_create_month_partition(parent text, month date) RETURNS text AS $$
+DECLARE
+    month_start date := date_trunc('month', month)::date;
+    partition_name text := parent || '_p' || to_char(month_start, 'YYYY_MM');
+BEGIN
+    -- Concurrent loaders may try to create the same partition
+    PERFORM pg_advisory_xact_lock(hashtext(partition_name));
+    IF to_regclass(partition_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+            partition_name,
+            parent,
+            month_start::timestamp AT TIME ZONE 'UTC',
+            (month_start + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+        );
+        IF parent = 'tweetpipe_tweet' THEN
+            -- Row triggers can not be defined on the partitioned table (postgres < 13)
+            EXECUTE format(
+                'CREATE TRIGGER tweetpipe_tweet_search_vector_trigger '
+                || 'BEFORE INSERT OR UPDATE OF full_text, text ON %I '
+                || 'FOR EACH ROW EXECUTE PROCEDURE tweetpipe_tweet_search_vector_update()',
+                partition_name
+            );
+        END IF;
+    END IF;
+    RETURN partition_name;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+DROP_PARTITION_FUNCTION = """
+DROP FUNCTION IF EXISTS tweetpipe_create_month_partition(text, date);
+"""
+
+PARTITION_TWEET = """
+DO $$
+DECLARE
+    constraint_name text;
+BEGIN
+    FOR constraint_name IN
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = 'tweetpipe_hashtag_tweets'::regclass
+        AND confrelid = 'tweetpipe_tweet'::regclass
+    LOOP
+        EXECUTE format(
+            'ALTER TABLE tweetpipe_hashtag_tweets DROP CONSTRAINT %I', constraint_name
+        );
+    END LOOP;
+END
+$$;
+
+ALTER TABLE tweetpipe_tweet RENAME TO tweetpipe_tweet_unpartitioned;
+CREATE TABLE tweetpipe_tweet
+    (LIKE tweetpipe_tweet_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    PARTITION BY RANGE (created_at);
+
+SELECT tweetpipe_create_month_partition('tweetpipe_tweet', month)
+FROM (
+    SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC')::date AS month
+    FROM tweetpipe_tweet_unpartitioned
+) months;
+
+INSERT INTO tweetpipe_tweet SELECT * FROM tweetpipe_tweet_unpartitioned;
+DROP TABLE tweetpipe_tweet_unpartitioned;
+
+ALTER TABLE tweetpipe_tweet ADD PRIMARY KEY (id, created_at);
+ALTER TABLE tweetpipe_tweet ADD CONSTRAINT tweetpipe_tweet_user_id_340677b8_fk_tweetpipe_user_id
+    FOREIGN KEY (user_id) REFERENCES tweetpipe_user (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX tweetpipe_tweet_user_id_created_at_idx ON tweetpipe_tweet (user_id, created_at);
+CREATE INDEX tweet_search_vector_idx ON tweetpipe_tweet USING gin (search_vector);
+"""
+
+UNPARTITION_TWEET = """
+ALTER TABLE tweetpipe_tweet RENAME TO tweetpipe_tweet_partitioned;
+CREATE TABLE tweetpipe_tweet
+    (LIKE tweetpipe_tweet_partitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+INSERT INTO tweetpipe_tweet SELECT * FROM tweetpipe_tweet_partitioned;
+DROP TABLE tweetpipe_tweet_partitioned;
+
+ALTER TABLE tweetpipe_tweet ADD PRIMARY KEY (id);
+ALTER TABLE tweetpipe_tweet ADD CONSTRAINT tweetpipe_tweet_user_id_340677b8_fk_tweetpipe_user_id
+    FOREIGN KEY (user_id) REFERENCES tweetpipe_user (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX tweetpipe_tweet_user_id_340677b8 ON tweetpipe_tweet (user_id);
+CREATE INDEX tweet_search_vector_idx ON tweetpipe_tweet USING gin (search_vector);
+CREATE TRIGGER tweetpipe_tweet_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF full_text, text ON tweetpipe_tweet
+    FOR EACH ROW EXECUTE PROCEDURE tweetpipe_tweet_search_vector_update();
+
+ALTER TABLE tweetpipe_hashtag_tweets
+    ADD CONSTRAINT tweetpipe_hashtag_tw_tweet_id_3681ef78_fk_tweetpipe
+    FOREIGN KEY (tweet_id) REFERENCES tweetpipe_tweet (id) DEFERRABLE INITIALLY DEFERRED;
+"""
+
+PARTITION_FOLLOWERCOUNT = """
+ALTER TABLE tweetpipe_followercount RENAME TO tweetpipe_followercount_unpartitioned;
+CREATE TABLE tweetpipe_followercount
+    (LIKE tweetpipe_followercount_unpartitioned INCLUDING DEFAULTS)
+    PARTITION BY RANGE (fetched_at);
+-- Keep the id sequence, it would be dropped together with the old table
+ALTER SEQUENCE tweetpipe_followercount_id_seq OWNED BY NONE;
+
+SELECT tweetpipe_create_month_partition('tweetpipe_followercount', month)
+FROM (
+    SELECT DISTINCT date_trunc('month', fetched_at AT TIME ZONE 'UTC')::date AS month
+    FROM tweetpipe_followercount_unpartitioned
+) months;
+
+INSERT INTO tweetpipe_followercount SELECT * FROM tweetpipe_followercount_unpartitioned;
+DROP TABLE tweetpipe_followercount_unpartitioned;
+ALTER SEQUENCE tweetpipe_followercount_id_seq OWNED BY tweetpipe_followercount.id;
+
+ALTER TABLE tweetpipe_followercount ADD PRIMARY KEY (id, fetched_at);
+ALTER TABLE tweetpipe_followercount
+    ADD CONSTRAINT tweetpipe_followercount_user_id_fetched_at_93fb4b95_uniq UNIQUE (user_id, fetched_at);
+ALTER TABLE tweetpipe_followercount
+    ADD CONSTRAINT tweetpipe_followercount_user_id_16b22645_fk_tweetpipe_user_id
+    FOREIGN KEY (user_id) REFERENCES tweetpipe_user (id) DEFERRABLE INITIALLY DEFERRED;
+"""
+
+UNPARTITION_FOLLOWERCOUNT = """
+ALTER TABLE tweetpipe_followercount RENAME TO tweetpipe_followercount_partitioned;
+CREATE TABLE tweetpipe_followercount
+    (LIKE tweetpipe_followercount_partitioned INCLUDING DEFAULTS);
+ALTER SEQUENCE tweetpipe_followercount_id_seq OWNED BY NONE;
+INSERT INTO tweetpipe_followercount SELECT * FROM tweetpipe_followercount_partitioned;
+DROP TABLE tweetpipe_followercount_partitioned;
+ALTER SEQUENCE tweetpipe_followercount_id_seq OWNED BY tweetpipe_followercount.id;
+
+ALTER TABLE tweetpipe_followercount ADD PRIMARY KEY (id);
+ALTER TABLE tweetpipe_followercount
+    ADD CONSTRAINT tweetpipe_followercount_user_id_fetched_at_93fb4b95_uniq UNIQUE (user_id, fetched_at);
+ALTER TABLE tweetpipe_followercount
+    ADD CONSTRAINT tweetpipe_followercount_user_id_16b22645_fk_tweetpipe_user_id
+    FOREIGN KEY (user_id) REFERENCES tweetpipe_user (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX tweetpipe_followercount_user_id_16b22645 ON tweetpipe_followercount (user_id);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweetpipe', '0008_add_job_queue'),
+    ]
+
+    operations = [
+        # Only the tables change, the models (django state) stay the same
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    CREATE_PARTITION_FUNCTION, reverse_sql=DROP_PARTITION_FUNCTION
+                ),
+                migrations.RunSQL(PARTITION_TWEET, reverse_sql=UNPARTITION_TWEET),
+                migrations.RunSQL(
+                    PARTITION_FOLLOWERCOUNT, reverse_sql=UNPARTITION_FOLLOWERCOUNT
+                ),
+            ],
+            state_operations=[],
+        ),
+    ]
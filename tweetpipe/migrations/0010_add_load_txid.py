@@ -0,0 +1,185 @@
+from django.db import migrations
+
+# Mark every exported row with the id of the transaction which inserted or last updated it
+# (txid_current(), 64 bit, never wraps around). The export (export.py) uses it as watermark:
+# every run exports the rows of all transactions which finished since the previous run,
+# regardless of their fetched_at.
+#
+# The column is only known to the DB (defaults and triggers), the models are unchanged.
+# Row triggers can not be defined on the partitioned tables (postgres < 13), they are added
+# to every partition, including the ones created by tweetpipe_create_month_partition.
+
+TABLES = (
+    'tweetpipe_user',
+    'tweetpipe_followercount',
+    'tweetpipe_tweet',
+    'tweetpipe_hashtag_tweets',
+)
+# Unpartitioned tables whose rows are updated by the loaders
+UPDATED_TABLES = ('tweetpipe_user',)
+
+CREATE_TRIGGER_FUNCTION = """
+CREATE FUNCTION tweetpipe_set_load_txid() RETURNS trigger AS $$
+BEGIN
+    NEW.load_txid := txid_current();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+TRIGGER = (
+    'CREATE TRIGGER tweetpipe_load_txid_trigger BEFORE UPDATE ON {table} '
+    'FOR EACH ROW EXECUTE PROCEDURE tweetpipe_set_load_txid()'
+)
+
+CREATE_PARTITION_TRIGGERS = """
+DO $$
+DECLARE
+    partition_name text;
+BEGIN
+    FOR partition_name IN
+        SELECT inhrelid::regclass::text FROM pg_inherits
+        WHERE inhparent IN ('tweetpipe_followercount'::regclass, 'tweetpipe_tweet'::regclass)
+    LOOP
+        EXECUTE format(
+            'CREATE TRIGGER tweetpipe_load_txid_trigger BEFORE UPDATE ON %I '
+            || 'FOR EACH ROW EXECUTE PROCEDURE tweetpipe_set_load_txid()',
+            partition_name
+        );
+    END LOOP;
+END
+$$;
+"""
+
+DROP_PARTITION_TRIGGERS = """
+DO $$
+DECLARE
+    partition_name text;
+BEGIN
+    FOR partition_name IN
+        SELECT inhrelid::regclass::text FROM pg_inherits
+        WHERE inhparent IN ('tweetpipe_followercount'::regclass, 'tweetpipe_tweet'::regclass)
+    LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS tweetpipe_load_txid_trigger ON %I', partition_name);
+    END LOOP;
+END
+$$;
+"""
+
+# New partitions get the load_txid trigger as well. Both versions of the function are
+# written out: this migration must not change if 0009 is edited.
+CREATE_PARTITION_FUNCTION = """
+CREATE OR REPLACE FUNCTION tweetpipe_create_month_partition(parent text, month date)
+RETURNS text AS $$
+DECLARE
+    month_start date := date_trunc('month', month)::date;
+    partition_name text := parent || '_p' || to_char(month_start, 'YYYY_MM');
+BEGIN
+    -- Concurrent loaders may try to create the same partition
+    PERFORM pg_advisory_xact_lock(hashtext(partition_name));
+    IF to_regclass(partition_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+            partition_name,
+            parent,
+            month_start::timestamp AT TIME ZONE 'UTC',
+            (month_start + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+        );
+        IF parent = 'tweetpipe_tweet' THEN
+            -- Row triggers can not be defined on the partitioned table (postgres < 13)
+            EXECUTE format(
+                'CREATE TRIGGER tweetpipe_tweet_search_vector_trigger '
+                || 'BEFORE INSERT OR UPDATE OF full_text, text ON %I '
+                || 'FOR EACH ROW EXECUTE PROCEDURE tweetpipe_tweet_search_vector_update()',
+                partition_name
+            );
+        END IF;
+        EXECUTE format(
+            'CREATE TRIGGER tweetpipe_load_txid_trigger BEFORE UPDATE ON %I '
+            || 'FOR EACH ROW EXECUTE PROCEDURE tweetpipe_set_load_txid()',
+            partition_name
+        );
+    END IF;
+    RETURN partition_name;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+# The function of 0009
+RESTORE_PARTITION_FUNCTION = """
+CREATE OR REPLACE FUNCTION tweetpipe_create_month_partition(parent text, month date)
+RETURNS text AS $$
+DECLARE
+    month_start date := date_trunc('month', month)::date;
+    partition_name text := parent || '_p' || to_char(month_start, 'YYYY_MM');
+BEGIN
+    -- Concurrent loaders may try to create the same partition
+    PERFORM pg_advisory_xact_lock(hashtext(partition_name));
+    IF to_regclass(partition_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+            partition_name,
+            parent,
+            month_start::timestamp AT TIME ZONE 'UTC',
+            (month_start + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+        );
+        IF parent = 'tweetpipe_tweet' THEN
+            -- Row triggers can not be defined on the partitioned table (postgres < 13)
+            EXECUTE format(
+                'CREATE TRIGGER tweetpipe_tweet_search_vector_trigger '
+                || 'BEFORE INSERT OR UPDATE OF full_text, text ON %I '
+                || 'FOR EACH ROW EXECUTE PROCEDURE tweetpipe_tweet_search_vector_update()',
+                partition_name
+            );
+        END IF;
+    END IF;
+    RETURN partition_name;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweetpipe', '0009_partition_tweet_and_followercount'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    [
+                        f'ALTER TABLE {table} '
+                        'ADD COLUMN load_txid bigint NOT NULL DEFAULT txid_current()'
+                        for table in TABLES
+                    ]
+                    + [
+                        f'CREATE INDEX {table}_load_txid_idx ON {table} (load_txid)'
+                        for table in TABLES
+                    ],
+                    reverse_sql=[
+                        f'ALTER TABLE {table} DROP COLUMN load_txid' for table in TABLES
+                    ],
+                ),
+                migrations.RunSQL(
+                    CREATE_TRIGGER_FUNCTION,
+                    reverse_sql='DROP FUNCTION tweetpipe_set_load_txid()',
+                ),
+                migrations.RunSQL(
+                    [TRIGGER.format(table=table) for table in UPDATED_TABLES],
+                    reverse_sql=[
+                        f'DROP TRIGGER tweetpipe_load_txid_trigger ON {table}'
+                        for table in UPDATED_TABLES
+                    ],
+                ),
+                migrations.RunSQL(
+                    CREATE_PARTITION_TRIGGERS, reverse_sql=DROP_PARTITION_TRIGGERS
+                ),
+                migrations.RunSQL(
+                    CREATE_PARTITION_FUNCTION, reverse_sql=RESTORE_PARTITION_FUNCTION
+                ),
+            ],
+            state_operations=[],
+        ),
+    ]
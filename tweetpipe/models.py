@@ -5,6 +5,8 @@ Use the django ORM for its simplicity and the bundled schema migrations.
 
 Second draft modeling the relevant data.
 """
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
 
@@ -31,6 +33,15 @@ class User(models.Model):
 
 
 class Tweet(models.Model):
+    # Partitioned by month of created_at, the primary key in the DB is (id, created_at)
+    # (see migration 0009 and partitions.py)
+    req_fields = ("id", "created_at")
+    # Unique on their own, but not enforced by the partitioned table, checked by the loaders
+    unique_fields = ("id",)
+    # Maintained by the DB (trigger), never written by the loaders (see migration 0006)
+    generated_fields = ("search_vector",)
+    search_config = "english"
+
     id = models.BigIntegerField(primary_key=True)
     created_at = models.DateTimeField()
     user = models.ForeignKey(
@@ -47,8 +58,12 @@ class Tweet(models.Model):
     # Note: It is possible for a tweet to have more than 280c. This may happen if unicode escapec codes are used.
     text = models.CharField(max_length=560)
 
+    # Full text search document of full_text
+    search_vector = SearchVectorField(null=True, editable=False)
+
     class Meta:
         app_label = "tweetpipe"
+        indexes = [GinIndex(fields=["search_vector"], name="tweet_search_vector_idx")]
 
     def __repr__(self):
         return f"Tweet(id={self.id}, user={self.user}, created_at={self.created_at})"
@@ -66,6 +81,7 @@ class AbstractCountModel(models.Model):
 
 
 class FollowerCount(AbstractCountModel):
+    # Partitioned by month of fetched_at (see migration 0009 and partitions.py)
     req_fields = ("user", "fetched_at")
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="follower_counts"
@@ -73,12 +89,109 @@ class FollowerCount(AbstractCountModel):
 
     class Meta:
         app_label = "tweetpipe"
+        # Matches req_fields, required for upserts with ON CONFLICT (see load.CopyLoader)
+        unique_together = ("user", "fetched_at")
 
 
 class Hashtag(models.Model):
     req_fields = ("text",)
-    text = models.CharField(max_length=279)
+    text = models.CharField(max_length=279, unique=True)
     tweets = models.ManyToManyField(Tweet, related_name="hashtags")
 
     class Meta:
         app_label = "tweetpipe"
+
+
+class DailyHashtagCount(models.Model):
+    """Number of tweets of a user per day (created_at) using a hashtag, see aggregates.py"""
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="daily_hashtag_counts"
+    )
+    date = models.DateField()
+    hashtag = models.CharField(max_length=279)
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        app_label = "tweetpipe"
+        unique_together = ("user", "date", "hashtag")
+
+    def __repr__(self):
+        return f"DailyHashtagCount(user={self.user_id}, date={self.date}, hashtag={self.hashtag}, count={self.count})"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class DailyFollowerCount(models.Model):
+    """First and last follower count of a user per day (fetched_at), see aggregates.py"""
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="daily_follower_counts"
+    )
+    date = models.DateField()
+    first_fetched_at = models.DateTimeField()
+    first_count = models.IntegerField()
+    last_fetched_at = models.DateTimeField()
+    last_count = models.IntegerField()
+
+    class Meta:
+        app_label = "tweetpipe"
+        unique_together = ("user", "date")
+
+    def __repr__(self):
+        return f"DailyFollowerCount(user={self.user_id}, date={self.date}, last_count={self.last_count})"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class Job(models.Model):
+    """Unit of work for the tweetpipe workers, see jobs.py"""
+
+    FETCH = "fetch"
+    RERUN = "rerun"
+    KIND_CHOICES = [(FETCH, "Fetch tweets of a user"), (RERUN, "Rerun a raw file")]
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # User handle (fetch) or filename (rerun)
+    target = models.CharField(max_length=1024)
+    # Number of tweets to fetch
+    count = models.PositiveIntegerField(null=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # Worker holding the lease, the lease is extended by its heartbeat
+    worker = models.CharField(max_length=255, blank=True)
+    lease_expires_at = models.DateTimeField(null=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = "tweetpipe"
+        indexes = [models.Index(fields=["status", "created_at"], name="job_status_idx")]
+        constraints = [
+            # The same work is only queued once at a time
+            models.UniqueConstraint(
+                fields=["kind", "target"],
+                condition=models.Q(status__in=["pending", "running"]),
+                name="job_unique_open",
+            )
+        ]
+
+    def __repr__(self):
+        return f"Job(id={self.id}, kind={self.kind}, target={self.target}, status={self.status})"
+
+    def __str__(self):
+        return self.__repr__()
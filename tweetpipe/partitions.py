@@ -0,0 +1,97 @@
+"""
+Create the monthly partitions of tweetpipe_tweet and tweetpipe_followercount.
+
+Both tables are range partitioned by month (UTC) since migration 0009. A row can only be
+inserted if the partition of its month exists, the loaders therefore call
+ensure_partitions for every batch before it is loaded. Old tweets of a timeline may need
+partitions of past months, these are created on demand as well.
+
+ensure_upcoming_partitions creates the partitions of the next PARTITION_MONTHS_AHEAD months,
+it is called by the CLI before the pipeline runs and by the workers before every job.
+"""
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timezone
+
+from django.db import connection
+from loguru import logger
+
+from config import settings
+from models import FollowerCount, Tweet
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
+
+# Partitioned model: partition key
+PARTITION_KEYS = {Tweet: "created_at", FollowerCount: "fetched_at"}
+
+# (table, month) of the partitions known to exist, partitions are never dropped
+_known_partitions = set()
+_lock = threading.Lock()
+
+
+def month_of(value):
+    """First day of the (UTC) month of a datetime"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, months):
+    month_index = month.year * 12 + month.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def create_partitions(model, months):
+    """Create the partitions of model for months (first days of the months)"""
+    table = model._meta.db_table
+    with _lock:
+        missing = sorted(
+            month for month in set(months) if (table, month) not in _known_partitions
+        )
+    if not missing:
+        return
+
+    with connection.cursor() as cursor:
+        for month in missing:
+            cursor.execute(
+                "SELECT tweetpipe_create_month_partition(%s, %s)", [table, month]
+            )
+            logger.debug(f"Partition {cursor.fetchone()[0]} is available.")
+
+    # Partitions created inside a transaction are gone if it is rolled back
+    if not connection.in_atomic_block:
+        with _lock:
+            _known_partitions.update((table, month) for month in missing)
+
+
+def batch_months(batch):
+    """Months of the partitioned rows in a batch of transformed tweets, per model"""
+    months = defaultdict(set)
+    for data in batch:
+        for model, key in PARTITION_KEYS.items():
+            rows = data.get(model)
+            if rows is None:
+                continue
+            if not isinstance(rows, list):
+                rows = [rows]
+            for row in rows:
+                months[model].add(month_of(row[key]))
+    return months
+
+
+def ensure_partitions(batch):
+    """Create the partitions needed to load a batch of transformed tweets"""
+    for model, months in batch_months(batch).items():
+        create_partitions(model, months)
+
+
+def ensure_upcoming_partitions(months_ahead=None):
+    """Create the partitions of the current and the next months_ahead months"""
+    months_ahead = (
+        settings.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    )
+    current_month = month_of(datetime.now(timezone.utc))
+    months = [add_months(current_month, offset) for offset in range(months_ahead + 1)]
+    for model in PARTITION_KEYS:
+        create_partitions(model, months)
@@ -0,0 +1,152 @@
+"""
+Run the extract, transform and load stages concurrently.
+
+Every stage runs in its own thread, the stages are connected by bounded queues:
+
+    extract --(raw data per user)--> transform --(transformed tweets)--> load
+
+While the extract stage waits for the api, the transform stage parses the previous
+user and the load stage writes the tweets of the user before. If a downstream stage
+falls behind (e.g., the DB), its queue fills up and the upstream stages block until
+there is room again (backpressure).
+
+If a stage fails, all stages are stopped and the exception is re-raised in the thread
+which called StagedPipeline.run.
+"""
+import queue
+import threading
+
+from django.db import connection
+from loguru import logger
+
+from config import settings
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
+
+# Marks the end of the items in a queue
+_DONE = object()
+
+
+class PipelineStopped(Exception):
+    """Raised inside a stage if another stage failed"""
+
+
+class StagedPipeline:
+    """
+    Connect three callables as concurrent stages:
+
+        extract(item) - returns the raw data for a single item (e.g., a user handle)
+        transform(raw_data) - returns an iterable of transformed tweets
+        load(transformed_tweets) - consumes an iterable of transformed tweets
+
+    The load callable is called once, with an iterable over all transformed tweets of
+    all items. This allows batching loaders (e.g. the CopyLoader) to batch across users.
+    """
+
+    def __init__(
+        self, extract, transform, load, raw_queue_size=None, queue_size=None
+    ):
+        self.extract = extract
+        self.transform = transform
+        self.load = load
+        self.raw_queue = queue.Queue(
+            maxsize=raw_queue_size or settings.PIPELINE_RAW_QUEUE_SIZE
+        )
+        self.transformed_queue = queue.Queue(
+            maxsize=queue_size or settings.PIPELINE_QUEUE_SIZE
+        )
+        self._stop = threading.Event()
+        self.errors = []
+
+    def put(self, _queue, item):
+        """Put item into the queue, block while it is full unless the pipeline stops"""
+        while not self._stop.is_set():
+            try:
+                _queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise PipelineStopped()
+
+    def iter_queue(self, _queue):
+        """Yield items from the queue until the end is reached or the pipeline stops"""
+        while not self._stop.is_set():
+            try:
+                item = _queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+        raise PipelineStopped()
+
+    def run_extract(self, items):
+        for item in items:
+            logger.debug(f"Extract stage: {item}")
+            self.put(self.raw_queue, self.extract(item))
+        self.put(self.raw_queue, _DONE)
+
+    def run_transform(self):
+        try:
+            for raw_data in self.iter_queue(self.raw_queue):
+                for transformed_tweet in self.transform(raw_data):
+                    self.put(self.transformed_queue, transformed_tweet)
+            self.put(self.transformed_queue, _DONE)
+        finally:
+            # The transformation may query the DB (prefilter.py)
+            connection.close()
+
+    def run_load(self):
+        try:
+            self.load(self.iter_queue(self.transformed_queue))
+        finally:
+            # Every thread uses its own DB connection, do not leave it open
+            connection.close()
+
+    def _run_stage(self, name, target, *args):
+        try:
+            target(*args)
+        except PipelineStopped:
+            logger.debug(f"Stage {name} stopped.")
+        except Exception as e:
+            logger.exception(f"Stage {name} failed: {e}")
+            self.errors.append(e)
+            self._stop.set()
+
+    def run(self, items):
+        """Run all stages for items and wait until they are done"""
+        stages = [
+            threading.Thread(
+                target=self._run_stage,
+                args=("extract", self.run_extract, items),
+                name="tweetpipe-extract",
+            ),
+            threading.Thread(
+                target=self._run_stage,
+                args=("transform", self.run_transform),
+                name="tweetpipe-transform",
+            ),
+            threading.Thread(
+                target=self._run_stage,
+                args=("load", self.run_load),
+                name="tweetpipe-load",
+            ),
+        ]
+        for stage in stages:
+            stage.start()
+
+        try:
+            for stage in stages:
+                # join with a timeout, otherwise KeyboardInterrupt is not raised
+                while stage.is_alive():
+                    stage.join(timeout=0.5)
+        except KeyboardInterrupt:
+            logger.warning("Interrupted, stopping all stages.")
+            self._stop.set()
+            for stage in stages:
+                stage.join()
+            raise
+
+        if self.errors:
+            raise self.errors[0]
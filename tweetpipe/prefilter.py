@@ -0,0 +1,157 @@
+"""
+Drop tweets which are already stored before they are transformed.
+
+On overlapping fetches and reruns most tweets are already in the DB. The Prefilter keeps
+a sorted array of the ids of the stored tweets per user (KnownTweets), persisted in
+PREFILTER_DIR/<DB_NAME> and refreshed incrementally (only ids > the largest known id are
+fetched). Every refresh checks the known ids against the DB (number and sum of the stored
+ids up to the largest known one): if tweets were deleted (truncate, restored DB) or older
+tweets were loaded later (reruns, backfills), the array is rebuilt. The arrays can only miss
+tweets which are loaded meanwhile (they are then loaded as usual), a known tweet is stored.
+
+Policies (PREFILTER_POLICY):
+    off - process all tweets (default)
+    skip - drop all known tweets
+    refresh_recent - drop known tweets older than PREFILTER_REFRESH_DAYS, recent tweets are
+        processed anyway to refresh their counters (retweets, favorites)
+
+The first tweet of every batch is always kept: the user and the follower count are
+parsed from it.
+"""
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Count, Sum
+from django.utils import timezone
+from loguru import logger
+
+from config import settings
+from models import Tweet
+import utils
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
+
+POLICIES = ("off", "skip", "refresh_recent")
+
+
+class KnownTweets:
+    """Sorted ids of the stored tweets of a user"""
+
+    def __init__(self, user_id, directory=None):
+        self.user_id = user_id
+        # The ids are only valid for the database they were read from
+        directory = (directory or settings.PREFILTER_DIR) / connection.settings_dict["NAME"]
+        settings.create_dir_if_missing(directory)
+        self.path = directory / f"{user_id}.ids"
+        self.ids = self.load()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(user_id={self.user_id}, ids={len(self.ids)})"
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, tweet_id):
+        idx = bisect_left(self.ids, tweet_id)
+        return idx < len(self.ids) and self.ids[idx] == tweet_id
+
+    def load(self):
+        ids = array("q")
+        try:
+            ids.frombytes(self.path.read_bytes())
+        except FileNotFoundError:
+            pass
+        return ids
+
+    def save(self):
+        # Several worker processes may refresh the same user
+        utils.write_atomic(self.path, self.ids.tobytes())
+
+    def is_stored(self, tweets):
+        """Check if the stored tweets up to the largest known id are the known ones"""
+        stored = tweets.filter(id__lte=self.ids[-1]).aggregate(
+            count=Count("id"), total=Sum("id")
+        )
+        return stored["count"] == len(self.ids) and stored["total"] == sum(self.ids)
+
+    def refresh(self):
+        """Add the ids of the tweets stored since the last refresh, return their number"""
+        tweets = Tweet.objects.filter(user_id=self.user_id)
+        with self._lock:
+            outdated = bool(self.ids) and not self.is_stored(tweets)
+            if outdated:
+                logger.warning(f"Known tweets of user {self.user_id} are outdated, rebuild.")
+                self.ids = array("q")
+            if self.ids:
+                tweets = tweets.filter(id__gt=self.ids[-1])
+            new_ids = list(tweets.order_by("id").values_list("id", flat=True))
+            if new_ids or outdated:
+                self.ids.extend(new_ids)
+                self.save()
+        return len(new_ids)
+
+
+class Prefilter:
+    def __init__(self, policy=None, refresh_days=None, directory=None):
+        self.policy = policy or settings.PREFILTER_POLICY
+        if self.policy not in POLICIES:
+            raise ValueError(f"Unknown prefilter policy '{self.policy}', use {POLICIES}")
+        refresh_days = (
+            settings.PREFILTER_REFRESH_DAYS if refresh_days is None else refresh_days
+        )
+        self.refresh_window = timedelta(days=refresh_days)
+        self.directory = directory
+        self._known = {}
+        self._lock = threading.Lock()
+
+    def known_tweets(self, user_id):
+        """Return the up to date KnownTweets of user_id"""
+        with self._lock:
+            if user_id not in self._known:
+                self._known[user_id] = KnownTweets(user_id, directory=self.directory)
+            known = self._known[user_id]
+        known.refresh()
+        return known
+
+    def is_recent(self, raw_tweet, now):
+        created_at = utils.twitter_time_to_datetime(raw_tweet["created_at"])
+        return now - created_at < self.refresh_window
+
+    def filter(self, raw_tweets):
+        """Return the raw tweets which have to be processed"""
+        if self.policy == "off" or not raw_tweets:
+            return raw_tweets
+
+        now = timezone.now()
+        known_by_user = {}
+        kept = [raw_tweets[0]]
+        for raw_tweet in raw_tweets[1:]:
+            user_id = raw_tweet["user"]["id"]
+            if user_id not in known_by_user:
+                known_by_user[user_id] = self.known_tweets(user_id)
+            if raw_tweet["id"] not in known_by_user[user_id]:
+                kept.append(raw_tweet)
+            elif self.policy == "refresh_recent" and self.is_recent(raw_tweet, now):
+                kept.append(raw_tweet)
+
+        logger.debug(
+            f"Prefilter ({self.policy}) dropped {len(raw_tweets) - len(kept)} "
+            f"of {len(raw_tweets)} tweets."
+        )
+        return kept
+
+
+_prefilter = None
+
+
+def get_prefilter():
+    """Return the Prefilter configured in the settings (one per process)"""
+    global _prefilter
+    if _prefilter is None:
+        _prefilter = Prefilter()
+    return _prefilter
@@ -0,0 +1,141 @@
+"""
+Profile the stages (extract, transform, load) of pipeline runs.
+
+Every stage is profiled separately with cProfile. In addition, the number of SQL queries
+and the time spent in them are recorded per stage (using connection.execute_wrapper,
+bulk COPYs of the CopyLoader do not go through it and are not counted).
+
+    profiler = Profiler()
+    with profiler.stage("extract"):
+        ...
+    profiler.report()
+
+The same stage can be entered several times (e.g. once per user), the numbers add up.
+Stages running in different threads (--staged) are profiled in their own thread only.
+report() writes a .prof file per stage (open with pstats or snakeviz) and a summary
+of the top hotspots to PROFILE_DIR.
+
+If profiling is disabled, the NullProfiler is used, its stages do nothing.
+"""
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from django.db import connection
+from django.utils import timezone
+from loguru import logger
+
+from config import settings
+import utils
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
+
+
+class StageStats:
+    """Profile, SQL queries and time of a single stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.profile = cProfile.Profile()
+        self.calls = 0
+        self.wall_time = 0.0
+        self.queries = 0
+        self.sql_time = 0.0
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(name='{self.name}', calls={self.calls}, "
+            f"wall_time={self.wall_time:.3f}, queries={self.queries}, sql_time={self.sql_time:.3f})"
+        )
+
+    def record_query(self, execute, sql, params, many, context):
+        """execute_wrapper counting the queries and the time spent in them"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+
+
+class Profiler:
+    enabled = True
+
+    def __init__(self, output_dir=None, top=None):
+        self.output_dir = output_dir or settings.PROFILE_DIR
+        self.top = top or settings.PROFILE_TOP
+        self.run_id = utils.datetime_to_string_format(timezone.now())
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, name):
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = StageStats(name)
+            return self.stages[name]
+
+    @contextmanager
+    def stage(self, name):
+        """Profile the code run in the context as stage name"""
+        stats = self._stats(name)
+        start = time.perf_counter()
+        stats.profile.enable()
+        try:
+            with connection.execute_wrapper(stats.record_query):
+                yield stats
+        finally:
+            stats.profile.disable()
+            stats.wall_time += time.perf_counter() - start
+            stats.calls += 1
+
+    def hotspots(self, stats):
+        """Top functions of a stage by cumulative time, as text"""
+        stream = io.StringIO()
+        profile_stats = pstats.Stats(stats.profile, stream=stream)
+        profile_stats.sort_stats("cumulative").print_stats(self.top)
+        return stream.getvalue()
+
+    def summary(self):
+        lines = []
+        for stats in self.stages.values():
+            lines.append(
+                f"Stage {stats.name}: {stats.wall_time:.3f}s in {stats.calls} call(s), "
+                f"{stats.queries} SQL queries ({stats.sql_time:.3f}s)"
+            )
+        for stats in self.stages.values():
+            lines.append(f"\n--- Top {self.top} of stage {stats.name} ---")
+            lines.append(self.hotspots(stats))
+        return "\n".join(lines)
+
+    def report(self):
+        """Write a .prof file per stage and the summary, return the summary"""
+        settings.create_dir_if_missing(self.output_dir)
+        for stats in self.stages.values():
+            prof_path = self.output_dir / f"{self.run_id}-{stats.name}.prof"
+            stats.profile.dump_stats(str(prof_path))
+            logger.info(f"{stats}, profile written to {prof_path}")
+
+        summary = self.summary()
+        summary_path = self.output_dir / f"{self.run_id}-summary.txt"
+        summary_path.write_text(summary)
+        logger.info(f"Profile summary written to {summary_path}")
+        return summary
+
+
+class NullProfiler:
+    """Profiler used when profiling is disabled"""
+
+    enabled = False
+
+    def stage(self, name):
+        return nullcontext()
+
+    def report(self):
+        return ""
+
+
+null_profiler = NullProfiler()
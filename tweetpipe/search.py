@@ -0,0 +1,65 @@
+"""
+Full text search over the stored tweets.
+
+The tweets are searched using postgres full text search on Tweet.search_vector,
+which is maintained by a trigger and indexed with a GIN index (see migration 0006).
+Results are ranked by ts_rank and can be filtered by user and date.
+"""
+from datetime import datetime, time
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, Q
+from django.utils import timezone
+from loguru import logger
+
+from models import Tweet
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
+
+
+def aware_datetime(value):
+    """Dates start at midnight, naive values are in the current time zone (TIME_ZONE)"""
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, time.min)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def search_tweets(
+    query, usernames=None, since=None, until=None, limit=20, search_type="plain"
+):
+    """
+    Return the tweets matching query, best matches first.
+
+        query: str - search terms (search_type: plain, phrase or raw tsquery syntax)
+        usernames: list of screen names to search in (default: all users)
+        since: datetime/date - only tweets created at or after since
+        until: datetime/date - only tweets created before until
+        limit: int - max. number of results
+    """
+    search_query = SearchQuery(
+        query, config=Tweet.search_config, search_type=search_type
+    )
+    tweets = Tweet.objects.filter(search_vector=search_query)
+
+    if usernames:
+        # Twitter handles are case insensitive
+        user_filter = Q()
+        for username in usernames:
+            user_filter |= Q(user__screen_name__iexact=username)
+        tweets = tweets.filter(user_filter)
+    if since:
+        tweets = tweets.filter(created_at__gte=aware_datetime(since))
+    if until:
+        tweets = tweets.filter(created_at__lt=aware_datetime(until))
+
+    tweets = (
+        tweets.annotate(rank=SearchRank(F("search_vector"), search_query))
+        .select_related("user")
+        .defer("search_vector")
+        .order_by("-rank", "-created_at")
+    )
+    logger.debug(f"Search '{query}' (users={usernames}, {since} - {until})")
+    return tweets[:limit]
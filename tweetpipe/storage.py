@@ -2,12 +2,30 @@
 Organize the interactions with AWS S3.
 
 This is a simple abstraction layer over boto3's S3 client.
+
+The BackgroundUploader writes raw files in a background thread,
+so that the pipeline does not have to wait for the upload.
+
+CachedS3 keeps a local copy of the files read from or written to S3.
+
+Dumps compacted into daily archives (see archive.py) are read from their archive
+and listed instead of it.
 """
 
+import atexit
 import boto3
-import json
+import hashlib
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from botocore.exceptions import ClientError
 from loguru import logger
+from urllib.parse import quote, unquote
 
+import archive
+from codec import get_codec
 from config import settings
 
 
@@ -16,35 +34,212 @@ class BaseStorage:
     Base Class for all file storage systems.
 
     The api expects to get and returns python dictionaries.
+    Storage systems implement the byte level methods (write_bytes, read_bytes, exists, list),
+    the conversion from and to dicts and the raw file layout are handled here.
+
+    Raw file layouts (RAW_STORAGE_LAYOUT):
+        dump - every file contains the full tweets (default)
+        dedup - every tweet and user is stored once per content under OBJECT_PREFIX
+            (tweets/<id>/<sha256>.json and users/<id>/<sha256>.json), the file itself
+            is a small manifest referencing them. Reading a manifest returns the
+            same data as reading the full dump.
+
+    Dumps which are not found are looked up in their daily archive (see archive.py),
+    listings contain the archived dumps instead of the archives.
     """
 
+    manifest_version = 1
+
     def __init__(self):
         logger.info(f"Using {self.__class__.__name__} as storage")
-        self.json_indent = 2
+        self.json_indent = settings.JSON_INDENT
+        self.codec = get_codec()
+        self.object_prefix = settings.OBJECT_PREFIX
+        # Files stored next to the raw files, they are not listed
+        self.reserved_prefixes = (settings.OBJECT_PREFIX, settings.EXPORT_PREFIX)
+        # Objects known to be stored, avoids checking the same object twice
+        self._known_objects = set()
+        # Indices of the archives read so far
+        self._archive_indices = {}
 
     def write(self, filename, data):
+        """Write data (dict) to filename"""
+        if settings.RAW_STORAGE_LAYOUT == "dedup" and "tweets" in data:
+            data = self.write_objects(data)
+        return self.write_bytes(filename, self.dict2json(data))
+
+    def read(self, filename, exclude_objects=None):
+        """
+        Read the content of filename and return it as dict.
+
+        Manifests are resolved transparently. Tweet objects with a key in exclude_objects
+        are skipped (except the first tweet of every user, see read_objects), the keys of
+        all resolved tweet objects are added to it.
+        """
+        data = self.json2dict(self.read_dump(filename))
+        if "tweetpipe_manifest" in data:
+            data = self.read_objects(data, exclude_objects)
+        return data
+
+    def read_dump(self, filename):
+        """Read filename, or the copy in its daily archive if it was compacted"""
+        try:
+            return self.read_bytes(filename)
+        except FileNotFoundError:
+            archive_filename = archive.archive_filename(filename)
+            if archive_filename is None or not self.exists(archive_filename):
+                raise
+        logger.debug(f"Read {filename} from {archive_filename}")
+        return self.read_archived(archive_filename, filename)
+
+    def archive_index(self, archive_filename, refresh=False):
+        """Return the index of an archive, using only range reads"""
+        if refresh or archive_filename not in self._archive_indices:
+            footer = self.read_range(archive_filename, -archive.FOOTER.size)
+            index_offset, index_length = archive.parse_footer(footer)
+            index = self.read_range(
+                archive_filename, index_offset, index_offset + index_length
+            )
+            self._archive_indices[archive_filename] = archive.parse_index(index)
+        return self._archive_indices[archive_filename]
+
+    def read_archived(self, archive_filename, filename):
+        """Read the dump filename from an archive, seeking directly to its member"""
+        index = self.archive_index(archive_filename)
+        if filename not in index:
+            # The archive may have been extended since its index was read
+            index = self.archive_index(archive_filename, refresh=True)
+        try:
+            offset, length = index[filename]
+        except KeyError:
+            raise FileNotFoundError(f"{filename} (not in {archive_filename})")
+        return archive.read_member(
+            self.read_range(archive_filename, offset, offset + length)
+        )
+
+    def expand_archives(self, filenames):
+        """Replace the archives in filenames with the dumps they contain"""
+        expanded = []
+        for filename in filenames:
+            if archive.is_archive(filename):
+                expanded.extend(sorted(self.archive_index(filename, refresh=True)))
+            else:
+                expanded.append(filename)
+        return expanded
+
+    def list(self, username, expand_archives=True):
+        raise NotImplementedError(
+            f"{self.__class__.__name__}.list(username, expand_archives) Not Implemented."
+        )
+
+    def write_bytes(self, filename, data):
         raise NotImplementedError(
-            f"{self.__class__.__name__}.write(filename, data) Not Implemented."
+            f"{self.__class__.__name__}.write_bytes(filename, data) Not Implemented."
         )
 
-    def list(self, username):
+    def read_bytes(self, filename):
         raise NotImplementedError(
-            f"{self.__class__.__name__}.list(username) Not Implemented."
+            f"{self.__class__.__name__}.read_bytes(filename) Not Implemented."
         )
 
-    def read(self, filename):
+    def read_range(self, filename, start, end=None):
+        """Read bytes [start, end) of filename, a negative start reads the last -start bytes"""
         raise NotImplementedError(
-            f"{self.__class__.__name__}.read(filename) Not Implemented."
+            f"{self.__class__.__name__}.read_range(filename, start, end) Not Implemented."
+        )
+
+    def exists(self, filename):
+        raise NotImplementedError(
+            f"{self.__class__.__name__}.exists(filename) Not Implemented."
+        )
+
+    def delete(self, filename):
+        raise NotImplementedError(
+            f"{self.__class__.__name__}.delete(filename) Not Implemented."
         )
 
     def dict2json(self, data_dict):
-        data_json = json.dumps(data_dict, indent=self.json_indent)
+        """Serialize data_dict into json (bytes)"""
+        data_json = self.codec.dumps(data_dict, indent=self.json_indent)
         return data_json
 
     def json2dict(self, data_json):
-        data_dict = json.loads(data_json)
+        """Deserialize json (bytes or str)"""
+        data_dict = self.codec.loads(data_json)
         return data_dict
 
+    def is_object(self, filename):
+        return filename.startswith(f"{self.object_prefix}/")
+
+    def is_raw_file(self, filename):
+        """Raw dumps, manifests and archives (no dedup objects or exports)"""
+        return not any(
+            filename.startswith(f"{prefix}/") for prefix in self.reserved_prefixes
+        )
+
+    def write_object(self, kind, object_id, obj):
+        """Store obj once per content, return its key"""
+        content = self.codec.canonical(obj)
+        digest = hashlib.sha256(content).hexdigest()
+        key = f"{self.object_prefix}/{kind}/{object_id}/{digest}.json"
+        if key not in self._known_objects:
+            if not self.exists(key):
+                self.write_bytes(key, content)
+            self._known_objects.add(key)
+        return key
+
+    def write_objects(self, data):
+        """Store the tweets and users of data as objects and return the manifest"""
+        manifest = {
+            "tweetpipe_manifest": self.manifest_version,
+            "tweetpipe_metadata": None,
+            "tweets": [],
+        }
+        new_objects = 0
+        for tweet in data["tweets"]:
+            tweet = dict(tweet)
+            # The metadata differs for every run and the user for every follower,
+            # store them separately to keep the tweet objects stable.
+            manifest["tweetpipe_metadata"] = tweet.pop("tweetpipe_metadata", None)
+            user = tweet.pop("user")
+            known_objects = len(self._known_objects)
+            manifest["tweets"].append(
+                {
+                    "tweet": self.write_object("tweets", tweet["id"], tweet),
+                    "user": self.write_object("users", user["id"], user),
+                }
+            )
+            new_objects += len(self._known_objects) - known_objects
+
+        logger.debug(
+            f"Stored {len(data['tweets'])} tweets, {new_objects} new/unseen objects."
+        )
+        return manifest
+
+    def read_objects(self, manifest, exclude_objects=None):
+        """
+        Resolve the objects referenced by manifest into the original dump.
+
+        The user and the follower count are parsed from the tweets with the metadata of
+        the manifest: the first tweet of every user is kept even if it is excluded.
+        """
+        if exclude_objects is None:
+            exclude_objects = set()
+        users = {}
+        tweets = []
+        for refs in manifest["tweets"]:
+            if refs["tweet"] in exclude_objects and refs["user"] in users:
+                continue
+            exclude_objects.add(refs["tweet"])
+            tweet = self.json2dict(self.read_bytes(refs["tweet"]))
+            if refs["user"] not in users:
+                users[refs["user"]] = self.json2dict(self.read_bytes(refs["user"]))
+            tweet["user"] = users[refs["user"]]
+            tweet["tweetpipe_metadata"] = manifest["tweetpipe_metadata"]
+            tweets.append(tweet)
+
+        return {"tweets": tweets}
+
 
 class S3(BaseStorage):
     def __init__(self):
@@ -63,69 +258,484 @@ class S3(BaseStorage):
         )
         return client
 
-    def write(self, filename, data):
-        """Write data to file with filename in S3 Bucket"""
-        json_data = self.dict2json(data)
+    def list(self, username=None, expand_archives=True):
+        """List files with prefix username stored in S3"""
+        paginator = self._client.get_paginator("list_objects_v2")
+        keys = []
+        for response in paginator.paginate(
+            Bucket=self.bucket_name, Prefix=username or ""
+        ):
+            for file in response.get("Contents", []):
+                if self.is_raw_file(file["Key"]):
+                    keys.append(file["Key"])
+        if expand_archives:
+            keys = self.expand_archives(keys)
+        return username, len(keys), keys
+
+    def get_object(self, filename, **kwargs):
+        """Return the get_object response for filename (kwargs e.g. IfNoneMatch, Range)"""
+        try:
+            return self._client.get_object(
+                Bucket=self.bucket_name, Key=filename, **kwargs
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                raise FileNotFoundError(filename) from e
+            raise
+
+    def read_bytes(self, filename):
+        """Read file content of file with certain filename"""
+        response = self.get_object(filename)
+        return response["Body"].read()
+
+    def read_range(self, filename, start, end=None):
+        if start < 0:
+            byte_range = f"bytes={start}"
+        elif end is None:
+            byte_range = f"bytes={start}-"
+        else:
+            byte_range = f"bytes={start}-{end - 1}"
+        response = self.get_object(filename, Range=byte_range)
+        return response["Body"].read()
+
+    def write_bytes(self, filename, data):
+        """Write raw bytes (e.g. non json files) to filename in S3 Bucket, return the ETag"""
+        if len(data) > settings.S3_MULTIPART_THRESHOLD:
+            return self.write_multipart(filename, data)
+
         response = self._client.put_object(
-            Bucket=self.bucket_name, Body=json_data, Key=filename
+            Bucket=self.bucket_name, Body=data, Key=filename
         )
         if not response["ResponseMetadata"]["HTTPStatusCode"] == 200:
             logger.warning(response)
-            return response
+        return response["ETag"]
 
-    def list(self, username=None):
-        """List files with prefix username stored in S3"""
-        response = self._client.list_objects_v2(
-            Bucket=self.bucket_name, Prefix=username
+    def write_multipart(self, filename, data):
+        """Upload large files in chunks of S3_MULTIPART_CHUNK_SIZE bytes"""
+        client = self._client
+        chunk_size = settings.S3_MULTIPART_CHUNK_SIZE
+        upload = client.create_multipart_upload(
+            Bucket=self.bucket_name, Key=filename
         )
-        key_count = response["KeyCount"]
+        upload_id = upload["UploadId"]
         try:
-            contents = response["Contents"]
-            keys = [file["Key"] for file in contents]
-        except KeyError:
-            logger.debug(response)
-            keys = []
-        return username, key_count, keys
+            parts = []
+            for part_number, start in enumerate(
+                range(0, len(data), chunk_size), start=1
+            ):
+                response = client.upload_part(
+                    Bucket=self.bucket_name,
+                    Key=filename,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=data[start : start + chunk_size],
+                )
+                parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
 
-    def read(self, filename):
-        """Read file content of file with certain filename"""
-        response = self._client.get_object(
-            Bucket=self.bucket_name, Key=filename
-        )
-        data = response["Body"].read()
-        return self.json2dict(data)
+            response = client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=filename,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except Exception:
+            client.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=filename, UploadId=upload_id
+            )
+            raise
+        logger.debug(f"Uploaded {filename} in {len(parts)} parts.")
+        return response["ETag"]
+
+    def exists(self, filename):
+        """Check if a file with filename is stored in S3"""
+        try:
+            self._client.head_object(Bucket=self.bucket_name, Key=filename)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+        return True
+
+    def delete(self, filename):
+        """Delete filename from the S3 Bucket"""
+        self._client.delete_object(Bucket=self.bucket_name, Key=filename)
 
 
 class LocalFileSystem(BaseStorage):
-    def __init__(self):
+    def __init__(self, data_dir=None):
         super().__init__()
-        self.data_dir = settings.LOCAL_STORAGE_DIR
+        self.data_dir = data_dir or settings.LOCAL_STORAGE_DIR
 
-    def write(self, filename, data):
-        """Write data to filename in local data_dir"""
-        try:
-            with open(self.data_dir / filename, "w") as f:
-                json.dump(data, f, indent=self.json_indent)
-        except FileNotFoundError:
-            # Create subdir in data dir
-            subdirs = filename.rsplit("/", 1)[0]
-            new_dir = self.data_dir / subdirs
-            new_dir.mkdir(exist_ok=True)
-            with open(self.data_dir / filename, "w") as f:
-                json.dump(data, f, indent=self.json_indent)
-
-    def list(self, username=None):
+    def list(self, username=None, expand_archives=True):
         """List files in local data_dir"""
         username = username or ""
         files = []
         for file_ in self.data_dir.glob(f"*{username}*/*"):
             if file_.is_file():
-                file_ = str(file_).split("/", 2)[-1]
-                files.append(file_)
+                file_ = str(file_.relative_to(self.data_dir))
+                if self.is_raw_file(file_):
+                    files.append(file_)
+        if expand_archives:
+            files = self.expand_archives(files)
         return username, len(files), files
 
-    def read(self, filename):
+    def read_bytes(self, filename):
         """Read content in filename from local data_dir"""
-        with open(self.data_dir / filename) as f:
-            data = json.load(f)
+        return (self.data_dir / filename).read_bytes()
+
+    def read_range(self, filename, start, end=None):
+        with open(self.data_dir / filename, "rb") as file_:
+            if start < 0:
+                file_.seek(start, 2)
+                return file_.read()
+            file_.seek(start)
+            return file_.read() if end is None else file_.read(end - start)
+
+    def write_bytes(self, filename, data):
+        """Write raw bytes (e.g. non json files) to filename in local data_dir"""
+        path = self.data_dir / filename
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    def exists(self, filename):
+        """Check if filename exists in local data_dir"""
+        return (self.data_dir / filename).is_file()
+
+    def delete(self, filename):
+        """Delete filename from local data_dir"""
+        (self.data_dir / filename).unlink()
+
+
+class CachedS3(BaseStorage):
+    """
+    S3 with a local, size bounded LRU cache in front of it.
+
+    The cache is a LocalFileSystem in S3_CACHE_DIR/files, the ETag of every cached file
+    is kept in S3_CACHE_DIR/etags.
+        write - write-through: the file is written to S3 and to the cache
+        read - read-through: cached files are validated with a conditional GET
+            (IfNoneMatch=ETag), which does not transfer the content if it is unchanged.
+            Objects of the dedup layout never change and are not validated.
+        list - listings are cached for S3_CACHE_LIST_TTL seconds
+    The least recently used files are evicted once the cache exceeds S3_CACHE_MAX_SIZE bytes.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.remote = S3()
+        self.cache_dir = settings.S3_CACHE_DIR
+        self.local = LocalFileSystem(data_dir=self.cache_dir / "files")
+        self.etags_dir = self.cache_dir / "etags"
+        self.lists_dir = self.cache_dir / "lists"
+        settings.create_dir_if_missing(self.local.data_dir)
+        settings.create_dir_if_missing(self.etags_dir)
+        settings.create_dir_if_missing(self.lists_dir)
+        self.max_size = settings.S3_CACHE_MAX_SIZE
+        self.list_ttl = settings.S3_CACHE_LIST_TTL
+
+        # filename: size of all cached files, least recently used first
+        self._lru = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._load_lru()
+
+    def _load_lru(self):
+        """Restore the LRU order of the files cached by earlier runs (by mtime)"""
+        files = []
+        for path in self.etags_dir.rglob("*"):
+            if not path.is_file():
+                continue
+            filename = str(path.relative_to(self.etags_dir))
+            try:
+                stat = (self.local.data_dir / filename).stat()
+            except FileNotFoundError:
+                path.unlink()
+                continue
+            files.append((stat.st_mtime, filename, stat.st_size))
+
+        for _, filename, size in sorted(files):
+            self._lru[filename] = size
+            self._size += size
+        logger.debug(f"{len(self._lru)} cached file(s), {self._size} bytes.")
+
+    def _etag_path(self, filename):
+        return self.etags_dir / filename
+
+    def _cached_etag(self, filename):
+        with self._lock:
+            if filename not in self._lru:
+                return None
+        try:
+            return self._etag_path(filename).read_text()
+        except FileNotFoundError:
+            return None
+
+    def _read_cached(self, filename):
+        """Read filename from the cache and mark it as recently used, None if it is missing"""
+        try:
+            data = self.local.read_bytes(filename)
+        except FileNotFoundError:
+            # Evicted by another thread in the meantime
+            return None
+        with self._lock:
+            if filename in self._lru:
+                self._lru.move_to_end(filename)
+        # The mtime keeps the LRU order across runs
+        (self.local.data_dir / filename).touch()
         return data
+
+    def _store(self, filename, data, etag):
+        """Add data to the cache and evict the least recently used files"""
+        if len(data) > self.max_size:
+            return
+        etag_path = self._etag_path(filename)
+        # A cached file is only valid with its ETag, remove it while the file is written
+        with self._lock:
+            self._size -= self._lru.pop(filename, 0)
+        try:
+            etag_path.unlink()
+        except FileNotFoundError:
+            pass
+        self.local.write_bytes(filename, data)
+        etag_path.parent.mkdir(parents=True, exist_ok=True)
+        etag_path.write_text(etag)
+
+        with self._lock:
+            self._lru[filename] = len(data)
+            self._size += len(data)
+            evicted = []
+            while self._size > self.max_size:
+                evicted_filename, size = self._lru.popitem(last=False)
+                self._size -= size
+                evicted.append(evicted_filename)
+
+        for evicted_filename in evicted:
+            for path in (
+                self._etag_path(evicted_filename),
+                self.local.data_dir / evicted_filename,
+            ):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+        if evicted:
+            logger.debug(f"Evicted {len(evicted)} file(s) from the cache.")
+
+    def read_bytes(self, filename):
+        """Read filename from the cache, fetch it from S3 if it is missing or changed"""
+        etag = self._cached_etag(filename)
+        response = None
+        if etag is not None and self.is_object(filename):
+            data = self._read_cached(filename)
+            if data is not None:
+                return data
+        elif etag is not None:
+            try:
+                response = self.remote.get_object(filename, IfNoneMatch=etag)
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "304":
+                    raise
+                data = self._read_cached(filename)
+                if data is not None:
+                    logger.debug(f"{filename} not modified, read from the cache.")
+                    return data
+
+        if response is None:
+            response = self.remote.get_object(filename)
+        data = response["Body"].read()
+        self._store(filename, data, response["ETag"])
+        return data
+
+    def write_bytes(self, filename, data):
+        """Write data to S3 and the cache"""
+        etag = self.remote.write_bytes(filename, data)
+        self._store(filename, data, etag)
+        if not self.is_object(filename):
+            self._invalidate_lists(filename)
+        return etag
+
+    def read_range(self, filename, start, end=None):
+        return self.remote.read_range(filename, start, end)
+
+    def exists(self, filename):
+        if self.is_object(filename) and self._cached_etag(filename) is not None:
+            return True
+        return self.remote.exists(filename)
+
+    def delete(self, filename):
+        """Delete filename from S3 and the cache"""
+        self.remote.delete(filename)
+        with self._lock:
+            self._size -= self._lru.pop(filename, 0)
+        for path in (self._etag_path(filename), self.local.data_dir / filename):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        self._invalidate_lists(filename)
+
+    def _list_path(self, username):
+        return self.lists_dir / f"prefix={quote(username or '', safe='')}.json"
+
+    def _invalidate_lists(self, filename):
+        """Drop the cached listings which would contain filename"""
+        for path in self.lists_dir.glob("prefix=*.json"):
+            prefix = unquote(path.name[len("prefix=") : -len(".json")])
+            if filename.startswith(prefix):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def list(self, username=None, expand_archives=True):
+        """List files with prefix username, use a cached listing younger than S3_CACHE_LIST_TTL"""
+        if not expand_archives:
+            return self.remote.list(username, expand_archives=False)
+        list_path = self._list_path(username)
+        try:
+            if time.time() - list_path.stat().st_mtime < self.list_ttl:
+                listing = self.json2dict(list_path.read_bytes())
+                return username, listing["key_count"], listing["keys"]
+        except FileNotFoundError:
+            pass
+
+        username, key_count, keys = self.remote.list(username)
+        list_path.write_bytes(self.dict2json({"key_count": key_count, "keys": keys}))
+        return username, key_count, keys
+
+
+class UploadError(Exception):
+    pass
+
+
+class BackgroundUploader:
+    """
+    Write raw files to a storage system in a background thread.
+
+    submit() returns immediately. Up to UPLOAD_QUEUE_SIZE files are kept in memory,
+    further files are serialized and spooled to disk (SPOOL_DIR) until the background
+    thread catches up. Failed uploads are retried and finally left in the spool.
+    Spooled files of earlier runs are uploaded when the uploader starts.
+
+    flush() blocks until all files are written and raises an UploadError if a file
+    could not be written. It is also called when the process exits.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.spool_dir = settings.SPOOL_DIR / storage.__class__.__name__.lower()
+        settings.create_dir_if_missing(self.spool_dir)
+        self.max_in_memory = settings.UPLOAD_QUEUE_SIZE
+        self.retries = settings.UPLOAD_RETRIES
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._in_memory = 0
+        self.failed = []
+
+        for spool_path in sorted(self.spool_dir.glob("*.spool")):
+            logger.info(f"Upload spooled file {spool_path} from an earlier run.")
+            self._queue.put((self._spool_filename(spool_path), None, spool_path))
+
+        self._thread = threading.Thread(
+            target=self._run, name="tweetpipe-uploader", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self._flush_at_exit)
+
+    @staticmethod
+    def _spool_filename(spool_path):
+        return unquote(spool_path.name.split(".", 1)[1].rsplit(".", 1)[0])
+
+    def spool(self, filename, data):
+        """Serialize data into a spool file, return its path"""
+        spool_path = self.spool_dir / f"{uuid.uuid4().hex}.{quote(filename, safe='')}.spool"
+        tmp_path = spool_path.with_suffix(".tmp")
+        tmp_path.write_bytes(self.storage.dict2json(data))
+        tmp_path.replace(spool_path)
+        return spool_path
+
+    def submit(self, filename, data):
+        """Queue data to be written to filename. data must not be modified afterwards."""
+        with self._lock:
+            in_memory = self._in_memory < self.max_in_memory
+            if in_memory:
+                self._in_memory += 1
+
+        if in_memory:
+            self._queue.put((filename, data, None))
+        else:
+            logger.debug(f"Upload queue full, spool {filename} to disk.")
+            self._queue.put((filename, None, self.spool(filename, data)))
+
+    def _write(self, filename, data, spool_path):
+        if spool_path is not None:
+            data = self.storage.json2dict(spool_path.read_bytes())
+            self.storage.write(filename, data)
+        else:
+            self.storage.write(filename, data)
+
+    def _upload(self, filename, data, spool_path):
+        """Write the file, retry failed attempts and finally spool it"""
+        for attempt in range(1, self.retries + 1):
+            try:
+                self._write(filename, data, spool_path)
+                logger.debug(f"Uploaded {filename}.")
+                if spool_path is not None:
+                    spool_path.unlink()
+                return
+            except Exception as e:
+                logger.warning(f"Upload of {filename} failed (attempt {attempt}): {e}")
+
+        if spool_path is None:
+            # Keep the data on disk, the next run uploads it
+            spool_path = self.spool(filename, data)
+        logger.error(f"Could not upload {filename}, kept in {spool_path}")
+        self.failed.append(filename)
+
+    def _run(self):
+        while True:
+            filename, data, spool_path = self._queue.get()
+            try:
+                self._upload(filename, data, spool_path)
+            except Exception as e:
+                # E.g. the spool failed, the thread must go on: flush waits for every file
+                logger.exception(f"Could not upload or spool {filename}: {e}")
+                self.failed.append(filename)
+            finally:
+                if data is not None:
+                    with self._lock:
+                        self._in_memory -= 1
+                self._queue.task_done()
+
+    def flush(self):
+        """Wait until all submitted files are written"""
+        self._queue.join()
+        if self.failed:
+            failed, self.failed = self.failed, []
+            raise UploadError(f"Could not upload {failed}, see {self.spool_dir}")
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except UploadError as e:
+            logger.error(e)
+
+
+_uploaders = {}
+_uploaders_lock = threading.Lock()
+
+
+def get_uploader(storage):
+    """Return the BackgroundUploader for the class of storage (one per process)"""
+    key = storage.__class__
+    with _uploaders_lock:
+        if key not in _uploaders:
+            _uploaders[key] = BackgroundUploader(storage)
+        return _uploaders[key]
+
+
+def flush_uploads():
+    """Wait for all background uploads, raise an UploadError if any failed"""
+    for uploader in _uploaders.values():
+        uploader.flush()
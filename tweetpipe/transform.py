@@ -4,34 +4,41 @@ Transform the raw, extracted data.
 The machinery for the ModelParser can be found in core.py
 
 The top-level parser (TweetPipeParser) iterates through the tweets and passes
-the tweet dict to all individual parsers
+the tweet dict to all individual parsers registered with @registry.register.
 ObjParsers take the entire tweetdict (incl. tweetpipe_metadata) and do the following:
   - create artificial fields
-  - reformat/filter dict to only contain relevant fields
+  - reformat/filter dict to only contain the columns of their model
   - return dict {model_class: fields}
 TweetPipeParser then merges these dicts and returns a single dict.
+Foreign keys and many-to-many relations are not emitted by the parsers, the loader
+links the instances of the same tweet (see ParserRegistry.relations).
 
+Before the transformation, raw tweets can be compacted (compact_data). Only the fields
+which are read by the registered parsers (their relevant_fields) are kept and stored in
+slim RawTweet records instead of the full tweet dicts.
+
+Tweets which are already stored can be dropped before the transformation (see prefilter.py).
 """
 from loguru import logger
 
 import utils
-from core import ModelParser
+from core import ModelParser, ParserRegistry
 from models import FollowerCount, Hashtag, Tweet, User
+from prefilter import get_prefilter
 
 _log_file_name = __file__.split("/")[-1].split(".")[0]
 logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
 
+registry = ParserRegistry()
+
+# Keys of the metadata added to every raw tweet (see extract.Tweets.enhance_data)
+METADATA_FIELDS = ("fetched_at", "username", "count")
+
 
 class TweetPipeParser:
     def __init__(self, data):
         self.raw_tweets = data.pop("tweets")
-        # This could be moved into a registered decorator
-        self.registered_parsers = [
-            UserParser,
-            TweetParser,
-            FollowerCountParser,
-            HashtagParser,
-        ]
+        self.registered_parsers = registry.parsers
 
     def process(self):
         """Process the raw data and pass chunks onto the corresponding ModelParsers"""
@@ -53,32 +60,42 @@ class BaseModelParser(ModelParser):
 
     def __init__(self):
         super().__init__()
-        self.relevant_fields = ["tweetpipe_metadata.*"] + self.relevant_fields
+        self.relevant_fields = self.source_fields()
         self.field_transformations = {
             **{"fetched_at": self.transform_datetime},
             **self.field_transformations,
         }
 
+    @classmethod
+    def source_fields(cls):
+        """relevant_fields incl. the fields added for all parsers"""
+        metadata_fields = [f"tweetpipe_metadata.{field}" for field in METADATA_FIELDS]
+        return metadata_fields + cls.relevant_fields
+
     def transform_datetime(self, datetime_str):
         return utils.twitter_time_to_datetime(datetime_str)
 
 
+@registry.register
 class UserParser(BaseModelParser):
+    _model = User
+    relevant_fields = ["user.*"]
+
     def __init__(self, data):
         self.data = data
-        self._model = User
-        self.relevant_fields = ["user.*"]
 
         self.field_transformations = {"created_at": self.transform_datetime}
 
         super().__init__()
 
 
+@registry.register
 class FollowerCountParser(BaseModelParser):
+    _model = FollowerCount
+    relevant_fields = ["user.followers_count"]
+
     def __init__(self, data):
         self.data = data
-        self._model = FollowerCount
-        self.relevant_fields = ["user.followers_count", "user"]
         self.general_transformations = [self.transform_followers_count]
 
         super().__init__()
@@ -87,11 +104,20 @@ class FollowerCountParser(BaseModelParser):
         self.data["count"] = self.data["followers_count"]
 
 
+@registry.register
 class TweetParser(BaseModelParser):
+    _model = Tweet
+    relevant_fields = [
+        "id",
+        "created_at",
+        "full_text",
+        "display_text_range",
+        "retweet_count",
+        "favorite_count",
+    ]
+
     def __init__(self, data):
         self.data = data
-        self._model = Tweet
-        self.relevant_fields = ["*"]
 
         self.field_transformations = {"created_at": self.transform_datetime}
 
@@ -107,26 +133,112 @@ class TweetParser(BaseModelParser):
         self.data["tweet_url"] = tweet_url
 
 
+@registry.register
 class HashtagParser(BaseModelParser):
+    _model = Hashtag
+    relevant_fields = ["entities.hashtags"]
+
     def __init__(self, data):
         self.data = data
-        self._model = Hashtag
-        self.relevant_fields = ["entities.hashtags"]
         super().__init__()
 
     def process(self):
         self.pre_transformation_filter()
         hashtags = []
         for hashtag in self.data["hashtags"]:
-            fields = {"text": hashtag["text"], "tweet": None}
-            # Hack
-            fields["tweets"] = fields["tweet"]
-            hashtags.append(fields)
+            hashtags.append({"text": hashtag["text"]})
 
         return {self._model: hashtags}
 
 
+class RawRecord:
+    """
+    Slim, read-only representation of a raw tweet dict.
+
+    Subclasses define __slots__ for the top-level fields of the tweet, no per instance
+    dict is allocated. Supports the parts of the mapping protocol used by the
+    ModelParser (record[field], field in record, keys() and ** unpacking).
+    """
+
+    __slots__ = ()
+
+    def __init__(self, data):
+        for field in self.__slots__:
+            if field in data:
+                setattr(self, field, data[field])
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def __contains__(self, field):
+        return hasattr(self, field)
+
+    def keys(self):
+        return [field for field in self.__slots__ if hasattr(self, field)]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(id={getattr(self, 'id', None)})"
+
+
+class TweetCompactor:
+    """
+    Convert raw tweet dicts into RawTweet records.
+
+    The fields of the record and the projection of nested dicts are derived from the
+    source fields of the registered parsers (see ParserRegistry.source_fields). Nested
+    dicts which repeat from tweet to tweet (the user and the tweetpipe metadata) are
+    shared between the records instead of being stored once per tweet.
+    """
+
+    shared_fields = ("user", "tweetpipe_metadata")
+
+    def __init__(self, source_fields):
+        self.projection = utils.projection_tree(source_fields)
+        if self.projection is True:
+            # A parser reads the entire tweet, nothing to project
+            self.record_class = None
+        else:
+            self.record_class = type(
+                "RawTweet", (RawRecord,), {"__slots__": tuple(self.projection)}
+            )
+        self._shared = {}
+
+    def share(self, field, value):
+        """Return an equal value seen before (if any), to avoid storing duplicates"""
+        previous = self._shared.get(field)
+        if previous is not None and previous == value:
+            return previous
+        self._shared[field] = value
+        return value
+
+    def compact(self, raw_tweet):
+        if self.record_class is None:
+            return raw_tweet
+        tweet = utils.project_dict(raw_tweet, self.projection)
+        for field in self.shared_fields:
+            if field in tweet:
+                tweet[field] = self.share(field, tweet[field])
+        return self.record_class(tweet)
+
+
+def compact_data(data):
+    """
+    Return a copy of data with all raw tweets converted into compact RawTweet records.
+
+    The full tweet dicts in data are not modified. As soon as all references to data are
+    dropped, only the compact records remain in memory.
+    """
+    compactor = TweetCompactor(registry.source_fields)
+    compacted = {key: value for key, value in data.items() if key != "tweets"}
+    compacted["tweets"] = [compactor.compact(tweet) for tweet in data["tweets"]]
+    return compacted
+
+
 def get_transformed_data(data):
     """Entry function to run the main TweetPipeParser and transform the raw data"""
+    data["tweets"] = get_prefilter().filter(data["tweets"])
     parser = TweetPipeParser(data)
     return parser.process()
@@ -1,6 +1,8 @@
 """
 Utilities for Project TweetPipe.
 """
+import os
+import tempfile
 from datetime import datetime
 from config import settings
 
@@ -26,7 +28,60 @@ def convert_twitter2default_format(datetime_str):
     return convert_datetime_format_str(settings.TWITTER_TIME_FORMAT, settings.DEFAULT_DATETIME_FORMAT, datetime_str)
 
 
+def write_atomic(path, content):
+    """Write bytes to path, readers (and concurrent writers) never see a partial file"""
+    with tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False
+    ) as tmp_file:
+        tmp_file.write(content)
+    try:
+        os.replace(tmp_file.name, path)
+    except BaseException:
+        os.unlink(tmp_file.name)
+        raise
+
+
 def filter_dict(bigdict, fields):
     """Shrink a big dict to only contain keys in fields"""
     fields = set(fields)
     return {k: bigdict[k] for k in bigdict.keys() & fields}
+
+
+def projection_tree(paths):
+    """
+    Convert dotted field paths into a nested projection tree.
+
+    Paths use the notation of ModelParser.relevant_fields:
+        "field" or "field.*" keep the entire field
+        "field.sub_field" keep only sub_field of field
+    Returns True if the entire dict is kept (e.g., for "*").
+    """
+    tree = {}
+    for path in paths:
+        nested_fields = path.split(".")
+        if nested_fields[-1] in ("*", ""):
+            nested_fields = nested_fields[:-1]
+        if not nested_fields:
+            return True
+
+        subtree = tree
+        for nested_field in nested_fields[:-1]:
+            if subtree.get(nested_field) is True:
+                break
+            subtree = subtree.setdefault(nested_field, {})
+        else:
+            subtree[nested_fields[-1]] = True
+    return tree
+
+
+def project_dict(bigdict, tree):
+    """Copy of bigdict only containing the (nested) fields in the projection tree"""
+    projected = {}
+    for field, subtree in tree.items():
+        if field not in bigdict:
+            continue
+        value = bigdict[field]
+        if subtree is not True and isinstance(value, dict):
+            value = project_dict(value, subtree)
+        projected[field] = value
+    return projected
@@ -0,0 +1,214 @@
+"""
+Validate transformed tweets against the constraints of their models before loading.
+
+Without validation, rows violating a constraint (e.g. a name longer than User.name allows)
+are only discovered by postgres, after the round trip. A single bad row aborts an entire
+COPY batch, which is then reloaded tweet by tweet.
+
+The checks of every column are compiled once from the model (_meta):
+    - not null (null=False)
+    - max_length (CharField, URLField, ...)
+    - integer range (IntegerField, BigIntegerField, positive fields)
+    - valid url (URLField, empty strings are allowed: tweets without a link)
+
+Invalid rows are written to a dead letter file (DEAD_LETTER_DIR/<date>.jsonl, one json
+object per line) together with the reasons. Invalid rows of models with several rows per
+tweet (e.g. hashtags) are dropped individually, for all other models the entire tweet is
+dropped: the rows of a tweet depend on each other.
+"""
+import json
+import threading
+
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import models
+from django.utils import timezone
+from loguru import logger
+
+from config import settings
+from models import Tweet
+from transform import registry
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+logger.add(f"logs/tweetpipe_{_log_file_name}.log", rotation="1 day")
+
+# Value ranges of the integer fields (postgres)
+INTEGER_RANGES = {
+    "SmallIntegerField": (-(2 ** 15), 2 ** 15 - 1),
+    "IntegerField": (-(2 ** 31), 2 ** 31 - 1),
+    "BigIntegerField": (-(2 ** 63), 2 ** 63 - 1),
+    "PositiveSmallIntegerField": (0, 2 ** 15 - 1),
+    "PositiveIntegerField": (0, 2 ** 31 - 1),
+}
+
+
+def compile_checks(field):
+    """Return a list of functions, which return a reason if the value is invalid"""
+    checks = []
+    if not field.null:
+        checks.append(lambda value: "is null" if value is None else None)
+
+    max_length = getattr(field, "max_length", None)
+    if max_length is not None:
+
+        def check_max_length(value):
+            if isinstance(value, str) and len(value) > max_length:
+                return f"has {len(value)} characters (max_length={max_length})"
+
+        checks.append(check_max_length)
+
+    integer_range = INTEGER_RANGES.get(field.get_internal_type())
+    if integer_range is not None:
+        lower, upper = integer_range
+
+        def check_range(value):
+            if isinstance(value, int) and not lower <= value <= upper:
+                return f"{value} is out of range [{lower}, {upper}]"
+
+        checks.append(check_range)
+
+    # The internal type of a URLField is CharField
+    if isinstance(field, models.URLField):
+        url_validator = URLValidator()
+
+        def check_url(value):
+            if not value:
+                return None
+            try:
+                url_validator(value)
+            except ValidationError:
+                return f"'{value}' is not a valid url"
+
+        checks.append(check_url)
+
+    return checks
+
+
+class ModelValidator:
+    """Checks of all columns of a model emitted by its parser"""
+
+    def __init__(self, model, columns):
+        self.model = model
+        self.checks = {}
+        self.required = set()
+        for name in sorted(columns):
+            field = model._meta.get_field(name)
+            self.checks[name] = compile_checks(field)
+            if not field.null and not field.has_default():
+                self.required.add(name)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(model={self.model.__name__})"
+
+    def errors(self, row):
+        """Return the reasons why row is invalid (empty if it is valid)"""
+        errors = [f"{name} is missing" for name in self.required if name not in row]
+        for name, checks in self.checks.items():
+            if name not in row:
+                continue
+            value = row[name]
+            for check in checks:
+                reason = check(value)
+                if reason is not None:
+                    errors.append(f"{name} {reason}")
+        return errors
+
+
+class DeadLetter:
+    """Append invalid rows and their reasons to a jsonl file per day, kept open"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or settings.DEAD_LETTER_DIR
+        settings.create_dir_if_missing(self.directory)
+        self._lock = threading.Lock()
+        self._file = None
+        self.count = 0
+
+    def _file_of(self, day):
+        """Return the open file of day, the file of the previous day is closed"""
+        path = self.directory / f"{day:%Y%m%d}.jsonl"
+        if self._file is None or self._file.name != str(path):
+            self.close()
+            self._file = open(path, "a", encoding="utf-8")
+        return self._file
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def write(self, model, row, reasons, dropped, tweet_id=None):
+        now = timezone.now()
+        entry = {
+            "model": model.__name__,
+            "tweet_id": tweet_id,
+            "dropped": dropped,
+            "reasons": reasons,
+            "row": row,
+            "rejected_at": now.isoformat(),
+        }
+        line = json.dumps(entry, default=str, ensure_ascii=False)
+        with self._lock:
+            dead_letter_file = self._file_of(now)
+            dead_letter_file.write(line + "\n")
+            # Complete lines for readers of the file
+            dead_letter_file.flush()
+            self.count += 1
+        logger.warning(f"Rejected {model.__name__} row of tweet {tweet_id}: {reasons}")
+
+
+class TweetValidator:
+    """Validate transformed tweets ({model: row or [rows]}) of all registered models"""
+
+    def __init__(self, dead_letter=None):
+        self.validators = {
+            model: ModelValidator(model, columns)
+            for model, columns in registry.columns.items()
+        }
+        self.dead_letter = dead_letter or DeadLetter()
+
+    def validate(self, data):
+        """Return the valid part of a transformed tweet, None if the tweet is dropped"""
+        tweet_id = data.get(Tweet, {}).get("id")
+        valid = {}
+        for model, rows in data.items():
+            validator = self.validators.get(model)
+            if validator is None:
+                valid[model] = rows
+            elif isinstance(rows, list):
+                valid[model] = []
+                for row in rows:
+                    errors = validator.errors(row)
+                    if errors:
+                        self.dead_letter.write(model, row, errors, "row", tweet_id)
+                    else:
+                        valid[model].append(row)
+            else:
+                errors = validator.errors(rows)
+                if errors:
+                    self.dead_letter.write(model, rows, errors, "tweet", tweet_id)
+                    return None
+                valid[model] = rows
+        return valid
+
+    def validate_batch(self, batch):
+        """Return the valid tweets of a batch"""
+        valid = []
+        for data in batch:
+            data = self.validate(data)
+            if data is not None:
+                valid.append(data)
+        return valid
+
+
+_validator = None
+_validator_lock = threading.Lock()
+
+
+def get_validator():
+    """Return the TweetValidator (compiled once per process)"""
+    global _validator
+    with _validator_lock:
+        if _validator is None:
+            _validator = TweetValidator()
+        return _validator